@@ -5,6 +5,23 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Запуск в режиме ASGI (один процесс обслуживает много одновременных
+запросов автодополнения прайса и пагинации транзакций):
+
+    pip install uvicorn
+    ASYNC_ENDPOINTS=True uvicorn config.asgi:application --workers 2
+
+или через gunicorn:
+
+    ASYNC_ENDPOINTS=True gunicorn config.asgi:application -k uvicorn.workers.UvicornWorker -w 2
+
+Читающие endpoints (api/price-item-data/ и admin/async/transactions/...)
+асинхронные: ORM вызывается через async-интерфейсы (aget и т.п.), а итоги
+и страница списка транзакций запрашиваются параллельно в отдельных потоках.
+Остальные (синхронные) представления админки Django выполняет в пуле потоков.
+Статику под ASGI раздает фронтенд-сервер (collectstatic + nginx).
+При нескольких воркерах используйте общий кэш (CACHE_BACKEND=file или redis).
 """
 
 import os
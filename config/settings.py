@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -53,8 +54,13 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'control.archive.ArchiveToggleMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'control.profiling.ProfilerMiddleware',
+    'control.metrics.MetricsMiddleware',
+    'control.tracing.TracingMiddleware',
+    'control.nplusone.NPlusOneMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -80,13 +86,73 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=sqlite (по умолчанию) или postgresql.
+# Для PostgreSQL нужен psycopg 3 (pip install "psycopg[binary,pool]").
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite').lower()
+
+if DB_ENGINE in ('postgresql', 'postgres'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'habirov'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Проверять постоянное соединение перед повторным использованием
+            'CONN_HEALTH_CHECKS': True,
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+        }
+    }
+    if os.environ.get('DB_POOL', 'False') == 'True':
+        # Пул соединений psycopg; с пулом постоянные соединения Django отключаются
+        from psycopg_pool import ConnectionPool
+
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+                'timeout': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+                # Проверка соединения при выдаче из пула
+                'check': ConnectionPool.check_connection,
+            },
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # IMMEDIATE - все транзакции сразу берут блокировку на запись
+                'transaction_mode': os.environ.get('SQLITE_TRANSACTION_MODE') or None,
+            },
+        }
     }
+
+# PRAGMA для каждого нового соединения SQLite (см. control.db.configure_sqlite_connection).
+# Пустое значение в .env отключает соответствующую настройку.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'),  # мс
+    'mmap_size': os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)),  # байт
+    'cache_size': os.environ.get('SQLITE_CACHE_SIZE', '-65536'),  # отрицательное - в КиБ
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
 }
 
+# Горячие копии SQLite (control/backup.py, python manage.py sqlite_backup):
+# каталог, страниц за шаг и пауза между шагами (сек), сколько последних копий
+# хранить всегда и через сколько дней удалять остальные. SQLITE_BACKUP_INTERVAL_HOURS > 0 -
+# воркер run_jobs сам ставит задачу копирования с этим интервалом.
+SQLITE_BACKUP_DIR = os.environ.get('SQLITE_BACKUP_DIR', str(BASE_DIR / 'backups' / 'sqlite'))
+SQLITE_BACKUP_PAGES = int(os.environ.get('SQLITE_BACKUP_PAGES', '256'))
+SQLITE_BACKUP_SLEEP = float(os.environ.get('SQLITE_BACKUP_SLEEP', '0.05'))
+SQLITE_BACKUP_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BACKUP_BUSY_TIMEOUT', '5'))
+SQLITE_BACKUP_KEEP = int(os.environ.get('SQLITE_BACKUP_KEEP', '7'))
+SQLITE_BACKUP_MAX_AGE_DAYS = int(os.environ.get('SQLITE_BACKUP_MAX_AGE_DAYS', '30'))
+SQLITE_BACKUP_INTERVAL_HOURS = float(os.environ.get('SQLITE_BACKUP_INTERVAL_HOURS', '0'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -141,3 +207,96 @@ CSRF_TRUSTED_ORIGINS = ['https://iphabirov.ru', 'http://iphabirov.ru']
 
 # Кастомная модель пользователя
 AUTH_USER_MODEL = 'control.CustomUser'
+
+# Экспорт смет: число потоков для параллельной генерации файлов в ZIP-архиве
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', '4'))
+
+# Профилировщик запросов (control/profiling.py): доля профилируемых запросов
+# (0 - выключен, 1 - все), размер кольцевого буфера и число медленных SQL в профиле.
+# Профили доступны сотрудникам на странице /admin/diagnostics/profiles/.
+PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', '0'))
+PROFILER_BUFFER_SIZE = int(os.environ.get('PROFILER_BUFFER_SIZE', '100'))
+PROFILER_SLOWEST_QUERIES = int(os.environ.get('PROFILER_SLOWEST_QUERIES', '5'))
+
+# Журнал медленных SQL (control/slowlog.py): порог в мс (0 - выключен),
+# файл JSON lines с ротацией и EXPLAIN при первом появлении формы запроса.
+# Сводка: python manage.py slow_queries_report
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '0'))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', str(BASE_DIR / 'logs' / 'slow_queries.jsonl'))
+SLOW_QUERY_LOG_MAX_BYTES = int(os.environ.get('SLOW_QUERY_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', '5'))
+SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'True') == 'True'
+
+# Метрики Prometheus (control/metrics.py) на /metrics. Доступ: заголовок
+# Authorization: Bearer <METRICS_TOKEN> (или ?token=) либо сессия сотрудника.
+# Воркеры gunicorn пишут метрики в общий локальный каталог METRICS_DIR.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'habirov_metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+
+# Трассировка (control/tracing.py): доля трассируемых запросов (0 - выключена),
+# файл OTLP/JSON с ротацией и предел числа спанов в одной трассе.
+# Самые медленные трассы: python manage.py traces_report
+TRACING_SAMPLE_RATE = float(os.environ.get('TRACING_SAMPLE_RATE', '0'))
+TRACING_FILE = os.environ.get('TRACING_FILE', str(BASE_DIR / 'logs' / 'traces.jsonl'))
+TRACING_FILE_MAX_BYTES = int(os.environ.get('TRACING_FILE_MAX_BYTES', str(20 * 1024 * 1024)))
+TRACING_FILE_BACKUPS = int(os.environ.get('TRACING_FILE_BACKUPS', '3'))
+TRACING_MAX_SPANS = int(os.environ.get('TRACING_MAX_SPANS', '2000'))
+TRACING_SERVICE_NAME = os.environ.get('TRACING_SERVICE_NAME', 'habirov')
+
+# Детектор N+1 запросов (control/nplusone.py): log - предупреждение в лог
+# control.nplusone, raise - ошибка NPlusOneError, off - выключен (по умолчанию
+# log при DEBUG). Порог - сколько одинаковых по форме запросов допустимо за
+# один HTTP-запрос; NPLUSONE_ALLOWLIST - подстроки формы запроса, атрибута
+# (Transaction.stage) или места вызова через запятую. По умолчанию исключен
+# виджет автодополнения админки: он загружает выбранное значение в каждой
+# строке инлайна, и из кода проекта это не исправить.
+NPLUSONE_MODE = os.environ.get('NPLUSONE_MODE', 'log' if DEBUG else 'off')
+NPLUSONE_THRESHOLD = int(os.environ.get('NPLUSONE_THRESHOLD', '5'))
+NPLUSONE_ALLOWLIST = [
+    item for item in os.environ.get('NPLUSONE_ALLOWLIST', 'AutocompleteMixin.optgroups').split(',') if item
+]
+
+# Архив транзакций (control/archive.py): показывать ли архивные транзакции
+# в списках и итогах по умолчанию (пользователь переключает это ссылкой
+# «Архив» в списке транзакций) и размер пачки переноса.
+# Перенос: python manage.py archive_transactions --finished-projects
+TRANSACTIONS_INCLUDE_ARCHIVE = os.environ.get('TRANSACTIONS_INCLUDE_ARCHIVE', 'True') == 'True'
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+
+# Копирование смет и объектов по шаблону (control/cloning.py):
+# размер пачки bulk_create этапов, смет и позиций.
+CLONE_BATCH_SIZE = int(os.environ.get('CLONE_BATCH_SIZE', '500'))
+
+# Массовая правка позиций смет (control/bulk_edit.py): размер пачки bulk_update.
+BULK_EDIT_BATCH_SIZE = int(os.environ.get('BULK_EDIT_BATCH_SIZE', '500'))
+
+# Импорт банковских выписок (control/bank_import.py): размер пачки bulk_create.
+# Импорт: python manage.py import_bank_statement выписка.txt --category Прочее
+BANK_IMPORT_BATCH_SIZE = int(os.environ.get('BANK_IMPORT_BATCH_SIZE', '1000'))
+
+# Async-представления для читающих AJAX-запросов (списки транзакций).
+# Включайте при запуске под ASGI (см. config/asgi.py): тогда страницы списков
+# запрашиваются у async-представления, и один процесс обслуживает много
+# одновременных запросов, не занимая поток на время ожидания БД.
+ASYNC_ENDPOINTS = os.environ.get('ASYNC_ENDPOINTS', 'False') == 'True'
+
+# Кэш результатов запросов (см. control/cache.py).
+# CACHE_BACKEND: locmem - в памяти процесса (один воркер), file - общий каталог,
+# redis - Redis-совместимый сервер (нужен пакет redis). Для нескольких воркеров
+# gunicorn используйте file или redis, чтобы версии моделей были общими.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+_CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'habirov'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+}
+CACHES = {
+    'default': {
+        'BACKEND': _CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': os.environ.get('CACHE_LOCATION', _CACHE_BACKENDS[CACHE_BACKEND][1]),
+        'TIMEOUT': int(os.environ.get('CACHE_TIMEOUT', '3600')),
+        'KEY_PREFIX': 'habirov',
+    }
+}
@@ -16,8 +16,50 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from control import views as control_views
 
 urlpatterns = [
+    path(
+        'admin/diagnostics/sqlite/',
+        admin.site.admin_view(control_views.sqlite_diagnostics_view),
+        name='control_sqlite_diagnostics',
+    ),
+    path(
+        'admin/archive/toggle/',
+        admin.site.admin_view(control_views.archive_toggle_view),
+        name='control_archive_toggle',
+    ),
+    path(
+        'admin/reports/periods/',
+        admin.site.admin_view(control_views.periods_view),
+        name='control_periods',
+    ),
+    path(
+        'admin/reports/pnl/',
+        admin.site.admin_view(control_views.pnl_view),
+        name='control_pnl',
+    ),
+    path(
+        'admin/reports/cash-flow/',
+        admin.site.admin_view(control_views.cash_flow_view),
+        name='control_cash_flow',
+    ),
+    path(
+        'admin/diagnostics/profiles/',
+        admin.site.admin_view(control_views.profiles_view),
+        name='control_profiles',
+    ),
+    path(
+        'admin/diagnostics/profiles/<int:profile_id>/',
+        admin.site.admin_view(control_views.profile_detail_view),
+        name='control_profile_detail',
+    ),
+    path(
+        'admin/async/transactions/<str:scope>/<int:pk>/',
+        control_views.transactions_list_async_view,
+        name='control_transactions_list_async',
+    ),
     path('admin/', admin.site.urls),
+    path('metrics', control_views.metrics_view, name='control_metrics'),
     path('api/', include('control.urls')),
 ]
@@ -18,19 +18,58 @@ class CategoryAutocompleteFilter(AutocompleteFilter):
     title = 'Категория'
     field_name = 'category'
 
+class DebtStateFilter(admin.SimpleListFilter):
+    """Состояние долга контрагента (по индексам receivable/payable)"""
+    title = 'Долг'
+    parameter_name = 'debt'
+
+    def lookups(self, request, model_admin):
+        return [
+            ('all', 'Все'),
+            ('outstanding', 'Не погашен'),
+            ('receivable', 'Должен нам'),
+            ('payable', 'Мы должны'),
+            ('settled', 'Погашен'),
+        ]
+
+    def value(self):
+        # По умолчанию - только непогашенные долги; 'all' - без отбора
+        return super().value() or 'outstanding'
+
+    def choices(self, changelist):
+        # Встроенный пункт «Все» убирает параметр, то есть возвращает к умолчанию - его заменяет 'all'
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': self.value() == lookup,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        if self.value() == 'outstanding':
+            return queryset.filter(~Q(receivable=0) | ~Q(payable=0))
+        if self.value() == 'receivable':
+            return queryset.filter(receivable__gt=0)
+        if self.value() == 'payable':
+            return queryset.filter(payable__gt=0)
+        if self.value() == 'settled':
+            return queryset.filter(receivable=0, payable=0)
+        return queryset
+
 # ContractorAutocompleteFilter удален - теперь используем CustomUser
 DropdownFilter = ChoiceDropdownFilter = RelatedDropdownFilter = None
 from django.contrib.auth.admin import UserAdmin
 from django import forms
+from . import metrics
+from .tracing import traced
 from .models import (
-    CustomUser, Project, Object, Stage, Estimate, EstimateItem,
+    CustomUser, Project, Object, Stage, Estimate, EstimateItem, EstimateSnapshot,
     WorkType, MaterialType, PriceItem,
-    Category, Transaction
+    Category, ImportRule, Transaction, ArchivedTransaction, ClosedPeriod, DebtPosition, BackgroundJob
 )
 from .utils import (
     get_transactions_for_estimate_item, get_transactions_for_estimate,
-    get_transactions_for_stage, get_transactions_for_object, 
-    get_transactions_for_project, render_transactions_table
+    render_transactions_table
 )
 
 
@@ -100,6 +139,63 @@ class EstimateItemForm(forms.ModelForm):
         }
 
 
+def _transactions_list_url(scope, obj, url_name):
+    """URL AJAX-пагинации списка: async-представление при ASYNC_ENDPOINTS, иначе view админки"""
+    from django.conf import settings
+    from django.urls import reverse
+    if settings.ASYNC_ENDPOINTS:
+        return reverse('control_transactions_list_async', args=[scope, obj.pk])
+    return reverse(url_name, args=[obj.pk])
+
+
+@traced()
+def _render_transactions_panel(scope, obj, url_name, container_id='tx-list'):
+    """Первая страница списка транзакций узла для readonly-поля карточки"""
+    from django.utils.html import format_html
+    from django.template.loader import render_to_string
+    from .utils import get_transactions_list_context
+    context = get_transactions_list_context(scope, obj, _transactions_list_url(scope, obj, url_name))
+    if scope == 'estimate':
+        context['estimate'] = obj
+    html_inner = render_to_string('admin/control/estimate/transactions_list.html', context)
+    # Оборачиваем в контейнер, чтобы AJAX-страницы могли заменяться внутри
+    return format_html('<div id="{}">{}</div>', container_id, html_inner)
+
+
+@traced()
+def _transactions_list_response(request, scope, obj, url_name):
+    """Страница списка транзакций узла (AJAX-пагинация)"""
+    from django.shortcuts import render
+    from .utils import get_per_page, get_transactions_list_context
+    context = get_transactions_list_context(
+        scope, obj, _transactions_list_url(scope, obj, url_name),
+        page=request.GET.get('page') or 1,
+        per_page=get_per_page(request),
+    )
+    if scope == 'estimate':
+        context['estimate'] = obj
+    return render(request, 'admin/control/estimate/transactions_list.html', context)
+
+
+def _enqueue_job_response(request, kind, params):
+    """Поставить фоновую задачу и перейти на страницу ее прогресса"""
+    from django.contrib import messages
+    from django.core.exceptions import PermissionDenied
+    from django.shortcuts import redirect
+    from django.urls import reverse
+    from .jobs import can_enqueue, enqueue, get_job_label
+    if not can_enqueue(request.user, kind):
+        raise PermissionDenied
+    job = enqueue(kind, params, user=request.user)
+    messages.info(request, f'Задача «{get_job_label(kind)}» #{job.pk} поставлена в очередь.')
+    return redirect(reverse('admin:control_backgroundjob_change', args=[job.pk]))
+
+
+def _job_form_data(request):
+    """Данные формы для параметров задачи - без CSRF-токена"""
+    return {key: value for key, value in request.POST.dict().items() if key != 'csrfmiddlewaretoken'}
+
+
 class CustomUserAdmin(UserAdmin):
     """Админка для кастомной модели пользователя"""
     model = CustomUser
@@ -113,7 +209,7 @@ class CustomUserAdmin(UserAdmin):
         ('Личная информация', {'fields': ('first_name', 'last_name', 'ext_id')}),
         ('Разрешения', {'fields': ('is_active', 'is_staff', 'is_superuser', 'groups', 'user_permissions')}),
         ('Важные даты', {'fields': ('last_login', 'date_joined')}),
-        ('Дополнительно', {'fields': ('auth_token',)}),
+        ('Дополнительно', {'fields': ('auth_token', 'get_statement_link')}),
     )
     
     add_fieldsets = (
@@ -123,7 +219,101 @@ class CustomUserAdmin(UserAdmin):
         }),
     )
     
-    readonly_fields = ['date_joined', 'last_login']
+    readonly_fields = ['date_joined', 'last_login', 'get_statement_link']
+    
+    def get_urls(self):
+        from django.urls import path
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                '<int:user_id>/statement/',
+                self.admin_site.admin_view(self.statement_view),
+                name='control_customuser_statement',
+            ),
+            path(
+                '<int:user_id>/statement/export/',
+                self.admin_site.admin_view(self.statement_export_view),
+                name='control_customuser_statement_export',
+            ),
+        ]
+        return custom_urls + urls
+    
+    def get_statement_link(self, obj):
+        from django.urls import reverse
+        from django.utils.html import format_html
+        if not obj or not obj.pk:
+            return '—'
+        return format_html(
+            '<a href="{}">Открыть акт сверки</a>', reverse('admin:control_customuser_statement', args=[obj.pk])
+        )
+    
+    get_statement_link.short_description = 'Акт сверки'
+    
+    def _statement_params(self, request, user_id):
+        """Контрагент и период акта из GET (date_from, date_to в формате ГГГГ-ММ-ДД)"""
+        from django.shortcuts import get_object_or_404
+        from django.utils.dateparse import parse_date
+        contractor = get_object_or_404(CustomUser, pk=user_id)
+        try:
+            date_from = parse_date(request.GET.get('date_from') or '')
+            date_to = parse_date(request.GET.get('date_to') or '')
+        except ValueError:
+            date_from = date_to = None
+        return contractor, date_from, date_to
+    
+    @traced()
+    def statement_view(self, request, user_id):
+        """Акт сверки: движения с остатком нарастающим итогом, страницы по ключу"""
+        from django.http import HttpResponseBadRequest
+        from django.shortcuts import render
+        from django.utils.http import urlencode
+        from .statements import statement_page, statement_totals
+        contractor, date_from, date_to = self._statement_params(request, user_id)
+        try:
+            page = statement_page(contractor, date_from, date_to, cursor=request.GET.get('cursor'))
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        period_query = {
+            key: value.isoformat() for key, value in (('date_from', date_from), ('date_to', date_to)) if value
+        }
+        return render(request, 'admin/control/customuser/statement.html', {
+            **self.admin_site.each_context(request),
+            'title': f'Акт сверки: {contractor}',
+            'contractor': contractor,
+            'opts': self.model._meta,
+            'date_from': date_from,
+            'date_to': date_to,
+            'page': page,
+            'totals': statement_totals(contractor, date_from, date_to),
+            'is_first_page': not request.GET.get('cursor'),
+            'period_query': urlencode(period_query),
+            'next_query': urlencode({**period_query, 'cursor': page['next_cursor']}) if page['next_cursor'] else '',
+        })
+    
+    @traced()
+    def statement_export_view(self, request, user_id):
+        """Выгрузка акта целиком: ?format=csv (поток) или xlsx"""
+        import tempfile
+        from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+        from .exports import XLSX_CONTENT_TYPE, xlsx_available
+        from .statements import iter_statement_csv, write_statement_xlsx
+        contractor, date_from, date_to = self._statement_params(request, user_id)
+        export_format = request.GET.get('format', 'csv')
+        filename = f'statement_{contractor.pk}'
+        if export_format == 'xlsx':
+            if not xlsx_available():
+                return HttpResponse('xlsxwriter не установлен', status=500)
+            fh = tempfile.TemporaryFile()
+            write_statement_xlsx(fh, contractor, date_from, date_to)
+            fh.seek(0)
+            metrics.inc('statement_exports_total', format='xlsx')
+            return FileResponse(fh, as_attachment=True, filename=f'{filename}.xlsx', content_type=XLSX_CONTENT_TYPE)
+        metrics.inc('statement_exports_total', format='csv')
+        response = StreamingHttpResponse(
+            iter_statement_csv(contractor, date_from, date_to), content_type='text/csv; charset=utf-8',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+        return response
 
 
 class EstimateItemInline(admin.TabularInline):
@@ -141,6 +331,10 @@ class EstimateItemInline(admin.TabularInline):
         'get_create_transaction_button'
     ]
     autocomplete_fields = ['price_item']
+
+    def get_queryset(self, request):
+        # Заголовок строки инлайна - str(позиция): смета, этап и позиция прайса
+        return super().get_queryset(request).select_related('estimate__stage', 'price_item')
     
     class Media:
         js = (
@@ -179,6 +373,9 @@ class TransactionInline(admin.TabularInline):
         'amount', 'description', 'get_estimate_info'
     ]
     readonly_fields = ['get_signed_amount', 'get_estimate_info']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('estimate__stage')
     
     def get_signed_amount(self, obj):
         """Получить сумму со знаком"""
@@ -205,11 +402,51 @@ class EstimateAdmin(admin.ModelAdmin):
     search_fields = ['stage__name', 'stage__object__name']
     readonly_fields = [
         'get_create_transactions_button', 'get_client_total', 'get_contractor_total', 'get_income_total', 
-        'get_base_total', 'created_at', 'updated_at', 'get_all_transactions'
+        'get_base_total', 'created_at', 'updated_at', 'get_all_transactions', 'get_snapshot_info', 'get_clone_button'
     ]
     inlines = [EstimateItemInline, TransactionInline]
     autocomplete_fields = ['stage']
     change_form_template = 'admin/control/estimate/change_form.html'
+    actions = ['recalculate_estimates_background', 'clone_estimates', 'clone_estimates_repriced']
+    list_select_related = ['stage__object']
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        match = getattr(request, 'resolver_match', None)
+        if match and match.url_name == 'control_estimate_changelist':
+            # Суммы для колонок списка - в том же запросе
+            queryset = queryset.with_totals()
+        return queryset
+    
+    def recalculate_estimates_background(self, request, queryset):
+        """Действие: пересчет сумм позиций выбранных смет фоновой задачей"""
+        return _enqueue_job_response(request, 'recalculate_estimates', {
+            'estimate_ids': list(queryset.values_list('pk', flat=True)),
+        })
+    
+    recalculate_estimates_background.short_description = 'Пересчитать суммы позиций (в фоне)'
+    
+    def _clone_selected(self, request, queryset, reprice):
+        from .cloning import clone_estimate
+        items = 0
+        for estimate in queryset.select_related('stage'):
+            _copy, count = clone_estimate(estimate, reprice=reprice)
+            items += count
+        self.message_user(request, f'Скопировано смет: {len(queryset)}, позиций: {items}. Копии - черновики в тех же этапах.')
+    
+    def clone_estimates(self, request, queryset):
+        """Действие: копии выбранных смет в тех же этапах"""
+        self._clone_selected(request, queryset, reprice=False)
+    
+    clone_estimates.short_description = 'Копировать сметы'
+    clone_estimates.allowed_permissions = ('add',)
+    
+    def clone_estimates_repriced(self, request, queryset):
+        """Действие: копии выбранных смет с ценами из текущего прайса"""
+        self._clone_selected(request, queryset, reprice=True)
+    
+    clone_estimates_repriced.short_description = 'Копировать сметы по текущим ценам прайса'
+    clone_estimates_repriced.allowed_permissions = ('add',)
     
     def get_urls(self):
         from django.urls import path
@@ -240,12 +477,17 @@ class EstimateAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(self.export_xlsx_view),
                 name='control_estimate_export_xlsx',
             ),
+            path(
+                '<int:estimate_id>/clone/',
+                self.admin_site.admin_view(self.clone_view),
+                name='control_estimate_clone',
+            ),
         ]
         return custom_urls + urls
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('stage', 'status')
+            'fields': ('stage', 'status', 'get_snapshot_info', 'get_clone_button')
         }),
         ('Суммы по смете', {
             'fields': ('get_client_total', 'get_contractor_total', 'get_income_total', 'get_base_total'),
@@ -261,61 +503,52 @@ class EstimateAdmin(admin.ModelAdmin):
         }),
     )
     
+    @traced()
     def get_client_total(self, obj):
         """Сумма для заказчика"""
         return f"{obj.get_client_total():,.2f} руб."
     get_client_total.short_description = 'Сумма для заказчика'
     
+    @traced()
     def get_contractor_total(self, obj):
         """Сумма для исполнителя"""
         return f"{obj.get_contractor_total():,.2f} руб."
     get_contractor_total.short_description = 'Сумма для исполнителя'
     
+    @traced()
     def get_income_total(self, obj):
         """Доход по смете"""
         return f"{obj.get_income_total():,.2f} руб."
     get_income_total.short_description = 'Доход по смете'
     
+    @traced()
     def get_base_total(self, obj):
         """Базовая сумма"""
         return f"{obj.get_base_total():,.2f} руб."
     get_base_total.short_description = 'Базовая сумма'
     
+    def get_snapshot_info(self, obj):
+        """Текущая ревизия снимка утвержденной сметы"""
+        from django.urls import reverse
+        from django.utils.html import format_html
+        if not obj or not obj.current_snapshot_id:
+            return 'Нет (снимок создается при утверждении)'
+        snapshot = obj.current_snapshot
+        return format_html(
+            'Ред. {} от {} · <a href="{}?estimate__id__exact={}">все ревизии</a>',
+            snapshot.revision, snapshot.created_at.strftime('%d.%m.%Y %H:%M'),
+            reverse('admin:control_estimatesnapshot_changelist'), obj.pk,
+        )
+    get_snapshot_info.short_description = 'Снимок'
+    
+    @traced()
     def get_all_transactions(self, obj):
         """Показать все транзакции сметы"""
         if not obj.pk:
             return 'Сохраните смету для просмотра транзакций'
-        from django.utils.html import format_html
-        from django.template.loader import render_to_string
-        from .models import Transaction
-        from django.core.paginator import Paginator
-        
-        qs = Transaction.objects.filter(estimate=obj).select_related('category', 'contractor')\
-            .order_by('-date', '-id')
-        paginator = Paginator(qs, 15)
-        page_obj = paginator.get_page(1)
-        all_total_income = sum(t.amount for t in qs.filter(transaction_type='income'))
-        all_total_expense = sum(t.amount for t in qs.filter(transaction_type='expense'))
-        all_total_net = all_total_income - all_total_expense
-        
-        from django.urls import reverse
-        base_url = reverse('admin:control_estimate_transactions_list', args=[obj.pk])
-        per_page = 20
-        html_inner = render_to_string(
-            'admin/control/estimate/transactions_list.html',
-            {
-                'estimate': obj,
-                'page_obj': page_obj,
-                'paginator': paginator,
-                'per_page': per_page,
-                'base_url': base_url,
-                'all_total_income': all_total_income,
-                'all_total_expense': all_total_expense,
-                'all_total_net': all_total_net,
-            }
+        return _render_transactions_panel(
+            'estimate', obj, 'admin:control_estimate_transactions_list', container_id='estimate-tx-list'
         )
-        # Оборачиваем в контейнер, чтобы будущие AJAX-страницы могли заменяться внутри
-        return format_html('<div id="estimate-tx-list">{}</div>', html_inner)
     
     get_all_transactions.short_description = 'Все транзакции сметы'
     
@@ -335,6 +568,50 @@ class EstimateAdmin(admin.ModelAdmin):
     
     get_create_transactions_button.short_description = 'Создание транзакций'
     
+    def get_clone_button(self, obj):
+        """Ссылка на копирование сметы"""
+        if not obj or not obj.pk:
+            return '—'
+        from django.utils.html import format_html
+        from django.urls import reverse
+        return format_html(
+            '<a href="{}" class="button" style="padding: 5px 10px; text-decoration: none;">📋 Копировать смету</a>',
+            reverse('admin:control_estimate_clone', args=[obj.pk]),
+        )
+    
+    get_clone_button.short_description = 'Копирование'
+    
+    @traced()
+    def clone_view(self, request, estimate_id):
+        """Копия сметы с позициями в выбранный этап, по ценам сметы или текущего прайса"""
+        import time
+        from django.contrib import messages
+        from django.core.exceptions import PermissionDenied
+        from django.shortcuts import get_object_or_404, redirect, render
+        from django.urls import reverse
+        from .cloning import clone_estimate
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        estimate = get_object_or_404(Estimate.objects.select_related('stage__object__project'), pk=estimate_id)
+        stages = Stage.objects.select_related('object__project').order_by('object__project__name', 'object__name', 'order')
+        if request.method == 'POST':
+            stage = get_object_or_404(Stage, pk=request.POST.get('stage') or estimate.stage_id)
+            started = time.monotonic()
+            copy, count = clone_estimate(estimate, stage, reprice=bool(request.POST.get('reprice')))
+            messages.success(
+                request, f'Смета скопирована: позиций {count} за {time.monotonic() - started:.2f} с. Копия - черновик.'
+            )
+            return redirect(reverse('admin:control_estimate_change', args=[copy.pk]))
+        return render(request, 'admin/control/estimate/clone.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Копирование сметы',
+            'opts': self.model._meta,
+            'estimate': estimate,
+            'stages': stages,
+            'items_count': estimate.items.count(),
+        })
+    
+    @traced()
     def create_transactions_view(self, request, estimate_id):
         """View для создания транзакций по смете"""
         from django.shortcuts import render, redirect, get_object_or_404
@@ -343,7 +620,10 @@ class EstimateAdmin(admin.ModelAdmin):
         from .models import Estimate, Transaction, Category
         from django.urls import reverse
         
-        estimate = get_object_or_404(Estimate, pk=estimate_id)
+        # Утвержденная смета со снимком - одним запросом
+        estimate = get_object_or_404(
+            Estimate.objects.select_related('stage__object__project', 'current_snapshot'), pk=estimate_id,
+        )
         
         if request.method == 'POST':
             # Обработка создания транзакций
@@ -352,25 +632,19 @@ class EstimateAdmin(admin.ModelAdmin):
         # GET запрос - показываем форму подтверждения
         return self._show_confirmation_form(request, estimate)
     
+    @traced()
     def _show_confirmation_form(self, request, estimate):
         """Показать форму подтверждения с редактируемыми полями"""
         from django.shortcuts import render
-        from .models import Category
-        
-        # Получаем все элементы сметы
-        items = estimate.items.all()
+        from .snapshots import estimate_lines
+        from .utils import get_transaction_form_options
         
-        # Получаем категории и контрагентов для выбора
-        categories = Category.objects.filter(is_active=True)
-        contractors = CustomUser.objects.filter(is_active=True)
+        # Строки сметы: из снимка утвержденной сметы или из позиций с пересчитанными суммами
+        items = estimate_lines(estimate)
         
         # Подготавливаем данные для каждого элемента
         items_data = []
         for item in items:
-            # Пересчитываем суммы, если они не актуальны
-            item._calculate_amounts()
-            
-
             item_data = {
                 'item': item,
                 'expense_amount': f"{float(item.contractor_price):.2f}",  # Сумма расхода (для исполнителя) с точкой
@@ -383,56 +657,21 @@ class EstimateAdmin(admin.ModelAdmin):
         context = {
             'estimate': estimate,
             'items_data': items_data,
-            'categories': categories,
-            'contractors': contractors,
+            # Списки категорий и контрагентов выводятся на страницу один раз
+            'options': get_transaction_form_options(),
             'opts': self.model._meta,
             'has_view_permission': True,
         }
         
         return render(request, 'admin/control/estimate/create_transactions.html', context)
 
+    @traced()
     def transactions_list_view(self, request, estimate_id):
         """Серверный список транзакций сметы с пагинацией (для AJAX-встраивания)."""
-        from django.shortcuts import render, get_object_or_404
-        from django.core.paginator import Paginator
-        from .models import Estimate, Transaction
-        
+        from django.shortcuts import get_object_or_404
+        from .models import Estimate
         estimate = get_object_or_404(Estimate, pk=estimate_id)
-        qs = Transaction.objects.filter(estimate=estimate).select_related('category', 'contractor')\
-            .order_by('-date', '-id')
-        
-        # размер страницы
-        try:
-            per_page = int(request.GET.get('per_page', 20))
-        except Exception:
-            per_page = 20
-        # Ограничим разумными пределами
-        if per_page < 5:
-            per_page = 5
-        if per_page > 500:
-            per_page = 500
-        page_number = request.GET.get('page') or 1
-        paginator = Paginator(qs, per_page)
-        page_obj = paginator.get_page(page_number)
-        
-        # Итоги по всем результатам (по смете)
-        all_total_income = sum(t.amount for t in qs.filter(transaction_type='income'))
-        all_total_expense = sum(t.amount for t in qs.filter(transaction_type='expense'))
-        all_total_net = all_total_income - all_total_expense
-        
-        from django.urls import reverse
-        base_url = reverse('admin:control_estimate_transactions_list', args=[estimate.pk])
-        context = {
-            'estimate': estimate,
-            'page_obj': page_obj,
-            'paginator': paginator,
-            'per_page': per_page,
-            'base_url': base_url,
-            'all_total_income': all_total_income,
-            'all_total_expense': all_total_expense,
-            'all_total_net': all_total_net,
-        }
-        return render(request, 'admin/control/estimate/transactions_list.html', context)
+        return _transactions_list_response(request, 'estimate', estimate, 'admin:control_estimate_transactions_list')
 
     def export_view(self, request, estimate_id):
         """Промежуточная страница выбора формата и аудитории, с редактируемым списком позиций."""
@@ -445,169 +684,58 @@ class EstimateAdmin(admin.ModelAdmin):
             'audience': audience,
         })
 
+    @traced()
     def export_preview_view(self, request, estimate_id):
         """HTML предпросмотр для печати (PDF через печать браузера)."""
         from django.shortcuts import render, get_object_or_404
-        from .models import Estimate
-        estimate = get_object_or_404(Estimate, pk=estimate_id)
+        from .exports import estimate_for_export, build_preview_context
+        estimate = get_object_or_404(estimate_for_export(), pk=estimate_id)
         audience = request.GET.get('audience', 'client')
-        # Рассчитываем данные по каждой позиции под выбранную аудиторию
-        materials_data, works_data = [], []
-        total_materials, total_works = 0.0, 0.0
-        for item in estimate.items.select_related('price_item').all():
-            item._calculate_amounts()
-            quantity = float(item.quantity)
-            unit = item.get_unit()
-            if audience == 'self' or audience == 'contractor':
-                total = float(item.contractor_price)
-            else:  # client
-                total = float(item.client_price)
-            unit_price = float(total / quantity) if quantity else float(item.unit_price)
-            record = {
-                'name': item.get_item_name(),
-                'unit': unit,
-                'quantity': quantity,
-                'unit_price': unit_price,
-                'unit_price_str': f"{unit_price:.2f}",
-                'total': total,
-                'total_str': f"{total:.2f}",
-            }
-            # Группируем по типу price_item (материал/работа)
-            price_item = getattr(item, 'price_item', None)
-            if price_item and getattr(price_item, 'material_id', None):
-                materials_data.append(record)
-                total_materials += total
-            else:
-                works_data.append(record)
-                total_works += total
-        overall_total = total_materials + total_works
-        return render(request, 'admin/control/estimate/export/preview.html', {
-            'estimate': estimate,
-            'audience': audience,
-            'materials_data': materials_data,
-            'works_data': works_data,
-            'total_materials': total_materials,
-            'total_works': total_works,
-            'overall_total': overall_total,
-            'total_materials_str': f"{total_materials:.2f}",
-            'total_works_str': f"{total_works:.2f}",
-            'overall_total_str': f"{overall_total:.2f}",
-        })
+        metrics.inc('estimate_exports_total', audience=audience, format='html')
+        return render(request, 'admin/control/estimate/export/preview.html',
+                      build_preview_context(estimate, audience))
 
+    @traced()
     def export_xlsx_view(self, request, estimate_id):
         """Выгрузка Excel с учетом выбора аудитории и корректировок."""
         from django.shortcuts import get_object_or_404
         from django.http import HttpResponse
-        from .models import Estimate
-        import io
-        try:
-            import xlsxwriter
-        except Exception:
+        from .exports import estimate_for_export, render_estimate_xlsx, xlsx_available, XLSX_CONTENT_TYPE
+        if not xlsx_available():
             return HttpResponse('xlsxwriter не установлен', status=500)
-        estimate = get_object_or_404(Estimate, pk=estimate_id)
         audience = request.GET.get('audience', 'client')
-        output = io.BytesIO()
-        wb = xlsxwriter.Workbook(output, {'in_memory': True})
-        ws = wb.add_worksheet('Смета')
-        headers = ['Наименование', 'Ед.', 'Кол-во', 'Цена', 'Сумма']
-        for c, h in enumerate(headers):
-            ws.write(0, c, h)
-        row = 1
-        for item in estimate.items.all():
-            name = item.get_item_name()
-            unit = item.get_unit()
-            qty = float(item.quantity)
-            # цена по аудитории
-            if audience == 'self':
-                price = float(item.contractor_price / item.quantity) if item.quantity else float(item.unit_price)
-            elif audience == 'contractor':
-                price = float(item.contractor_price / item.quantity) if item.quantity else float(item.unit_price)
-            else:
-                price = float(item.client_price / item.quantity) if item.quantity else float(item.unit_price)
-            total = qty * price
-            ws.write(row, 0, name)
-            ws.write(row, 1, unit or '')
-            ws.write(row, 2, qty)
-            ws.write(row, 3, price)
-            ws.write(row, 4, total)
-            row += 1
-        wb.close()
-        output.seek(0)
-        resp = HttpResponse(output.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        if request.GET.get('background'):
+            return _enqueue_job_response(request, 'export_estimate_xlsx', {
+                'estimate_id': int(estimate_id), 'audience': audience,
+            })
+        estimate = get_object_or_404(estimate_for_export(), pk=estimate_id)
+        metrics.inc('estimate_exports_total', audience=audience, format='xlsx')
+        resp = HttpResponse(render_estimate_xlsx(estimate, audience), content_type=XLSX_CONTENT_TYPE)
         resp['Content-Disposition'] = f'attachment; filename="estimate_{estimate_id}.xlsx"'
         return resp
     
+    @traced()
     def _process_transaction_creation(self, request, estimate):
         """Обработать создание транзакций"""
         from django.shortcuts import redirect
         from django.contrib import messages
         from django.urls import reverse
-        from .models import Transaction
-        from django.db import transaction
+        from .db import immediate_atomic
+        from .snapshots import estimate_lines
+        from .utils import create_wizard_transactions
+        
+        items = estimate_lines(estimate)
+        if request.POST.get('run_in_background'):
+            return _enqueue_job_response(request, 'create_transactions', {
+                'item_ids': [item.id for item in items],
+                'data': _job_form_data(request),
+            })
         
         try:
-            with transaction.atomic():
-                created_count = 0
-                
-                # Проходим по всем элементам сметы
-                for item in estimate.items.all():
-                    # Проверяем, включена ли позиция
-                    include_item = request.POST.get(f'include_item_{item.id}')
-                    if not include_item:
-                        continue
-                    
-                    # Получаем данные из формы
-                    include_expense = request.POST.get(f'include_expense_{item.id}')
-                    include_income = request.POST.get(f'include_income_{item.id}')
-                    
-                    if include_expense:
-                        expense_amount = request.POST.get(f'expense_amount_{item.id}')
-                        expense_category_id = request.POST.get(f'expense_category_{item.id}')
-                        expense_contractor_id = request.POST.get(f'expense_contractor_{item.id}')
-                        
-                        if expense_amount and expense_category_id:
-                            # Создаем транзакцию расхода
-                            Transaction.objects.create(
-                                amount=expense_amount,
-                                transaction_type='expense',
-                                category_id=expense_category_id,
-                                contractor_id=expense_contractor_id if expense_contractor_id else None,
-                                description=f'Расход по смете: {item.get_item_name()}',
-                                estimate=estimate,
-                                estimate_item=item,
-                            )
-                            created_count += 1
-                    
-                    if include_income:
-                        income_amount = request.POST.get(f'income_amount_{item.id}')
-                        income_category_id = request.POST.get(f'income_category_{item.id}')
-                        income_contractor_id = request.POST.get(f'income_contractor_{item.id}')
-                        
-                        if income_amount and income_category_id:
-                            # Формируем описание дохода
-                            if item.income_type:
-                                description = f'Расход по смете (наценка/откат): {item.get_item_name()} ({item.get_income_display()})'
-                            else:
-                                # Дополнительный расход (раньше доход)
-                                income_description = request.POST.get(f'income_description_{item.id}', '').strip()
-                                if income_description:
-                                    description = f'Дополнительный расход по смете: {item.get_item_name()} - {income_description}'
-                                else:
-                                    description = f'Дополнительный расход по смете: {item.get_item_name()}'
-                            
-                            # Создаем как расход (наценки/откаты тоже расходы бюджета)
-                            Transaction.objects.create(
-                                amount=income_amount,
-                                transaction_type='expense',
-                                category_id=income_category_id,
-                                contractor_id=income_contractor_id if income_contractor_id else None,
-                                description=description,
-                                estimate=estimate,
-                                estimate_item=item,
-                            )
-                            created_count += 1
-                
+            with immediate_atomic():
+                created_count = create_wizard_transactions(items, request.POST)
                 messages.success(request, f'Успешно создано {created_count} транзакций по смете.')
+            metrics.inc('wizard_transactions_created_total', created_count, source='estimate')
                 
         except Exception as e:
             messages.error(request, f'Ошибка при создании транзакций: {str(e)}')
@@ -624,6 +752,7 @@ class EstimateItemAdmin(admin.ModelAdmin):
         'is_percentage', 'income_amount', 'client_price', 'contractor_price'
     ]
     list_filter = ('income_type', 'is_percentage', EstimateAutocompleteFilter, 'created_at')
+    list_select_related = ['estimate__stage', 'price_item']
     search_fields = [
         'price_item__name', 'description',
         'estimate__stage__name'
@@ -633,7 +762,7 @@ class EstimateItemAdmin(admin.ModelAdmin):
         'created_at', 'updated_at', 'get_transactions'
     ]
     autocomplete_fields = ['estimate', 'price_item']
-    actions = ['create_transactions_for_selected']
+    actions = ['create_transactions_for_selected', 'bulk_edit_selected', 'reset_unit_price_selected']
     change_form_template = 'admin/control/estimateitem/change_form.html'
     
     def get_urls(self):
@@ -655,9 +784,107 @@ class EstimateItemAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(self.transactions_list_view),
                 name='control_estimateitem_transactions_list',
             ),
+            path(
+                'bulk-edit/',
+                self.admin_site.admin_view(self.bulk_edit_view),
+                name='control_estimateitem_bulk_edit',
+            ),
+            path(
+                'bulk-edit/api/',
+                self.admin_site.admin_view(self.bulk_edit_api_view),
+                name='control_estimateitem_bulk_edit_api',
+            ),
         ]
         return custom_urls + urls
     
+    def bulk_edit_selected(self, request, queryset):
+        """Действие: форма массовой правки выбранных позиций"""
+        from django.shortcuts import redirect
+        from django.urls import reverse
+        request.session['bulk_edit_estimate_items'] = list(queryset.values_list('id', flat=True))
+        return redirect(reverse('admin:control_estimateitem_bulk_edit'))
+    
+    bulk_edit_selected.short_description = 'Массовая правка выбранных позиций'
+    bulk_edit_selected.allowed_permissions = ('change',)
+    
+    def reset_unit_price_selected(self, request, queryset):
+        """Действие: цены выбранных позиций из текущего прайса"""
+        from .bulk_edit import bulk_edit_items
+        result = bulk_edit_items(queryset, {'reset_unit_price': True})
+        metrics.inc('estimate_items_bulk_edited_total', result['items'], source='admin')
+        self.message_user(request, f'Цены из прайса: позиций {result["items"]}, смет {len(result["totals"])}.')
+    
+    reset_unit_price_selected.short_description = 'Цена из текущего прайса'
+    reset_unit_price_selected.allowed_permissions = ('change',)
+    
+    @traced()
+    def bulk_edit_view(self, request):
+        """Форма массовой правки: доход, количество, цена из прайса - одним bulk_update"""
+        from django.contrib import messages
+        from django.core.exceptions import PermissionDenied
+        from django.shortcuts import redirect, render
+        from django.urls import reverse
+        from .bulk_edit import BULK_EDIT_OPERATIONS, bulk_edit_items
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        selected_ids = request.session.get('bulk_edit_estimate_items', [])
+        if not selected_ids:
+            messages.error(request, 'Нет выбранных позиций для правки.')
+            return redirect(reverse('admin:control_estimateitem_changelist'))
+        queryset = EstimateItem.objects.filter(id__in=selected_ids)
+        if request.method == 'POST':
+            operations = {key: request.POST.get(key) for key in BULK_EDIT_OPERATIONS}
+            try:
+                result = bulk_edit_items(queryset, operations)
+            except ValueError as e:
+                messages.error(request, str(e))
+            else:
+                request.session.pop('bulk_edit_estimate_items', None)
+                metrics.inc('estimate_items_bulk_edited_total', result['items'], source='admin')
+                messages.success(request, f'Изменено позиций: {result["items"]}, смет: {len(result["totals"])}.')
+                return redirect(reverse('admin:control_estimateitem_changelist'))
+        return render(request, 'admin/control/estimateitem/bulk_edit.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Массовая правка позиций',
+            'opts': self.model._meta,
+            'items_count': queryset.count(),
+            'estimates_count': queryset.values('estimate_id').distinct().count(),
+            'income_type_choices': [
+                ('none' if value == '' else value, label) for value, label in EstimateItem.INCOME_TYPE_CHOICES
+            ],
+            'form_data': request.POST,
+        })
+    
+    @traced()
+    def bulk_edit_api_view(self, request):
+        """
+        POST JSON {"ids": [...], "operations": {...}} - массовая правка позиций.
+        Ответ: число позиций и новые итоги затронутых смет.
+        """
+        import json
+        from django.http import JsonResponse
+        from .bulk_edit import bulk_edit_items
+        if request.method != 'POST':
+            return JsonResponse({'error': 'Только POST'}, status=405)
+        if not self.has_change_permission(request):
+            return JsonResponse({'error': 'Недостаточно прав'}, status=403)
+        try:
+            payload = json.loads(request.body or b'{}')
+            ids = [int(item_id) for item_id in payload.get('ids') or []]
+            if not ids:
+                raise ValueError('Не выбраны позиции')
+            result = bulk_edit_items(EstimateItem.objects.filter(id__in=ids), payload.get('operations') or {})
+        except (ValueError, TypeError, AttributeError) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        metrics.inc('estimate_items_bulk_edited_total', result['items'], source='api')
+        return JsonResponse({
+            'items': result['items'],
+            'totals': {
+                str(estimate_id): {key: str(value) for key, value in totals.items()}
+                for estimate_id, totals in result['totals'].items()
+            },
+        })
+    
     def create_transaction_view(self, request, item_id):
         """View для создания транзакции по отдельной позиции"""
         from django.shortcuts import redirect
@@ -684,77 +911,28 @@ class EstimateItemAdmin(admin.ModelAdmin):
     
     create_transactions_for_selected.short_description = "Создать транзакции для выбранных позиций"
     
+    @traced()
     def _process_selected_transactions(self, request, queryset):
         """Обработать создание транзакций для выбранных позиций"""
         from django.shortcuts import redirect
         from django.contrib import messages
         from django.urls import reverse
-        from .models import Transaction
-        from django.db import transaction
+        from .db import immediate_atomic
+        from .utils import create_wizard_transactions
+        
+        if request.POST.get('run_in_background'):
+            response = _enqueue_job_response(request, 'create_transactions', {
+                'item_ids': list(queryset.values_list('id', flat=True)),
+                'data': _job_form_data(request),
+            })
+            request.session.pop('selected_estimate_items', None)
+            return response
         
         try:
-            with transaction.atomic():
-                created_count = 0
-                
-                # Проходим по всем выбранным позициям
-                for item in queryset:
-                    # Проверяем, включена ли позиция
-                    include_item = request.POST.get(f'include_item_{item.id}')
-                    if not include_item:
-                        continue
-                    
-                    # Получаем данные из формы
-                    include_expense = request.POST.get(f'include_expense_{item.id}')
-                    include_income = request.POST.get(f'include_income_{item.id}')
-                    
-                    if include_expense:
-                        expense_amount = request.POST.get(f'expense_amount_{item.id}')
-                        expense_category_id = request.POST.get(f'expense_category_{item.id}')
-                        expense_contractor_id = request.POST.get(f'expense_contractor_{item.id}')
-                        
-                        if expense_amount and expense_category_id:
-                            # Создаем транзакцию расхода
-                            Transaction.objects.create(
-                                amount=expense_amount,
-                                transaction_type='expense',
-                                category_id=expense_category_id,
-                                contractor_id=expense_contractor_id if expense_contractor_id else None,
-                                description=f'Расход по смете: {item.get_item_name()}',
-                                estimate=item.estimate,
-                                estimate_item=item,
-                            )
-                            created_count += 1
-                    
-                    if include_income:
-                        income_amount = request.POST.get(f'income_amount_{item.id}')
-                        income_category_id = request.POST.get(f'income_category_{item.id}')
-                        income_contractor_id = request.POST.get(f'income_contractor_{item.id}')
-                        
-                        if income_amount and income_category_id:
-                            # Формируем описание дохода
-                            if item.income_type:
-                                description = f'Расход по смете (наценка/откат): {item.get_item_name()} ({item.get_income_display()})'
-                            else:
-                                # Дополнительный расход (раньше доход)
-                                income_description = request.POST.get(f'income_description_{item.id}', '').strip()
-                                if income_description:
-                                    description = f'Дополнительный расход по смете: {item.get_item_name()} - {income_description}'
-                                else:
-                                    description = f'Дополнительный расход по смете: {item.get_item_name()}'
-                            
-                            # Создаем как расход (наценки/откаты тоже расходы бюджета)
-                            Transaction.objects.create(
-                                amount=income_amount,
-                                transaction_type='expense',
-                                category_id=income_category_id,
-                                contractor_id=income_contractor_id if income_contractor_id else None,
-                                description=description,
-                                estimate=item.estimate,
-                                estimate_item=item,
-                            )
-                            created_count += 1
-                
+            with immediate_atomic():
+                created_count = create_wizard_transactions(queryset.select_related('price_item'), request.POST)
                 messages.success(request, f'Успешно создано {created_count} транзакций по выбранным позициям.')
+            metrics.inc('wizard_transactions_created_total', created_count, source='selected')
                 
         except Exception as e:
             messages.error(request, f'Ошибка при создании транзакций: {str(e)}')
@@ -765,12 +943,13 @@ class EstimateItemAdmin(admin.ModelAdmin):
         
         return redirect(reverse('admin:control_estimateitem_changelist'))
     
+    @traced()
     def create_transactions_selected_view(self, request):
         """View для создания транзакций по выбранным позициям"""
         from django.shortcuts import render, redirect
         from django.contrib import messages
         from django.urls import reverse
-        from .models import EstimateItem, Category
+        from .models import EstimateItem
         
         # Получаем выбранные ID из сессии
         selected_ids = request.session.get('selected_estimate_items', [])
@@ -786,8 +965,8 @@ class EstimateItemAdmin(admin.ModelAdmin):
             return self._process_selected_transactions(request, queryset)
         
         # GET запрос - показываем форму
-        categories = Category.objects.filter(is_active=True)
-        contractors = CustomUser.objects.filter(is_active=True)
+        from .utils import get_transaction_form_options
+        queryset = queryset.select_related('price_item', 'estimate__stage')
         
         # Подготавливаем данные для каждой выбранной позиции
         items_data = []
@@ -808,8 +987,7 @@ class EstimateItemAdmin(admin.ModelAdmin):
         
         context = {
             'items_data': items_data,
-            'categories': categories,
-            'contractors': contractors,
+            'options': get_transaction_form_options(),
             'opts': self.model._meta,
             'has_view_permission': True,
             'is_selected_action': True,
@@ -846,70 +1024,22 @@ class EstimateItemAdmin(admin.ModelAdmin):
         return obj.get_item_name()
     get_item_name.short_description = 'Название'
     
+    @traced()
     def get_transactions(self, obj):
         """Показать транзакции по пункту сметы (AJAX список с пагинацией)"""
         if not obj.pk:
             return 'Сохраните пункт сметы для просмотра транзакций'
-        from django.utils.html import format_html
-        from django.template.loader import render_to_string
-        from django.core.paginator import Paginator
-        from django.urls import reverse
-        from .models import Transaction
-        qs = Transaction.objects.filter(estimate_item=obj).select_related('category', 'contractor').order_by('-date', '-id')
-        paginator = Paginator(qs, 20)
-        page_obj = paginator.get_page(1)
-        all_total_income = sum(t.amount for t in qs.filter(transaction_type='income'))
-        all_total_expense = sum(t.amount for t in qs.filter(transaction_type='expense'))
-        all_total_net = all_total_income - all_total_expense
-        base_url = reverse('admin:control_estimateitem_transactions_list', args=[obj.pk])
-        html_inner = render_to_string(
-            'admin/control/estimate/transactions_list.html',
-            {
-                'page_obj': page_obj,
-                'paginator': paginator,
-                'per_page': 20,
-                'base_url': base_url,
-                'all_total_income': all_total_income,
-                'all_total_expense': all_total_expense,
-                'all_total_net': all_total_net,
-            }
-        )
-        return format_html('<div id="tx-list">{}</div>', html_inner)
+        return _render_transactions_panel('estimateitem', obj, 'admin:control_estimateitem_transactions_list')
     
     get_transactions.short_description = 'Транзакции по пункту'
 
+    @traced()
     def transactions_list_view(self, request, item_id):
         """Список транзакций по EstimateItem (AJAX)."""
-        from django.shortcuts import get_object_or_404, render
-        from django.core.paginator import Paginator
-        from .models import EstimateItem, Transaction
+        from django.shortcuts import get_object_or_404
+        from .models import EstimateItem
         item = get_object_or_404(EstimateItem, pk=item_id)
-        qs = Transaction.objects.filter(estimate_item=item).select_related('category', 'contractor').order_by('-date', '-id')
-        try:
-            per_page = int(request.GET.get('per_page', 20))
-        except Exception:
-            per_page = 20
-        if per_page < 5:
-            per_page = 5
-        if per_page > 500:
-            per_page = 500
-        page_number = request.GET.get('page') or 1
-        paginator = Paginator(qs, per_page)
-        page_obj = paginator.get_page(page_number)
-        all_total_income = sum(t.amount for t in qs.filter(transaction_type='income'))
-        all_total_expense = sum(t.amount for t in qs.filter(transaction_type='expense'))
-        all_total_net = all_total_income - all_total_expense
-        from django.urls import reverse
-        base_url = reverse('admin:control_estimateitem_transactions_list', args=[item.pk])
-        return render(request, 'admin/control/estimate/transactions_list.html', {
-            'page_obj': page_obj,
-            'paginator': paginator,
-            'per_page': per_page,
-            'base_url': base_url,
-            'all_total_income': all_total_income,
-            'all_total_expense': all_total_expense,
-            'all_total_net': all_total_net,
-        })
+        return _transactions_list_response(request, 'estimateitem', item, 'admin:control_estimateitem_transactions_list')
     
     def income_info(self, obj):
         """Информация о доходе"""
@@ -925,14 +1055,113 @@ class EstimateItemAdmin(admin.ModelAdmin):
 
 
 
-class ProjectAdmin(admin.ModelAdmin):
+class EstimatesZipExportMixin:
+    """Выгрузка всех смет узла (проект/объект/этап) одним ZIP-архивом"""
+    actions = ['export_estimates_zip', 'export_estimates_zip_background']
+
+    def get_urls(self):
+        from django.urls import path
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                '<int:node_id>/export-zip/',
+                self.admin_site.admin_view(self.export_zip_view),
+                name=f'control_{self.model._meta.model_name}_export_zip',
+            ),
+        ]
+        return custom_urls + urls
+
+    def has_export_estimates_permission(self, request):
+        # В архиве - сметы узла, права на сам узел для их выгрузки мало
+        return request.user.has_perm('control.view_estimate')
+
+    @traced()
+    def _estimates_zip_response(self, nodes, audience, filename):
+        """Потоковый ответ с архивом смет"""
+        from django.http import HttpResponse, StreamingHttpResponse
+        from .exports import AUDIENCES, estimates_under, iter_estimates_zip, xlsx_available
+        if not xlsx_available():
+            return HttpResponse('xlsxwriter не установлен', status=500)
+        if audience not in AUDIENCES:
+            audience = 'client'
+        metrics.inc('estimate_exports_total', audience=audience, format='zip')
+        response = StreamingHttpResponse(
+            iter_estimates_zip(estimates_under(nodes), audience),
+            content_type='application/zip',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def export_estimates_zip(self, request, queryset):
+        """Действие: сметы всех выбранных узлов для заказчика"""
+        return self._estimates_zip_response(
+            queryset, 'client', f'estimates_{self.model._meta.model_name}.zip'
+        )
+
+    export_estimates_zip.short_description = 'Скачать все сметы (ZIP)'
+    export_estimates_zip.allowed_permissions = ('export_estimates',)
+
+    def export_estimates_zip_background(self, request, queryset):
+        """Действие: архив смет выбранных узлов собирается фоновой задачей"""
+        return _enqueue_job_response(request, 'export_estimates_zip', {
+            'model': self.model._meta.label,
+            'ids': list(queryset.values_list('pk', flat=True)),
+            'audience': 'client',
+        })
+
+    export_estimates_zip_background.short_description = 'Собрать все сметы (ZIP) в фоне'
+    export_estimates_zip_background.allowed_permissions = ('export_estimates',)
+
+    @traced()
+    def export_zip_view(self, request, node_id):
+        """Архив смет одного узла с выбором аудитории (?audience=client|self|contractor)"""
+        from django.core.exceptions import PermissionDenied
+        from django.shortcuts import get_object_or_404
+        if not self.has_export_estimates_permission(request):
+            raise PermissionDenied
+        node = get_object_or_404(self.model, pk=node_id)
+        audience = request.GET.get('audience', 'client')
+        if request.GET.get('background'):
+            return _enqueue_job_response(request, 'export_estimates_zip', {
+                'model': self.model._meta.label, 'ids': [node.pk], 'audience': audience,
+            })
+        return self._estimates_zip_response(
+            self.model._default_manager.filter(pk=node.pk),
+            audience,
+            f'estimates_{self.model._meta.model_name}_{node.pk}_{audience}.zip',
+        )
+
+    def get_export_zip_buttons(self, obj):
+        """Ссылки на скачивание архива смет по аудиториям"""
+        if not obj.pk:
+            return 'Сохраните запись для выгрузки смет'
+        from django.utils.html import format_html_join
+        from django.urls import reverse
+        url = reverse(f'admin:control_{self.model._meta.model_name}_export_zip', args=[obj.pk])
+        return format_html_join(
+            ' ',
+            '<a href="{}?audience={}" class="button" style="padding: 5px 10px; text-decoration: none;">📦 {}</a>',
+            (
+                (url, 'client', 'Для клиента'),
+                (url, 'self', 'Для себя'),
+                (url, 'contractor', 'Для исполнителя'),
+                (url, 'client&background=1', 'Для клиента, в фоне'),
+            ),
+        )
+
+    get_export_zip_buttons.short_description = 'Сметы (ZIP)'
+
+
+class ProjectAdmin(EstimatesZipExportMixin, admin.ModelAdmin):
     """Админка для проектов"""
     form = ProjectForm
     list_display = ['name', 'contractor', 'description', 'is_active', 'created_at']
     list_filter = ['is_active', 'contractor', 'created_at']
+    list_select_related = ['contractor']
     search_fields = ['name', 'description', 'contractor__name']
-    readonly_fields = ['created_at', 'updated_at', 'get_all_transactions', 'get_all_stages']
+    readonly_fields = ['created_at', 'updated_at', 'get_all_transactions', 'get_all_stages', 'get_export_zip_buttons']
     autocomplete_fields = ['contractor']
+    actions = EstimatesZipExportMixin.actions + ['archive_transactions_background', 'restore_transactions_background']
     
     fieldsets = (
         ('Основная информация', {
@@ -942,6 +1171,9 @@ class ProjectAdmin(admin.ModelAdmin):
             'fields': ('get_all_stages',),
             'classes': ('collapse',)
         }),
+        ('Экспорт смет', {
+            'fields': ('get_export_zip_buttons',),
+        }),
         ('Все транзакции проекта', {
             'fields': ('get_all_transactions',),
             'classes': ('collapse',)
@@ -951,6 +1183,24 @@ class ProjectAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    
+    def archive_transactions_background(self, request, queryset):
+        """Действие: перенести транзакции выбранных проектов в архив фоновой задачей"""
+        return _enqueue_job_response(request, 'archive_transactions', {
+            'project_ids': list(queryset.values_list('pk', flat=True)),
+        })
+    
+    archive_transactions_background.short_description = 'Перенести транзакции в архив (в фоне)'
+    
+    def restore_transactions_background(self, request, queryset):
+        """Действие: вернуть транзакции выбранных проектов из архива фоновой задачей"""
+        return _enqueue_job_response(request, 'archive_transactions', {
+            'project_ids': list(queryset.values_list('pk', flat=True)),
+            'restore': True,
+        })
+    
+    restore_transactions_background.short_description = 'Вернуть транзакции из архива (в фоне)'
+    
     def get_urls(self):
         from django.urls import path
         urls = super().get_urls()
@@ -963,81 +1213,42 @@ class ProjectAdmin(admin.ModelAdmin):
         ]
         return custom_urls + urls
     
+    @traced()
     def get_all_transactions(self, obj):
         """Показать все транзакции проекта (AJAX список)."""
         if not obj.pk:
             return 'Сохраните проект для просмотра транзакций'
-        from django.utils.html import format_html
-        from django.template.loader import render_to_string
-        from django.core.paginator import Paginator
-        from django.urls import reverse
-        from .models import Transaction
-        qs = get_transactions_for_project(obj)
-        # qs может быть списком — приведем к QuerySet через фильтр
-        if not hasattr(qs, 'filter'):
-            qs_ids = [t.id for t in qs]
-            qs = Transaction.objects.filter(id__in=qs_ids).order_by('-date', '-id')
-        paginator = Paginator(qs, 20)
-        page_obj = paginator.get_page(1)
-        all_total_income = sum(t.amount for t in qs.filter(transaction_type='income'))
-        all_total_expense = sum(t.amount for t in qs.filter(transaction_type='expense'))
-        all_total_net = all_total_income - all_total_expense
-        base_url = reverse('admin:control_project_transactions_list', args=[obj.pk])
-        html_inner = render_to_string('admin/control/estimate/transactions_list.html', {
-            'page_obj': page_obj,
-            'paginator': paginator,
-            'per_page': 20,
-            'base_url': base_url,
-            'all_total_income': all_total_income,
-            'all_total_expense': all_total_expense,
-            'all_total_net': all_total_net,
-        })
-        return format_html('<div id="tx-list">{}</div>', html_inner)
+        return _render_transactions_panel('project', obj, 'admin:control_project_transactions_list')
 
+    @traced()
     def transactions_list_view(self, request, project_id):
-        from django.shortcuts import get_object_or_404, render
-        from django.core.paginator import Paginator
-        from .models import Project, Transaction
+        from django.shortcuts import get_object_or_404
+        from .models import Project
         project = get_object_or_404(Project, pk=project_id)
-        qs = get_transactions_for_project(project)
-        if not hasattr(qs, 'filter'):
-            qs_ids = [t.id for t in qs]
-            qs = Transaction.objects.filter(id__in=qs_ids).order_by('-date', '-id')
-        try:
-            per_page = int(request.GET.get('per_page', 20))
-        except Exception:
-            per_page = 20
-        if per_page < 5: per_page = 5
-        if per_page > 500: per_page = 500
-        paginator = Paginator(qs, per_page)
-        page_obj = paginator.get_page(request.GET.get('page') or 1)
-        all_total_income = sum(t.amount for t in qs.filter(transaction_type='income'))
-        all_total_expense = sum(t.amount for t in qs.filter(transaction_type='expense'))
-        all_total_net = all_total_income - all_total_expense
-        from django.urls import reverse
-        base_url = reverse('admin:control_project_transactions_list', args=[project.pk])
-        return render(request, 'admin/control/estimate/transactions_list.html', {
-            'page_obj': page_obj,
-            'paginator': paginator,
-            'per_page': per_page,
-            'base_url': base_url,
-            'all_total_income': all_total_income,
-            'all_total_expense': all_total_expense,
-            'all_total_net': all_total_net,
-        })
+        return _transactions_list_response(request, 'project', project, 'admin:control_project_transactions_list')
     
     get_all_transactions.short_description = 'Все транзакции проекта'
     
+    @traced()
     def get_all_stages(self, obj):
         """Показать все этапы проекта"""
         if not obj.pk:
             return 'Сохраните проект для просмотра этапов'
-        
+        from .cache import cached
+        # Обзор этапов кэшируется до изменения этапов или объектов
+        return cached(
+            'project_stages', (obj.pk,), ('control.Stage', 'control.Object'),
+            lambda: self._render_all_stages(obj),
+        )
+
+    @traced()
+    def _render_all_stages(self, obj):
+        """HTML-таблица этапов проекта"""
         from django.utils.html import format_html
         
         # Получаем все этапы проекта через объекты
         from .models import Stage
-        stages = Stage.objects.filter(object__project=obj).order_by('object__name', 'order')
+        stages = Stage.objects.filter(object__project=obj).select_related('object').order_by('object__name', 'order')
         
         if not stages.exists():
             return format_html('<p style="color: #666; font-style: italic;">Нет этапов</p>')
@@ -1104,7 +1315,7 @@ class ProjectAdmin(admin.ModelAdmin):
     get_all_stages.short_description = 'Все этапы проекта'
 
 
-class ObjectAdmin(admin.ModelAdmin):
+class ObjectAdmin(EstimatesZipExportMixin, admin.ModelAdmin):
     """Админка для объектов"""
     form = ObjectForm
     list_display = [
@@ -1112,15 +1323,23 @@ class ObjectAdmin(admin.ModelAdmin):
         'planned_end_date', 'estimated_budget', 'is_active'
     ]
     list_filter = ['is_active', 'project', 'planned_start_date', 'planned_end_date']
+    list_select_related = ['project__contractor']
     search_fields = ['name', 'address', 'project__name']
-    readonly_fields = ['created_at', 'updated_at', 'get_all_transactions']
+    readonly_fields = ['created_at', 'updated_at', 'get_all_transactions', 'get_export_zip_buttons', 'get_instantiate_button']
     date_hierarchy = 'planned_start_date'
     autocomplete_fields = ['project']
+    actions = EstimatesZipExportMixin.actions + ['instantiate_from_template']
     
     fieldsets = (
         ('Основная информация', {
             'fields': ('name', 'project', 'address', 'planned_start_date', 'planned_end_date', 'actual_end_date', 'estimated_budget', 'is_active')
         }),
+        ('Экспорт смет', {
+            'fields': ('get_export_zip_buttons',),
+        }),
+        ('Шаблон', {
+            'fields': ('get_instantiate_button',),
+        }),
         ('Все транзакции объекта', {
             'fields': ('get_all_transactions',),
             'classes': ('collapse',)
@@ -1139,70 +1358,92 @@ class ObjectAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(self.transactions_list_view),
                 name='control_object_transactions_list',
             ),
+            path(
+                '<int:object_id>/instantiate/',
+                self.admin_site.admin_view(self.instantiate_view),
+                name='control_object_instantiate',
+            ),
         ]
         return custom_urls + urls
     
+    def get_instantiate_button(self, obj):
+        """Ссылка на создание объекта по этому объекту как шаблону"""
+        if not obj or not obj.pk:
+            return '—'
+        from django.utils.html import format_html
+        from django.urls import reverse
+        return format_html(
+            '<a href="{}" class="button" style="padding: 5px 10px; text-decoration: none;">🏗 Создать объект по этому шаблону</a>',
+            reverse('admin:control_object_instantiate', args=[obj.pk]),
+        )
+    
+    get_instantiate_button.short_description = 'Шаблон'
+    
+    def instantiate_from_template(self, request, queryset):
+        """Действие: новый объект по выбранному объекту-шаблону (форма выбора проекта)"""
+        from django.contrib import messages
+        from django.shortcuts import redirect
+        from django.urls import reverse
+        if len(queryset) != 1:
+            self.message_user(request, 'Выберите один объект-шаблон', level=messages.WARNING)
+            return None
+        return redirect(reverse('admin:control_object_instantiate', args=[queryset[0].pk]))
+    
+    instantiate_from_template.short_description = 'Создать объект по шаблону'
+    instantiate_from_template.allowed_permissions = ('add',)
+    
+    @traced()
+    def instantiate_view(self, request, object_id):
+        """Новый объект в выбранном проекте: этапы, сметы и позиции шаблона"""
+        import time
+        from django.contrib import messages
+        from django.core.exceptions import PermissionDenied
+        from django.shortcuts import get_object_or_404, redirect, render
+        from django.urls import reverse
+        from .cloning import clone_object
+        from .models import Object as BuildObject
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        template = get_object_or_404(BuildObject.objects.select_related('project'), pk=object_id)
+        if request.method == 'POST':
+            project = get_object_or_404(Project, pk=request.POST.get('project') or template.project_id)
+            # Объект создается в чужом проекте только при праве на его просмотр
+            if not self.admin_site.get_model_admin(Project).has_view_permission(request, project):
+                raise PermissionDenied
+            started = time.monotonic()
+            build_object, counts = clone_object(
+                template, project, name=(request.POST.get('name') or '').strip() or None,
+                reprice=bool(request.POST.get('reprice')),
+            )
+            messages.success(request, (
+                f'Объект создан по шаблону за {time.monotonic() - started:.2f} с: этапов {counts["stages"]}, '
+                f'смет {counts["estimates"]}, позиций {counts["items"]}.'
+            ))
+            return redirect(reverse('admin:control_object_change', args=[build_object.pk]))
+        return render(request, 'admin/control/object/instantiate.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Объект по шаблону',
+            'opts': self.model._meta,
+            'template_object': template,
+            'projects': Project._default_manager.select_related('contractor').order_by('name'),
+            'stages_count': template.stages.count(),
+            'estimates_count': Estimate.objects.filter(stage__object=template).count(),
+            'items_count': EstimateItem.objects.filter(estimate__stage__object=template).count(),
+        })
+    
+    @traced()
     def get_all_transactions(self, obj):
         """Показать все транзакции объекта (AJAX список)."""
         if not obj.pk:
             return 'Сохраните объект для просмотра транзакций'
-        from django.utils.html import format_html
-        from django.template.loader import render_to_string
-        from django.core.paginator import Paginator
-        from django.urls import reverse
-        from .models import Transaction
-        qs = get_transactions_for_object(obj)
-        if not hasattr(qs, 'filter'):
-            qs_ids = [t.id for t in qs]
-            qs = Transaction.objects.filter(id__in=qs_ids).order_by('-date', '-id')
-        paginator = Paginator(qs, 20)
-        page_obj = paginator.get_page(1)
-        all_total_income = sum(t.amount for t in qs.filter(transaction_type='income'))
-        all_total_expense = sum(t.amount for t in qs.filter(transaction_type='expense'))
-        all_total_net = all_total_income - all_total_expense
-        base_url = reverse('admin:control_object_transactions_list', args=[obj.pk])
-        html_inner = render_to_string('admin/control/estimate/transactions_list.html', {
-            'page_obj': page_obj,
-            'paginator': paginator,
-            'per_page': 20,
-            'base_url': base_url,
-            'all_total_income': all_total_income,
-            'all_total_expense': all_total_expense,
-            'all_total_net': all_total_net,
-        })
-        return format_html('<div id="tx-list">{}</div>', html_inner)
+        return _render_transactions_panel('object', obj, 'admin:control_object_transactions_list')
 
+    @traced()
     def transactions_list_view(self, request, object_id):
-        from django.shortcuts import get_object_or_404, render
-        from django.core.paginator import Paginator
-        from .models import Object as BuildObject, Transaction
+        from django.shortcuts import get_object_or_404
+        from .models import Object as BuildObject
         build_object = get_object_or_404(BuildObject, pk=object_id)
-        qs = get_transactions_for_object(build_object)
-        if not hasattr(qs, 'filter'):
-            qs_ids = [t.id for t in qs]
-            qs = Transaction.objects.filter(id__in=qs_ids).order_by('-date', '-id')
-        try:
-            per_page = int(request.GET.get('per_page', 20))
-        except Exception:
-            per_page = 20
-        if per_page < 5: per_page = 5
-        if per_page > 500: per_page = 500
-        paginator = Paginator(qs, per_page)
-        page_obj = paginator.get_page(request.GET.get('page') or 1)
-        all_total_income = sum(t.amount for t in qs.filter(transaction_type='income'))
-        all_total_expense = sum(t.amount for t in qs.filter(transaction_type='expense'))
-        all_total_net = all_total_income - all_total_expense
-        from django.urls import reverse
-        base_url = reverse('admin:control_object_transactions_list', args=[build_object.pk])
-        return render(request, 'admin/control/estimate/transactions_list.html', {
-            'page_obj': page_obj,
-            'paginator': paginator,
-            'per_page': per_page,
-            'base_url': base_url,
-            'all_total_income': all_total_income,
-            'all_total_expense': all_total_expense,
-            'all_total_net': all_total_net,
-        })
+        return _transactions_list_response(request, 'object', build_object, 'admin:control_object_transactions_list')
     
     get_all_transactions.short_description = 'Все транзакции объекта'
 
@@ -1213,7 +1454,11 @@ class EstimateInline(admin.TabularInline):
     extra = 0
     fields = ['status', 'get_client_total', 'get_contractor_total', 'get_income_total', 'created_at']
     readonly_fields = ['get_client_total', 'get_contractor_total', 'get_income_total', 'created_at', 'updated_at']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
     
+    @traced()
     def get_client_total(self, obj):
         """Сумма для заказчика"""
         if obj.pk:
@@ -1221,6 +1466,7 @@ class EstimateInline(admin.TabularInline):
         return '-'
     get_client_total.short_description = 'Для заказчика'
     
+    @traced()
     def get_contractor_total(self, obj):
         """Сумма для исполнителя"""
         if obj.pk:
@@ -1228,6 +1474,7 @@ class EstimateInline(admin.TabularInline):
         return '-'
     get_contractor_total.short_description = 'Для исполнителя'
     
+    @traced()
     def get_income_total(self, obj):
         """Доход по смете"""
         if obj.pk:
@@ -1236,12 +1483,13 @@ class EstimateInline(admin.TabularInline):
     get_income_total.short_description = 'Доход'
 
 
-class StageAdmin(admin.ModelAdmin):
+class StageAdmin(EstimatesZipExportMixin, admin.ModelAdmin):
     """Админка для этапов"""
     list_display = ['name', 'object', 'order', 'planned_start_date', 'planned_end_date', 'is_active']
     list_filter = ['is_active', 'object__project', 'planned_start_date']
+    list_select_related = ['object__project']
     search_fields = ['name', 'object__name']
-    readonly_fields = ['created_at', 'updated_at', 'get_all_transactions']
+    readonly_fields = ['created_at', 'updated_at', 'get_all_transactions', 'get_export_zip_buttons']
     ordering = ['object', 'order']
     inlines = [EstimateInline]
     autocomplete_fields = ['object']
@@ -1250,6 +1498,9 @@ class StageAdmin(admin.ModelAdmin):
         ('Основная информация', {
             'fields': ('name', 'object', 'order', 'planned_start_date', 'planned_end_date', 'is_active')
         }),
+        ('Экспорт смет', {
+            'fields': ('get_export_zip_buttons',),
+        }),
         ('Все транзакции этапа', {
             'fields': ('get_all_transactions',),
             'classes': ('collapse',)
@@ -1272,67 +1523,19 @@ class StageAdmin(admin.ModelAdmin):
         ]
         return custom_urls + urls
     
+    @traced()
     def get_all_transactions(self, obj):
         """Показать все транзакции этапа (AJAX список)."""
         if not obj.pk:
             return 'Сохраните этап для просмотра транзакций'
-        from django.utils.html import format_html
-        from django.template.loader import render_to_string
-        from django.core.paginator import Paginator
-        from django.urls import reverse
-        from .models import Transaction
-        qs = get_transactions_for_stage(obj)
-        if not hasattr(qs, 'filter'):
-            qs_ids = [t.id for t in qs]
-            qs = Transaction.objects.filter(id__in=qs_ids).order_by('-date', '-id')
-        paginator = Paginator(qs, 20)
-        page_obj = paginator.get_page(1)
-        all_total_income = sum(t.amount for t in qs.filter(transaction_type='income'))
-        all_total_expense = sum(t.amount for t in qs.filter(transaction_type='expense'))
-        all_total_net = all_total_income - all_total_expense
-        base_url = reverse('admin:control_stage_transactions_list', args=[obj.pk])
-        html_inner = render_to_string('admin/control/estimate/transactions_list.html', {
-            'page_obj': page_obj,
-            'paginator': paginator,
-            'per_page': 20,
-            'base_url': base_url,
-            'all_total_income': all_total_income,
-            'all_total_expense': all_total_expense,
-            'all_total_net': all_total_net,
-        })
-        return format_html('<div id="tx-list">{}</div>', html_inner)
+        return _render_transactions_panel('stage', obj, 'admin:control_stage_transactions_list')
 
+    @traced()
     def transactions_list_view(self, request, stage_id):
-        from django.shortcuts import get_object_or_404, render
-        from django.core.paginator import Paginator
-        from .models import Stage, Transaction
+        from django.shortcuts import get_object_or_404
+        from .models import Stage
         stage = get_object_or_404(Stage, pk=stage_id)
-        qs = get_transactions_for_stage(stage)
-        if not hasattr(qs, 'filter'):
-            qs_ids = [t.id for t in qs]
-            qs = Transaction.objects.filter(id__in=qs_ids).order_by('-date', '-id')
-        try:
-            per_page = int(request.GET.get('per_page', 20))
-        except Exception:
-            per_page = 20
-        if per_page < 5: per_page = 5
-        if per_page > 500: per_page = 500
-        paginator = Paginator(qs, per_page)
-        page_obj = paginator.get_page(request.GET.get('page') or 1)
-        all_total_income = sum(t.amount for t in qs.filter(transaction_type='income'))
-        all_total_expense = sum(t.amount for t in qs.filter(transaction_type='expense'))
-        all_total_net = all_total_income - all_total_expense
-        from django.urls import reverse
-        base_url = reverse('admin:control_stage_transactions_list', args=[stage.pk])
-        return render(request, 'admin/control/estimate/transactions_list.html', {
-            'page_obj': page_obj,
-            'paginator': paginator,
-            'per_page': per_page,
-            'base_url': base_url,
-            'all_total_income': all_total_income,
-            'all_total_expense': all_total_expense,
-            'all_total_net': all_total_net,
-        })
+        return _transactions_list_response(request, 'stage', stage, 'admin:control_stage_transactions_list')
     
     get_all_transactions.short_description = 'Все транзакции этапа'
 
@@ -1377,6 +1580,17 @@ class CategoryAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at']
 
 
+class ImportRuleAdmin(admin.ModelAdmin):
+    """Правила импорта банковских выписок (python manage.py import_bank_statement)"""
+    list_display = ['name', 'field', 'pattern', 'direction', 'category', 'contractor', 'transaction_type', 'priority', 'is_active']
+    list_editable = ['priority', 'is_active']
+    list_filter = ['field', 'direction', 'is_active', 'category']
+    list_select_related = ['category', 'contractor']
+    search_fields = ['name', 'pattern']
+    autocomplete_fields = ['category', 'contractor']
+    readonly_fields = ['created_at']
+
+
 class TransactionAdmin(admin.ModelAdmin):
     """Админка для транзакций"""
     form = TransactionForm
@@ -1401,6 +1615,8 @@ class TransactionAdmin(admin.ModelAdmin):
     list_per_page = 25  # Пагинация - 25 записей на странице
     list_max_show_all = 100  # Максимум записей для показа всех
     autocomplete_fields = ['category', 'contractor', 'stage', 'estimate', 'estimate_item']
+    list_select_related = ['category', 'contractor', 'stage__object__project', 'estimate__stage__object__project']
+    actions = ['archive_selected']
     
     fieldsets = (
         ('Основная информация', {
@@ -1438,18 +1654,314 @@ class TransactionAdmin(admin.ModelAdmin):
         """Получить сумму со знаком"""
         return f"{obj.get_signed_amount():,.2f} руб."
     get_signed_amount.short_description = 'Сумма со знаком'
+    
+    def _in_closed_period(self, obj):
+        from .periods import closed_until
+        until = closed_until()
+        return obj is not None and until is not None and obj.date <= until
+    
+    def has_change_permission(self, request, obj=None):
+        # Транзакции закрытого периода открываются только на просмотр
+        return super().has_change_permission(request, obj) and not self._in_closed_period(obj)
+    
+    def has_delete_permission(self, request, obj=None):
+        return super().has_delete_permission(request, obj) and not self._in_closed_period(obj)
+    
+    def has_archive_permission(self, request):
+        # Перенос между таблицами удаляет строки из исходной - то же право, что у задачи archive_transactions
+        return request.user.has_perm('control.add_archivedtransaction')
+    
+    def archive_selected(self, request, queryset):
+        """Действие: перенести выбранные транзакции в архив"""
+        from .archive import archive_transactions
+        moved = archive_transactions(queryset)
+        self.message_user(request, f'Перенесено в архив транзакций: {moved}')
+    
+    archive_selected.short_description = 'Перенести в архив'
+    archive_selected.allowed_permissions = ('archive',)
+
+
+class ArchivedTransactionAdmin(TransactionAdmin):
+    """Архив транзакций: только просмотр и возврат в рабочую таблицу"""
+    list_display = TransactionAdmin.list_display + ['archived_at']
+    list_filter = TransactionAdmin.list_filter + ('archived_at',)
+    readonly_fields = ['created_at', 'updated_at', 'archived_at']
+    actions = ['restore_selected']
+    fieldsets = TransactionAdmin.fieldsets + (
+        ('Архив', {'fields': ('archived_at',)}),
+    )
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+    
+    def restore_selected(self, request, queryset):
+        """Действие: вернуть выбранные транзакции из архива с прежними id"""
+        from .archive import restore_transactions
+        restored = restore_transactions(queryset)
+        self.message_user(request, f'Возвращено из архива транзакций: {restored}')
+    
+    restore_selected.short_description = 'Вернуть из архива'
+    restore_selected.allowed_permissions = ('archive',)
+
+
+class ClosedPeriodAdmin(admin.ModelAdmin):
+    """Закрытые периоды: только просмотр, закрытие и открытие - на странице «Периоды и остатки»"""
+    list_display = ['__str__', 'period_type', 'date_from', 'date_to', 'transactions_count', 'closed_by', 'closed_at']
+    list_select_related = ['closed_by']
+    readonly_fields = ['period_type', 'date_from', 'date_to', 'transactions_count', 'closed_by', 'closed_at']
+    fields = readonly_fields
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class EstimateSnapshotAdmin(admin.ModelAdmin):
+    """Ревизии снимков утвержденных смет: только просмотр"""
+    list_display = ['estimate', 'revision', 'get_lines_count', 'get_client_total', 'get_contractor_total', 'created_at']
+    list_filter = ['created_at']
+    list_select_related = ['estimate__stage']
+    search_fields = ['estimate__stage__name', 'estimate__stage__object__name']
+    readonly_fields = ['estimate', 'revision', 'created_at', 'get_client_total', 'get_contractor_total', 'get_lines_table']
+    fields = readonly_fields
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+    
+    def get_lines_count(self, obj):
+        return len(obj.data['lines'])
+    
+    get_lines_count.short_description = 'Позиций'
+    
+    def get_client_total(self, obj):
+        return f"{obj.data['totals']['client']} руб."
+    
+    get_client_total.short_description = 'Сумма для заказчика'
+    
+    def get_contractor_total(self, obj):
+        return f"{obj.data['totals']['contractor']} руб."
+    
+    get_contractor_total.short_description = 'Сумма для исполнителя'
+    
+    def get_lines_table(self, obj):
+        from django.utils.html import format_html, format_html_join
+        from .snapshots import snapshot_lines
+        rows = format_html_join('', '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>', (
+            (line.name, line.unit, line.quantity, line.unit_price, line.client_price, line.contractor_price)
+            for line in snapshot_lines(obj)
+        ))
+        return format_html(
+            '<table><thead><tr><th>Наименование</th><th>Ед.</th><th>Кол-во</th><th>Цена</th>'
+            '<th>Для заказчика</th><th>Для исполнителя</th></tr></thead><tbody>{}</tbody></table>', rows,
+        )
+    
+    get_lines_table.short_description = 'Строки'
+
+
+class DebtPositionAdmin(admin.ModelAdmin):
+    """Долги контрагентов: позиции обновляются транзакциями, здесь только отчет"""
+    list_display = [
+        'contractor', 'receivable', 'payable', 'get_net', 'given', 'returned', 'borrowed', 'repaid',
+        'operations_count', 'updated_at', 'get_statement_link',
+    ]
+    list_filter = [DebtStateFilter]
+    list_select_related = ['contractor']
+    search_fields = ['contractor__last_name', 'contractor__first_name', 'contractor__phone']
+    ordering = ['-receivable']
+    readonly_fields = list_display
+    fields = readonly_fields
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+    
+    def get_net(self, obj):
+        """Сальдо: положительное - контрагент должен нам"""
+        return obj.net
+    
+    get_net.short_description = 'Сальдо'
+    
+    def get_statement_link(self, obj):
+        from django.urls import reverse
+        from django.utils.html import format_html
+        return format_html(
+            '<a href="{}">Акт</a>', reverse('admin:control_customuser_statement', args=[obj.contractor_id])
+        )
+    
+    get_statement_link.short_description = 'Акт сверки'
 
 
 # Регистрация моделей в админке
+class BackgroundJobAdmin(admin.ModelAdmin):
+    """Фоновые задачи: прогресс, результат и API постановки/опроса"""
+    list_display = ['id', 'get_kind_display', 'status', 'progress', 'message', 'created_by', 'created_at', 'get_download_link']
+    list_filter = ['status', 'kind', 'created_at']
+    readonly_fields = [
+        'kind', 'params', 'status', 'get_progress_panel', 'message', 'get_download_link', 'error',
+        'worker', 'created_by', 'created_at', 'started_at', 'finished_at',
+    ]
+    fields = readonly_fields
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_view_permission(self, request, obj=None):
+        """Свою задачу автор видит и без права просмотра всех задач"""
+        if super().has_view_permission(request, obj):
+            return True
+        return obj is not None and obj.created_by_id is not None and obj.created_by_id == request.user.pk
+    
+    def get_urls(self):
+        from django.urls import path
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                'enqueue/',
+                self.admin_site.admin_view(self.enqueue_view),
+                name='control_backgroundjob_enqueue',
+            ),
+            path(
+                '<int:job_id>/status/',
+                self.admin_site.admin_view(self.status_view),
+                name='control_backgroundjob_status',
+            ),
+            path(
+                '<int:job_id>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='control_backgroundjob_download',
+            ),
+        ]
+        return custom_urls + urls
+    
+    def get_kind_display(self, obj):
+        from .jobs import get_job_label
+        return get_job_label(obj.kind)
+    
+    get_kind_display.short_description = 'Задача'
+    
+    def get_download_link(self, obj):
+        """Ссылка на файл результата"""
+        if not obj.result_file:
+            return '-'
+        from django.utils.html import format_html
+        from django.urls import reverse
+        return format_html(
+            '<a href="{}">⬇ Скачать</a>',
+            reverse('admin:control_backgroundjob_download', args=[obj.pk]),
+        )
+    
+    get_download_link.short_description = 'Результат'
+    
+    def get_progress_panel(self, obj):
+        """Прогресс с автообновлением, пока задача не завершена"""
+        from django.template.loader import render_to_string
+        from django.urls import reverse
+        return render_to_string('admin/control/backgroundjob/progress.html', {
+            'job': obj,
+            'status_url': reverse('admin:control_backgroundjob_status', args=[obj.pk]),
+        })
+    
+    get_progress_panel.short_description = 'Прогресс'
+    
+    def _job_payload(self, job):
+        from django.urls import reverse
+        return {
+            'id': job.pk,
+            'kind': job.kind,
+            'status': job.status,
+            'progress': job.progress,
+            'message': job.message,
+            'finished': job.is_finished,
+            'download_url': reverse('admin:control_backgroundjob_download', args=[job.pk]) if job.result_file else None,
+            'status_url': reverse('admin:control_backgroundjob_status', args=[job.pk]),
+        }
+    
+    def enqueue_view(self, request):
+        """POST JSON {"kind": ..., "params": {...}} - поставить задачу в очередь"""
+        import json
+        from django.http import JsonResponse
+        from .jobs import HTTP_ENQUEUE_KINDS, can_enqueue, enqueue
+        if request.method != 'POST':
+            return JsonResponse({'error': 'Только POST'}, status=405)
+        try:
+            payload = json.loads(request.body or b'{}')
+            kind = payload.get('kind')
+            params = payload.get('params') or {}
+            if kind not in HTTP_ENQUEUE_KINDS or not isinstance(params, dict):
+                raise ValueError(f'Задачу {kind} нельзя поставить через API')
+        except (ValueError, AttributeError) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        if not can_enqueue(request.user, kind):
+            return JsonResponse({'error': 'Недостаточно прав'}, status=403)
+        job = enqueue(kind, params, user=request.user)
+        return JsonResponse(self._job_payload(job), status=201)
+    
+    def _get_visible_job(self, request, job_id):
+        """Задача, если пользователь - ее автор или может видеть все задачи"""
+        from django.core.exceptions import PermissionDenied
+        from django.shortcuts import get_object_or_404
+        job = get_object_or_404(BackgroundJob, pk=job_id)
+        if not self.has_view_permission(request, job):
+            raise PermissionDenied
+        return job
+    
+    def status_view(self, request, job_id):
+        """Опрос состояния задачи"""
+        from django.http import JsonResponse
+        return JsonResponse(self._job_payload(self._get_visible_job(request, job_id)))
+    
+    def download_view(self, request, job_id):
+        """Скачать файл результата"""
+        import os
+        from django.http import FileResponse, Http404
+        job = self._get_visible_job(request, job_id)
+        if not job.result_file:
+            raise Http404('Результат еще не готов')
+        return FileResponse(
+            job.result_file.open('rb'), as_attachment=True, filename=os.path.basename(job.result_file.name),
+        )
+
+
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Project, ProjectAdmin)
 admin.site.register(Object, ObjectAdmin)
 admin.site.register(Stage, StageAdmin)
 admin.site.register(Estimate, EstimateAdmin)
 admin.site.register(EstimateItem, EstimateItemAdmin)
+admin.site.register(EstimateSnapshot, EstimateSnapshotAdmin)
 admin.site.register(PriceItem, PriceItemAdmin)
 admin.site.register(WorkType, WorkTypeAdmin)
 admin.site.register(MaterialType, MaterialTypeAdmin)
 # Contractor удален - используем CustomUser
 admin.site.register(Category, CategoryAdmin)
+admin.site.register(ImportRule, ImportRuleAdmin)
 admin.site.register(Transaction, TransactionAdmin)
+admin.site.register(ArchivedTransaction, ArchivedTransactionAdmin)
+admin.site.register(ClosedPeriod, ClosedPeriodAdmin)
+admin.site.register(DebtPosition, DebtPositionAdmin)
+admin.site.register(BackgroundJob, BackgroundJobAdmin)
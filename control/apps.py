@@ -4,3 +4,21 @@ from django.apps import AppConfig
 class ControlConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'control'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.backends.signals import connection_created
+        from .db import configure_sqlite_connection
+        from .slowlog import install_slow_query_log
+        from . import signals  # noqa: F401
+
+        connection_created.connect(configure_sqlite_connection, dispatch_uid='control_sqlite_pragmas')
+        connection_created.connect(install_slow_query_log, dispatch_uid='control_slow_query_log')
+
+        if settings.PROFILER_SAMPLE_RATE > 0:
+            from .profiling import install_template_timer
+            install_template_timer()
+
+        if settings.TRACING_SAMPLE_RATE > 0:
+            from .tracing import install_template_spans
+            install_template_spans()
@@ -0,0 +1,182 @@
+"""
+Архив транзакций.
+
+Транзакции завершенных проектов (Project.is_active = False) и закрытых
+периодов (дата раньше границы) переносятся пачками из рабочей таблицы
+control_transaction в control_archivedtransaction с теми же колонками
+и id, поэтому перенос обратим (restore_transactions) и ссылки на id
+в логах и выгрузках остаются верными.
+
+Списки и итоги в админке читают либо только рабочую таблицу, либо
+представление control_transaction_all (модель LedgerTransaction) - по
+переключателю include_archive: настройка TRANSACTIONS_INCLUDE_ARCHIVE,
+флаг в сессии (ArchiveToggleMiddleware) или блок with archive_scope(True).
+
+Каждая пачка переносится в одной транзакции БД и сверяется: число строк
+и суммы по типам операций до и после совпадают, иначе откат.
+Команда: archive_transactions, фоновая задача archive_transactions.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .db import immediate_atomic, preserve_auto_timestamps
+from .debts import debt_tracking_paused
+from .models import ArchivedTransaction, LedgerTransaction, Transaction
+
+
+SESSION_KEY = 'include_archive'
+
+# Пути от транзакции к проекту: через этап, смету или пункт сметы
+PROJECT_PATHS = ('stage__object__project', 'estimate__stage__object__project',
+                 'estimate_item__estimate__stage__object__project')
+
+_include_archive = ContextVar('control_include_archive', default=None)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def include_archive():
+    """Показывать ли архивные транзакции в списках и итогах"""
+    value = _include_archive.get()
+    return settings.TRANSACTIONS_INCLUDE_ARCHIVE if value is None else value
+
+
+@contextmanager
+def archive_scope(enabled):
+    """Переключатель include_archive внутри блока"""
+    token = _include_archive.set(bool(enabled))
+    try:
+        yield
+    finally:
+        _include_archive.reset(token)
+
+
+def ledger_model():
+    """Модель для чтения транзакций: с архивом или только рабочая таблица"""
+    return LedgerTransaction if include_archive() else Transaction
+
+
+def project_q(lookup, value):
+    """Условие на проект транзакции по любому из путей (например, is_active=False)"""
+    condition = Q()
+    for path in PROJECT_PATHS:
+        condition |= Q(**{f'{path}__{lookup}': value})
+    return condition
+
+
+def archive_candidates(before=None, finished_projects=False, projects=None):
+    """
+    Транзакции рабочей таблицы для архивации: с датой раньше before
+    и/или относящиеся к завершенным проектам; projects ограничивает
+    выборку указанными проектами (id).
+    """
+    condition = Q()
+    if before is not None:
+        condition |= Q(date__lt=before)
+    if finished_projects:
+        condition |= project_q('is_active', False)
+    qs = Transaction.objects.all()
+    if projects:
+        qs = qs.filter(project_q('in', list(projects)))
+    elif not condition:
+        raise ArchiveError('Не задан критерий архивации: граница даты, завершенные проекты или проекты')
+    return qs.filter(condition) if condition else qs
+
+
+def restore_candidates(before=None, projects=None):
+    """Архивные транзакции для возврата: с датой раньше before и/или указанных проектов (все, если не задано)"""
+    qs = ArchivedTransaction.objects.all()
+    if before is not None:
+        qs = qs.filter(date__lt=before)
+    if projects:
+        qs = qs.filter(project_q('in', list(projects)))
+    return qs
+
+
+def ledger_totals(model=LedgerTransaction, **filters):
+    """Число строк и сумма по каждому типу операции: {тип: (число, сумма)}"""
+    rows = (
+        model._base_manager.filter(**filters).order_by()
+        .values('transaction_type').annotate(count=Count('id'), total=Sum('amount'))
+    )
+    return {
+        row['transaction_type']: (row['count'], (row['total'] or Decimal('0')).quantize(Decimal('0.01')))
+        for row in rows
+    }
+
+
+def _move(source, target, ids, extra=None):
+    """Переносит строки ids из source в target с теми же значениями колонок"""
+    # Совпадают все колонки, кроме служебных полей архива (archived_at)
+    target_fields = {field.attname for field in target._meta.concrete_fields}
+    fields = [field.attname for field in source._meta.concrete_fields if field.attname in target_fields]
+    expected = ledger_totals(source, pk__in=ids)
+    rows = list(source._base_manager.filter(pk__in=ids).values(*fields))
+    target.objects.bulk_create([target(**row, **(extra or {})) for row in rows])
+    source.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+    if source._base_manager.filter(pk__in=ids).exists() or ledger_totals(target, pk__in=ids) != expected:
+        raise ArchiveError(f'Сверка пачки не сошлась при переносе в {target._meta.db_table}')
+    return len(rows)
+
+
+def _move_in_batches(source, target, queryset, batch_size, progress, extra=None):
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    moved = 0
+    for start in range(0, len(ids), batch_size):
+        if progress is not None:
+            progress(start, len(ids), f'Перенесено {moved} из {len(ids)}')
+        # Короткая транзакция на пачку: писатели ждут не дольше одной пачки.
+        # Долги учитывают обе таблицы, перенос их не меняет
+        with immediate_atomic(), preserve_auto_timestamps([target]), debt_tracking_paused():
+            moved += _move(source, target, ids[start:start + batch_size], extra)
+    return moved
+
+
+def archive_transactions(queryset, batch_size=None, progress=None):
+    """Переносит транзакции queryset в архив пачками, возвращает их число"""
+    return _move_in_batches(
+        Transaction, ArchivedTransaction, queryset, batch_size, progress, {'archived_at': timezone.now()},
+    )
+
+
+def restore_transactions(queryset, batch_size=None, progress=None):
+    """Возвращает архивные транзакции queryset в рабочую таблицу с прежними id"""
+    return _move_in_batches(ArchivedTransaction, Transaction, queryset, batch_size, progress)
+
+
+class ArchiveToggleMiddleware:
+    """Переключатель архива из сессии (ставится кнопкой в списке транзакций); работает и под ASGI"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        session = getattr(request, 'session', None)
+        if session is None or SESSION_KEY not in session:
+            return self.get_response(request)
+        with archive_scope(session[SESSION_KEY]):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        session = getattr(request, 'session', None)
+        # Сессия в БД загружается асинхронным API, а не в цикле событий
+        include = await session.aget(SESSION_KEY) if session is not None else None
+        if include is None:
+            return await self.get_response(request)
+        with archive_scope(include):
+            return await self.get_response(request)
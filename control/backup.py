@@ -0,0 +1,275 @@
+"""
+Резервные копии.
+
+Потоковые копии моделей: каждая модель - отдельный файл gzip с NDJSON
+(одна строка - одна запись, значения в порядке полей из манифеста),
+manifest.json - число строк и SHA-256 каждого файла.
+Команды: backup_stream (выгрузка), restore_stream (загрузка).
+
+Старые копии dumpdata (один JSON-массив) читаются по одному объекту
+через iter_json_array. Команда: import_legacy_json.
+
+Горячая копия файла SQLite через online backup API (sqlite_hot_backup):
+копирование небольшими порциями страниц без остановки сайта, проверка
+integrity_check, сжатие и ротация старых копий.
+Команда: sqlite_backup, фоновая задача sqlite_backup.
+"""
+import base64
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+import uuid
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.utils import timezone
+
+
+FORMAT = 'habirov-ndjson'
+FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+
+def model_filename(model):
+    return f'{model._meta.label_lower}.ndjson.gz'
+
+
+def backup_fields(model):
+    """Сохраняемые поля модели: все колонки таблицы"""
+    return list(model._meta.concrete_fields)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    raise TypeError(f'Значение типа {type(value).__name__} не сериализуется')
+
+
+def encode_row(values):
+    """Строка NDJSON для значений одной записи"""
+    return json.dumps(values, ensure_ascii=False, separators=(',', ':'), default=_encode_value) + '\n'
+
+
+def _decoder(field):
+    """Преобразование значения из JSON обратно в тип поля (None, если не нужно)"""
+    if isinstance(field, models.JSONField):
+        return None
+    if isinstance(field, models.DurationField):
+        return lambda value: datetime.timedelta(seconds=value)
+    if isinstance(field, models.BinaryField):
+        return base64.b64decode
+    if isinstance(field, (models.DateField, models.TimeField, models.DecimalField, models.UUIDField)):
+        return field.to_python
+    return None
+
+
+def row_decoder(fields):
+    """Функция, превращающая строку NDJSON в словарь {attname: значение}"""
+    converters = [(field.attname, _decoder(field)) for field in fields]
+
+    def decode(line):
+        values = json.loads(line)
+        return {
+            attname: convert(value) if convert is not None and value is not None else value
+            for (attname, convert), value in zip(converters, values)
+        }
+    return decode
+
+
+_SEPARATORS_RE = re.compile(r'[\s,]*')
+
+
+def iter_json_array(fh, chunk_size=64 * 1024):
+    """
+    Элементы JSON-массива верхнего уровня по одному: файл читается
+    порциями, в памяти - только текущий объект и хвост буфера.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    opened = False
+    while True:
+        pos = _SEPARATORS_RE.match(buffer, pos).end()
+        if pos == len(buffer) or (not eof and len(buffer) - pos < 64):
+            if eof:
+                if pos == len(buffer):
+                    raise ValueError('Неожиданный конец файла: массив не закрыт')
+            else:
+                chunk = fh.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+        if not opened:
+            if buffer[pos] != '[':
+                raise ValueError('Ожидался JSON-массив')
+            opened = True
+            pos += 1
+            continue
+        if buffer[pos] == ']':
+            return
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Объект обрезан границей порции - дочитываем
+            chunk = fh.read(chunk_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield obj
+        pos = end
+
+
+def open_text(path):
+    """Текстовый файл, при расширении .gz - со сжатием gzip"""
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def open_ndjson(path, mode='rt', compresslevel=6):
+    if 'w' in mode:
+        return gzip.open(path, mode, compresslevel=compresslevel, encoding='utf-8')
+    return gzip.open(path, mode, encoding='utf-8')
+
+
+# --- Горячая копия SQLite ---
+
+SQLITE_BACKUP_PREFIX = 'db_'
+SQLITE_BACKUP_SUFFIX = '.sqlite3.gz'
+
+
+class BackupError(Exception):
+    pass
+
+
+def sqlite_backup_files(directory=None):
+    """Сжатые копии в каталоге, новые первыми: [(путь, время изменения, размер)]"""
+    directory = Path(directory or settings.SQLITE_BACKUP_DIR)
+    if not directory.is_dir():
+        return []
+    files = [
+        (path, path.stat().st_mtime, path.stat().st_size)
+        for path in directory.iterdir()
+        if path.name.startswith(SQLITE_BACKUP_PREFIX) and path.name.endswith(SQLITE_BACKUP_SUFFIX)
+    ]
+    return sorted(files, key=lambda item: item[1], reverse=True)
+
+
+def rotate_sqlite_backups(directory=None, keep=None, max_age_days=None):
+    """
+    Удаляет копии старше max_age_days, но всегда оставляет keep последних.
+    Возвращает список удаленных файлов.
+    """
+    keep = settings.SQLITE_BACKUP_KEEP if keep is None else keep
+    max_age_days = settings.SQLITE_BACKUP_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    threshold = time.time() - max_age_days * 86400
+    removed = []
+    for path, mtime, _size in sqlite_backup_files(directory)[keep:]:
+        if mtime < threshold:
+            path.unlink()
+            removed.append(path)
+    return removed
+
+
+def sqlite_hot_backup(directory=None, pages=None, sleep=None, keep=None, max_age_days=None,
+                      using=DEFAULT_DB_ALIAS, progress=None):
+    """
+    Согласованная копия работающей базы SQLite.
+
+    Страницы копируются порциями по pages с паузой sleep между ними, чтобы
+    писатели не ждали. В режиме WAL копируется один снимок базы; в режиме
+    журнала отката SQLite начинает проход заново, если базу изменили. Копия проверяется integrity_check, сжимается
+    gzip, после чего старые копии удаляются по политике хранения.
+    progress(done, total, message) вызывается после каждой порции.
+    Возвращает отчет: файл, размеры, число страниц и время этапов.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        raise BackupError('Горячая копия доступна только для SQLite')
+    source_path = str(connection.settings_dict['NAME'])
+    if not os.path.exists(source_path):
+        raise BackupError(f'Файл базы {source_path} не найден')
+    directory = Path(directory or settings.SQLITE_BACKUP_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    pages = settings.SQLITE_BACKUP_PAGES if pages is None else pages
+    sleep = settings.SQLITE_BACKUP_SLEEP if sleep is None else sleep
+
+    name = f'{SQLITE_BACKUP_PREFIX}{timezone.localtime():%Y%m%d_%H%M%S}'
+    if (directory / f'{name}{SQLITE_BACKUP_SUFFIX}').exists():
+        name = f'{name}_{os.getpid()}_{time.monotonic_ns() % 1000000}'
+    copy_path = directory / f'{name}.sqlite3.part'
+    result_path = directory / f'{name}{SQLITE_BACKUP_SUFFIX}'
+    report = {'source': source_path, 'file': str(result_path), 'timings': {}}
+
+    def on_step(status, remaining, total):
+        report['pages'] = total
+        if progress is not None:
+            progress(total - remaining, total, f'Скопировано страниц: {total - remaining} из {total}')
+
+    started = time.monotonic()
+    try:
+        # Отдельное соединение: Django-соединение процесса не блокируется
+        source = sqlite3.connect(source_path, timeout=settings.SQLITE_BACKUP_BUSY_TIMEOUT, isolation_level=None)
+        target = sqlite3.connect(copy_path)
+        try:
+            if source.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal':
+                # В WAL читающая транзакция не мешает писателям и фиксирует снимок:
+                # иначе каждая запись другого соединения начинала бы копирование заново
+                source.execute('BEGIN')
+                source.execute('SELECT count(*) FROM sqlite_master').fetchone()
+            source.backup(target, pages=pages, progress=on_step, sleep=sleep)
+            if source.in_transaction:
+                source.execute('COMMIT')
+            report['timings']['copy'] = time.monotonic() - started
+
+            step = time.monotonic()
+            # Копия из WAL-базы сама в режиме WAL; переводим в обычный файл
+            target.execute('PRAGMA journal_mode = DELETE')
+            problems = [row[0] for row in target.execute('PRAGMA integrity_check')]
+            report['timings']['integrity_check'] = time.monotonic() - step
+            if problems != ['ok']:
+                raise BackupError(f'integrity_check: {"; ".join(problems[:10])}')
+        finally:
+            target.close()
+            source.close()
+        report['db_size'] = copy_path.stat().st_size
+
+        step = time.monotonic()
+        with open(copy_path, 'rb') as src, gzip.open(result_path, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        report['timings']['compress'] = time.monotonic() - step
+        report['size'] = result_path.stat().st_size
+    except BaseException:
+        result_path.unlink(missing_ok=True)
+        raise
+    finally:
+        copy_path.unlink(missing_ok=True)
+
+    step = time.monotonic()
+    report['removed'] = [str(path) for path in rotate_sqlite_backups(directory, keep, max_age_days)]
+    report['timings']['rotate'] = time.monotonic() - step
+    report['timings']['total'] = time.monotonic() - started
+    return report
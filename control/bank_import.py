@@ -0,0 +1,308 @@
+"""
+Импорт банковских выписок в транзакции.
+
+Поддерживаются выгрузки CSV (колонки распознаются по заголовкам) и
+текстовый формат обмена с 1С (1CClientBankExchange). Файл читается
+потоково, построчно. Категория и контрагент строки берутся из первого
+подходящего правила ImportRule (по приоритету), иначе - из категории по
+умолчанию; строки без категории пропускаются.
+
+Дубликаты определяются по хэшу содержимого (дата, сумма со знаком,
+контрагент, назначение и номер повтора такой же строки в файле) в
+Transaction.import_hash и ArchivedTransaction.import_hash - частичные
+уникальные индексы. Поэтому повторный импорт того же файла или
+пересекающейся выписки ничего не дублирует. Запись - пачками bulk_create
+в одной транзакции; строки закрытых периодов пропускаются.
+"""
+import codecs
+import csv
+import hashlib
+import io
+import re
+from collections import Counter, namedtuple
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+
+from .db import immediate_atomic
+from .debts import apply_created_debts
+from .models import ArchivedTransaction, ImportRule, Transaction
+from .periods import closed_until
+
+
+class StatementError(Exception):
+    pass
+
+
+# Строка выписки: сумма со знаком (минус - списание)
+StatementRow = namedtuple('StatementRow', 'line date amount counterparty inn description')
+
+# Заголовки колонок CSV (в нижнем регистре) -> поле строки
+CSV_COLUMNS = {
+    'date': ('дата', 'дата операции', 'дата проводки', 'дата платежа', 'date'),
+    'amount': ('сумма', 'сумма операции', 'сумма в валюте счета', 'amount'),
+    'income': ('приход', 'поступление', 'зачисление', 'кредит'),
+    'expense': ('расход', 'списание', 'дебет'),
+    'counterparty': (
+        'контрагент', 'наименование контрагента', 'плательщик/получатель', 'получатель/плательщик', 'counterparty',
+    ),
+    'inn': ('инн', 'инн контрагента'),
+    'description': ('назначение платежа', 'назначение', 'описание', 'description'),
+}
+
+DATE_FORMATS = ('%d.%m.%Y', '%Y-%m-%d', '%d.%m.%y', '%d/%m/%Y')
+
+ONE_C_MARKER = '1CClientBankExchange'
+
+_SPACES_RE = re.compile(r'\s+')
+_DESCRIPTION_LENGTH = Transaction._meta.get_field('description').max_length
+
+
+def _normalize(value):
+    return _SPACES_RE.sub(' ', value or '').strip().casefold()
+
+
+def parse_amount(value):
+    """Сумма из выписки: пробелы между разрядами, запятая или точка, минус"""
+    value = (value or '').replace('\xa0', '').replace(' ', '').replace('−', '-').replace(',', '.')
+    if not value:
+        return None
+    try:
+        return Decimal(value).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f'некорректная сумма «{value}»')
+
+
+def parse_date(value):
+    """Дата из выписки (время после даты отбрасывается)"""
+    return _parse_date((value or '').strip().split(' ')[0])
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(value):
+    # Дат в выписке немного, а strptime медленный - разбор кэшируется
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f'некорректная дата «{value}»')
+
+
+def open_statement(path, encoding=None):
+    """
+    Текстовый поток выписки. Без encoding кодировка определяется по
+    началу файла: UTF-8 (с BOM или без), иначе windows-1251 (1С, банки).
+    """
+    raw = open(path, 'rb')
+    if encoding is None:
+        sample = raw.peek(64 * 1024)
+        if sample.startswith(codecs.BOM_UTF8):
+            encoding = 'utf-8-sig'
+        else:
+            try:
+                sample.decode('utf-8')
+                encoding = 'utf-8'
+            except UnicodeDecodeError as e:
+                # Обрезанный на границе буфера символ - еще UTF-8
+                encoding = 'utf-8' if e.start >= len(sample) - 3 else 'cp1251'
+    return io.TextIOWrapper(raw, encoding=encoding, newline='')
+
+
+def iter_1c_rows(lines):
+    """Строки выписки формата 1CClientBankExchange: секции СекцияДокумент ... КонецДокумента"""
+    accounts = set()
+    document = None
+    for number, line in enumerate(lines, 1):
+        key, _sep, value = line.rstrip('\r\n').partition('=')
+        key = key.strip()
+        if key == 'РасчСчет':
+            accounts.add(value.strip())
+        elif key == 'СекцияДокумент':
+            document = {'line': number}
+        elif key == 'КонецДокумента' and document is not None:
+            yield _row_from_1c(document, accounts)
+            document = None
+        elif document is not None and key:
+            document[key] = value.strip()
+
+
+def _row_from_1c(document, accounts):
+    line = document['line']
+    try:
+        amount = parse_amount(document.get('Сумма'))
+        if amount is None:
+            raise ValueError('нет суммы')
+        # Списание: есть дата списания или платит наш счет
+        outgoing = bool(document.get('ДатаСписано')) or (
+            not document.get('ДатаПоступило') and document.get('ПлательщикСчет') in accounts
+        )
+        date = parse_date(document.get('ДатаСписано') or document.get('ДатаПоступило') or document.get('Дата'))
+    except ValueError as e:
+        raise StatementError(f'Документ в строке {line}: {e}')
+    side = 'Получатель' if outgoing else 'Плательщик'
+    return StatementRow(
+        line, date, -amount if outgoing else amount,
+        document.get(f'{side}1') or document.get(side, ''),
+        document.get(f'{side}ИНН', ''),
+        document.get('НазначениеПлатежа', ''),
+    )
+
+
+def _csv_columns(header):
+    columns = {}
+    for index, title in enumerate(header):
+        title = _normalize(title)
+        for field, aliases in CSV_COLUMNS.items():
+            if title in aliases and field not in columns:
+                columns[field] = index
+    if 'date' not in columns or not ({'amount', 'income', 'expense'} & set(columns)):
+        raise StatementError(f'В заголовке CSV не найдены колонки даты и суммы: {header}')
+    return columns
+
+
+def iter_csv_rows(lines):
+    """Строки выписки CSV: разделитель ; , или табуляция, первая строка - заголовок"""
+    lines = iter(lines)
+    first = next(lines, '')
+    try:
+        dialect = csv.Sniffer().sniff(first, delimiters=';,\t')
+    except csv.Error:
+        raise StatementError('Не удалось определить разделитель CSV')
+    reader = csv.reader(_chain(first, lines), dialect)
+    columns = _csv_columns(next(reader))
+
+    def cell(values, field):
+        index = columns.get(field)
+        return values[index].strip() if index is not None and index < len(values) else ''
+
+    for values in reader:
+        if not any(value.strip() for value in values):
+            continue
+        line = reader.line_num
+        try:
+            amount = parse_amount(cell(values, 'amount'))
+            if amount is None:
+                # Отдельные колонки прихода и расхода
+                amount = (parse_amount(cell(values, 'income')) or 0) - abs(parse_amount(cell(values, 'expense')) or 0)
+            row = StatementRow(
+                line, parse_date(cell(values, 'date')), amount,
+                cell(values, 'counterparty'), cell(values, 'inn'), cell(values, 'description'),
+            )
+        except ValueError as e:
+            raise StatementError(f'Строка {line}: {e}')
+        if row.amount:
+            yield row
+
+
+def _chain(first, lines):
+    yield first
+    yield from lines
+
+
+def iter_statement_rows(fh):
+    """Строки выписки из текстового потока: формат по первой строке"""
+    first = fh.readline()
+    if first.lstrip('\ufeff').startswith(ONE_C_MARKER):
+        return iter_1c_rows(_chain(first, fh))
+    return iter_csv_rows(_chain(first, fh))
+
+
+def row_hash(row, occurrence=0):
+    """Хэш содержимого строки; occurrence - номер повтора такой же строки в файле"""
+    key = '\x1f'.join((
+        row.date.isoformat(), str(row.amount), _normalize(row.counterparty), _normalize(row.description),
+        str(occurrence),
+    ))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class RuleMatcher:
+    """Активные правила ImportRule в памяти: первое подходящее по приоритету"""
+
+    def __init__(self, rules=None):
+        if rules is None:
+            rules = ImportRule.objects.filter(is_active=True).order_by('priority', 'id')
+        self.rules = [(rule, _normalize(rule.pattern)) for rule in rules]
+        self.fields = {rule.field for rule, _pattern in self.rules}
+
+    def match(self, row):
+        if not self.rules:
+            return None
+        direction = 'income' if row.amount > 0 else 'expense'
+        values = {field: _normalize(getattr(row, field)) for field in self.fields}
+        for rule, pattern in self.rules:
+            if rule.direction and rule.direction != direction:
+                continue
+            if pattern and pattern in values[rule.field]:
+                return rule
+        return None
+
+
+def _build_transaction(import_hash, row, rule, default_category):
+    return Transaction(
+        amount=abs(row.amount),
+        transaction_type=(rule and rule.transaction_type) or ('income' if row.amount > 0 else 'expense'),
+        category_id=rule.category_id if rule else default_category.pk,
+        contractor_id=rule.contractor_id if rule else None,
+        date=row.date,
+        description=(row.description or row.counterparty)[:_DESCRIPTION_LENGTH] or None,
+        import_hash=import_hash,
+    )
+
+
+def import_statement(rows, default_category=None, batch_size=None, dry_run=False):
+    """
+    Импорт строк выписки (iter_statement_rows) в транзакции; dry_run -
+    все то же, но транзакция откатывается.
+    Возвращает Counter: rows, created, duplicates, unmatched, closed.
+    """
+    batch_size = batch_size or settings.BANK_IMPORT_BATCH_SIZE
+    matcher = RuleMatcher()
+    until = closed_until()
+    stats = Counter()
+    occurrences = Counter()
+    pending = []
+
+    def flush():
+        hashes = [import_hash for import_hash, _row, _rule in pending]
+        existing = set(Transaction._base_manager.filter(import_hash__in=hashes).values_list('import_hash', flat=True))
+        existing.update(
+            ArchivedTransaction._base_manager.filter(import_hash__in=hashes).values_list('import_hash', flat=True)
+        )
+        # Объекты - только для новых строк: при повторном импорте их почти нет
+        created = [
+            _build_transaction(import_hash, row, rule, default_category)
+            for import_hash, row, rule in pending if import_hash not in existing
+        ]
+        # bulk_create не вызывает save() и сигналов: закрытые периоды проверены выше, долги - здесь
+        Transaction.objects.bulk_create(created, batch_size=batch_size)
+        apply_created_debts(created)
+        stats['created'] += len(created)
+        stats['duplicates'] += len(pending) - len(created)
+        pending.clear()
+
+    with immediate_atomic():
+        for row in rows:
+            stats['rows'] += 1
+            base_key = row_hash(row)
+            occurrence = occurrences[base_key]
+            occurrences[base_key] += 1
+            if until is not None and row.date <= until:
+                stats['closed'] += 1
+                continue
+            rule = matcher.match(row)
+            if rule is None and default_category is None:
+                stats['unmatched'] += 1
+                continue
+            pending.append((base_key if not occurrence else row_hash(row, occurrence), row, rule))
+            if len(pending) >= batch_size:
+                flush()
+        if pending:
+            flush()
+        if dry_run:
+            transaction.set_rollback(True)
+    return stats
@@ -0,0 +1,175 @@
+"""
+Массовая правка позиций смет.
+
+bulk_edit_items меняет выбранные позиции одной пачкой: вид и значение
+дохода (задать или сдвинуть на величину), процент, количество (умножить
+на коэффициент), цену из текущего прайса. Суммы пересчитываются в
+памяти (_calculate_amounts), в базу - один bulk_update без save() на
+каждую строку. Итоги затронутых смет считаются одним запросом после
+записи; для утвержденных смет новая ревизия снимка - одна на смету,
+после коммита. Значения проверяются до записи: NaN и бесконечность
+отклоняются, а результат должен помещаться в max_digits полей позиции
+(иначе PostgreSQL отвечает DataError на весь bulk_update).
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from .db import immediate_atomic
+from .models import ESTIMATE_TOTAL_FIELDS, Estimate, EstimateItem
+from .snapshots import schedule_snapshot_refresh
+
+
+# Операции: ключ -> описание (для формы и ошибок API)
+BULK_EDIT_OPERATIONS = {
+    'income_type': 'Вид дохода',
+    'income_value': 'Значение дохода',
+    'income_value_delta': 'Изменить значение дохода на',
+    'is_percentage': 'Процент',
+    'quantity_factor': 'Умножить количество на',
+    'reset_unit_price': 'Цена из прайса',
+}
+
+# Поля позиции, которые пишет bulk_update
+BULK_EDIT_FIELDS = (
+    'income_type', 'income_value', 'is_percentage', 'quantity', 'unit_price',
+    'base_price', 'income_amount', 'client_price', 'contractor_price', 'updated_at',
+)
+
+_CENT = Decimal('0.01')
+
+# Десятичные поля, которые пишет bulk_update (для проверки max_digits)
+_DECIMAL_FIELDS = [
+    field for field in (EstimateItem._meta.get_field(name) for name in BULK_EDIT_FIELDS)
+    if field.get_internal_type() == 'DecimalField'
+]
+
+
+def _decimal(operations, key):
+    try:
+        value = Decimal(str(operations[key]))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f'{BULK_EDIT_OPERATIONS[key]}: некорректное число')
+    if not value.is_finite():
+        raise ValueError(f'{BULK_EDIT_OPERATIONS[key]}: некорректное число')
+    return value
+
+
+def _fits(field, value):
+    """Помещается ли значение в DecimalField после округления до decimal_places"""
+    return abs(value) < Decimal(10) ** (field.max_digits - field.decimal_places)
+
+
+def _check_limits(item):
+    """ValueError, если пересчитанное значение позиции не помещается в поле"""
+    for field in _DECIMAL_FIELDS:
+        value = getattr(item, field.attname)
+        if value is not None and not _fits(field, Decimal(value)):
+            raise ValueError(
+                f'Позиция #{item.pk}: {field.verbose_name} {value} не помещается в поле '
+                f'(не больше {field.max_digits - field.decimal_places} знаков до запятой)'
+            )
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'on', 'yes')
+    return bool(value)
+
+
+def parse_operations(operations):
+    """
+    Проверка и приведение операций (dict из формы или JSON).
+    Пустые значения пропускаются; ValueError - неизвестная операция или
+    некорректное значение.
+    """
+    unknown = set(operations) - set(BULK_EDIT_OPERATIONS)
+    if unknown:
+        raise ValueError(f'Неизвестные операции: {", ".join(sorted(unknown))}')
+    operations = {key: value for key, value in operations.items() if value not in (None, '')}
+    parsed = {}
+    if 'income_type' in operations:
+        choices = {value for value, _label in EstimateItem.INCOME_TYPE_CHOICES}
+        # 'none' - снять доход (пустая строка из формы означает «не менять»)
+        income_type = '' if operations['income_type'] == 'none' else operations['income_type']
+        if income_type not in choices:
+            raise ValueError(f'Неизвестный вид дохода: {income_type}')
+        parsed['income_type'] = income_type
+    if 'income_value' in operations and 'income_value_delta' in operations:
+        raise ValueError('Значение дохода: задайте новое значение или изменение, не оба')
+    for key in ('income_value', 'income_value_delta', 'quantity_factor'):
+        if key in operations:
+            parsed[key] = _decimal(operations, key)
+    if parsed.get('income_value', 0) < 0:
+        raise ValueError('Значение дохода не может быть отрицательным')
+    # Коэффициент ограничен так же, как само количество: иначе quantize не округлит произведение
+    for key, field_name in (('income_value', 'income_value'), ('income_value_delta', 'income_value'),
+                            ('quantity_factor', 'quantity')):
+        if key in parsed and not _fits(EstimateItem._meta.get_field(field_name), parsed[key]):
+            raise ValueError(f'{BULK_EDIT_OPERATIONS[key]}: слишком большое число')
+    if parsed.get('quantity_factor', 1) <= 0:
+        raise ValueError('Коэффициент количества должен быть больше нуля')
+    if 'is_percentage' in operations:
+        parsed['is_percentage'] = _flag(operations['is_percentage'])
+    if _flag(operations.get('reset_unit_price')):
+        parsed['reset_unit_price'] = True
+    if not parsed:
+        raise ValueError('Не задано ни одной операции')
+    return parsed
+
+
+def _apply(item, operations):
+    """Операции к одной позиции в памяти, с пересчетом сумм"""
+    if 'income_type' in operations:
+        item.income_type = operations['income_type']
+    if 'income_value' in operations:
+        item.income_value = operations['income_value']
+    if 'income_value_delta' in operations:
+        item.income_value = max(item.income_value + operations['income_value_delta'], Decimal('0'))
+    if 'is_percentage' in operations:
+        item.is_percentage = operations['is_percentage']
+    if 'quantity_factor' in operations:
+        item.quantity = (item.quantity * operations['quantity_factor']).quantize(_CENT, rounding=ROUND_HALF_UP)
+    if operations.get('reset_unit_price') and item.price_item is not None:
+        item.unit_price = item.price_item.price_per_unit
+    item._calculate_amounts()
+
+
+def estimate_totals(estimate_ids):
+    """Итоги смет одним запросом: {id сметы: {'client', 'contractor', 'income', 'base'}}"""
+    rows = EstimateItem.objects.filter(estimate_id__in=estimate_ids).values('estimate_id').annotate(**{
+        key: Sum(field) for key, field in ESTIMATE_TOTAL_FIELDS.items()
+    })
+    totals = {
+        estimate_id: {key: Decimal('0.00') for key in ESTIMATE_TOTAL_FIELDS} for estimate_id in estimate_ids
+    }
+    for row in rows:
+        totals[row['estimate_id']] = {
+            key: (row[key] or Decimal('0')).quantize(_CENT) for key in ESTIMATE_TOTAL_FIELDS
+        }
+    return totals
+
+
+def bulk_edit_items(queryset, operations):
+    """
+    Применить операции (см. parse_operations) к позициям queryset.
+    Возвращает {'items': число позиций, 'totals': итоги затронутых смет}.
+    """
+    operations = parse_operations(operations)
+    now = timezone.now()
+    with immediate_atomic():
+        items = list(queryset.select_related('price_item').order_by('id'))
+        for item in items:
+            _apply(item, operations)
+            _check_limits(item)
+            item.updated_at = now
+        EstimateItem.objects.bulk_update(items, BULK_EDIT_FIELDS, batch_size=settings.BULK_EDIT_BATCH_SIZE)
+        estimate_ids = sorted({item.estimate_id for item in items})
+        # bulk_update не вызывает сигналов позиций - снимки утвержденных смет обновляем сами
+        for estimate_id in Estimate.objects.filter(
+            pk__in=estimate_ids, status__in=Estimate.APPROVED_STATUSES,
+        ).values_list('id', flat=True):
+            schedule_snapshot_refresh(estimate_id)
+    return {'items': len(items), 'totals': estimate_totals(estimate_ids)}
@@ -0,0 +1,198 @@
+"""
+Поколенческий кэш результатов запросов.
+
+У каждой модели есть счетчик версии в кэше. Он увеличивается при
+save/delete (сигналы) и при массовых операциях (VersionedQuerySet).
+Результаты кэшируются под ключами, в которые входят версии моделей,
+от которых они зависят, поэтому после изменения данных старые ключи
+просто перестают использоваться и вытесняются по TIMEOUT - явного
+удаления ключей не требуется, и все воркеры видят одни и те же версии
+при общем бэкенде кэша (файловом или Redis).
+
+Изменение внутри транзакции увеличивает версию дважды: сразу (чтобы
+чтения в той же транзакции не брали старый результат) и после коммита
+(schedule_version_bump) - иначе другой воркер мог бы между первым
+увеличением и коммитом закэшировать еще старые строки под новой версией.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+
+from . import metrics
+
+
+# Модели, версии которых отслеживаются
+VERSIONED_MODELS = (
+    'control.CustomUser',
+    'control.WorkType',
+    'control.MaterialType',
+    'control.PriceItem',
+    'control.Category',
+    'control.Project',
+    'control.Object',
+    'control.Stage',
+    'control.Estimate',
+    'control.EstimateItem',
+    'control.Transaction',
+    'control.ArchivedTransaction',
+    'control.ClosedPeriod',
+)
+
+_MISSING = object()
+
+
+def _label(model_or_label):
+    if isinstance(model_or_label, str):
+        return model_or_label
+    return model_or_label._meta.label
+
+
+def _version_key(label):
+    return f'ver:{label.lower()}'
+
+
+def _initial_version():
+    # Новая версия всегда больше любой прежней, даже если ключ был вытеснен
+    return time.time_ns()
+
+
+def get_versions(labels):
+    """Текущие версии моделей {label: version} одним обращением к кэшу"""
+    keys = {_version_key(label): label for label in labels}
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, label in keys.items():
+        value = found.get(key)
+        if value is None:
+            cache.add(key, _initial_version(), None)
+            value = cache.get(key)
+        versions[label] = value
+    return versions
+
+
+async def aget_versions(labels):
+    """Асинхронный вариант get_versions для async-представлений"""
+    keys = {_version_key(label): label for label in labels}
+    found = await cache.aget_many(list(keys))
+    versions = {}
+    for key, label in keys.items():
+        value = found.get(key)
+        if value is None:
+            await cache.aadd(key, _initial_version(), None)
+            value = await cache.aget(key)
+        versions[label] = value
+    return versions
+
+
+def bump_version(model_or_label):
+    """Увеличить версию модели - все результаты, зависящие от нее, устаревают"""
+    key = _version_key(_label(model_or_label))
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Ключа еще нет (или вытеснен)
+        cache.set(key, _initial_version(), None)
+
+
+class _BumpVersion:
+    """Отложенное до коммита увеличение версии одной модели"""
+
+    def __init__(self, label):
+        self.label = label
+
+    def __call__(self):
+        bump_version(self.label)
+
+
+def schedule_version_bump(model_or_label, using=DEFAULT_DB_ALIAS):
+    """
+    Увеличить версию после изменения данных: сразу и, внутри транзакции,
+    еще раз после коммита (одно отложенное увеличение на модель)
+    """
+    label = _label(model_or_label)
+    bump_version(label)
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        return
+    for _savepoints, func, *_rest in connection.run_on_commit:
+        if isinstance(func, _BumpVersion) and func.label == label:
+            return
+    transaction.on_commit(_BumpVersion(label), using=using)
+
+
+def make_key(name, args, versions):
+    """Ключ кэша: имя результата, аргументы и версии зависимостей"""
+    args_part = ':'.join(str(arg) for arg in args)
+    if len(args_part) > 100:
+        args_part = hashlib.md5(args_part.encode('utf-8')).hexdigest()
+    versions_part = '.'.join(str(versions[label]) for label in sorted(versions))
+    return f'q:{name}:{args_part}:{versions_part}'
+
+
+def cached(name, args, depends_on, compute, timeout=None):
+    """
+    Вернуть результат compute() из кэша или вычислить и сохранить.
+
+    name       - имя результата (например, 'estimate_totals')
+    args       - аргументы, отличающие результаты друг от друга (id и т.п.)
+    depends_on - модели/метки моделей, от изменения которых зависит результат
+    timeout    - срок жизни, по умолчанию TIMEOUT бэкенда
+    """
+    versions = get_versions([_label(model) for model in depends_on])
+    key = make_key(name, args, versions)
+    value = cache.get(key, _MISSING)
+    metrics.inc('cache_requests_total', name=name, result='miss' if value is _MISSING else 'hit')
+    if value is _MISSING:
+        value = compute()
+        if timeout is None:
+            cache.set(key, value)
+        else:
+            cache.set(key, value, timeout)
+    return value
+
+
+async def acached(name, args, depends_on, compute, timeout=None):
+    """Асинхронный вариант cached: compute - корутинная функция"""
+    versions = await aget_versions([_label(model) for model in depends_on])
+    key = make_key(name, args, versions)
+    value = await cache.aget(key, _MISSING)
+    metrics.inc('cache_requests_total', name=name, result='miss' if value is _MISSING else 'hit')
+    if value is _MISSING:
+        value = await compute()
+        if timeout is None:
+            await cache.aset(key, value)
+        else:
+            await cache.aset(key, value, timeout)
+    return value
+
+
+def bump_version_on_change(sender, using=None, **kwargs):
+    """Обработчик post_save/post_delete для моделей из VERSIONED_MODELS"""
+    if sender._meta.label in VERSIONED_MODELS:
+        schedule_version_bump(sender, using=using or DEFAULT_DB_ALIAS)
+
+
+class VersionedQuerySet(models.QuerySet):
+    """QuerySet, увеличивающий версию модели после массовых операций без сигналов"""
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        schedule_version_bump(self.model, using=self.db)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        schedule_version_bump(self.model, using=self.db)
+        return created
+
+    def bulk_update(self, objs, *args, **kwargs):
+        rows = super().bulk_update(objs, *args, **kwargs)
+        schedule_version_bump(self.model, using=self.db)
+        return rows
+
+    def delete(self):
+        result = super().delete()
+        schedule_version_bump(self.model, using=self.db)
+        return result
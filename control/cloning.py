@@ -0,0 +1,80 @@
+"""
+Копирование смет и объектов-шаблонов.
+
+clone_estimate копирует смету с позициями в тот же или другой этап,
+clone_object создает новый объект по объекту-шаблону: этапы, сметы
+и позиции. Суммы позиций рассчитываются заранее (_calculate_amounts)
+и пишутся bulk_create пачками - без save() и сигналов на каждую
+строку, в одной транзакции. reprice=True берет цены позиций с прайсом
+из текущего прайса вместо цен шаблона. Копии смет - черновики.
+"""
+from django.conf import settings
+
+from .db import immediate_atomic
+from .models import Estimate, EstimateItem, Object, PriceItem, Stage
+
+
+# Поля позиции, которые переносятся в копию как есть
+ITEM_COPY_FIELDS = ('price_item_id', 'description', 'quantity', 'unit_price', 'income_type', 'income_value', 'is_percentage')
+
+
+def _current_prices(items):
+    """Текущие цены прайса для позиций: {price_item_id: цена}"""
+    ids = {item.price_item_id for item in items if item.price_item_id}
+    return dict(PriceItem.objects.filter(pk__in=ids).values_list('id', 'price_per_unit')) if ids else {}
+
+
+def _copy_items(items, estimate_ids, reprice=False):
+    """
+    Копии позиций с рассчитанными суммами; estimate_ids - {id сметы-источника: id копии}.
+    Возвращает число созданных позиций.
+    """
+    items = list(items)
+    prices = _current_prices(items)
+    copies = []
+    for item in items:
+        copy = EstimateItem(estimate_id=estimate_ids[item.estimate_id], **{
+            field: getattr(item, field) for field in ITEM_COPY_FIELDS
+        })
+        # Как в EstimateItem.save: без цены или с переоценкой - цена из прайса
+        if copy.price_item_id in prices and (reprice or not copy.unit_price):
+            copy.unit_price = prices[copy.price_item_id]
+        copy._calculate_amounts()
+        copies.append(copy)
+    EstimateItem.objects.bulk_create(copies, batch_size=settings.CLONE_BATCH_SIZE)
+    return len(copies)
+
+
+def clone_estimate(estimate, stage=None, reprice=False):
+    """Копия сметы-черновика с позициями в этапе stage (по умолчанию - в том же). Возвращает (смета, позиций)"""
+    with immediate_atomic():
+        copy = Estimate.objects.create(stage=stage or estimate.stage)
+        count = _copy_items(estimate.items.order_by('id'), {estimate.pk: copy.pk}, reprice)
+    return copy, count
+
+
+def clone_object(template, project, name=None, reprice=False):
+    """
+    Новый объект в проекте project по объекту-шаблону template: этапы,
+    сметы (черновики) и позиции. Возвращает (объект, {'stages', 'estimates', 'items'}).
+    """
+    with immediate_atomic():
+        build_object = Object.objects.create(
+            name=name or template.name, project=project, address=template.address,
+            estimated_budget=template.estimated_budget,
+        )
+        stages = list(template.stages.order_by('order'))
+        stage_copies = Stage.objects.bulk_create([
+            Stage(object=build_object, order=stage.order, name=stage.name, is_active=stage.is_active)
+            for stage in stages
+        ], batch_size=settings.CLONE_BATCH_SIZE)
+        stage_ids = {stage.pk: copy.pk for stage, copy in zip(stages, stage_copies)}
+        estimates = list(Estimate.objects.filter(stage__object=template).order_by('stage__order', 'id'))
+        estimate_copies = Estimate.objects.bulk_create([
+            Estimate(stage_id=stage_ids[estimate.stage_id]) for estimate in estimates
+        ], batch_size=settings.CLONE_BATCH_SIZE)
+        estimate_ids = {estimate.pk: copy.pk for estimate, copy in zip(estimates, estimate_copies)}
+        items = _copy_items(
+            EstimateItem.objects.filter(estimate__stage__object=template).order_by('id'), estimate_ids, reprice,
+        )
+    return build_object, {'stages': len(stage_copies), 'estimates': len(estimate_copies), 'items': items}
@@ -0,0 +1,180 @@
+"""
+Служебные функции для работы с базой данных: порядок моделей по зависимостям,
+перенос данных пачками, сброс последовательностей
+"""
+import os
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+
+
+def ordered_models(app_labels=None):
+    """
+    Все управляемые модели проекта (включая промежуточные таблицы M2M)
+    в порядке зависимостей по внешним ключам: сначала те, на кого ссылаются.
+    """
+    candidates = [
+        model for model in apps.get_models(include_auto_created=True)
+        if model._meta.managed and not model._meta.proxy
+        and (app_labels is None or model._meta.app_label in app_labels)
+    ]
+    candidate_set = set(candidates)
+    ordered, visited = [], set()
+
+    def visit(model, stack):
+        if model in visited or model in stack:
+            # Циклические ссылки разрешаются отложенной проверкой ограничений
+            return
+        stack.add(model)
+        for field in model._meta.concrete_fields:
+            related = field.related_model if field.is_relation else None
+            if related is not None and related is not model and related in candidate_set:
+                visit(related, stack)
+        stack.discard(model)
+        visited.add(model)
+        ordered.append(model)
+
+    for model in candidates:
+        visit(model, set())
+    return ordered
+
+
+@contextmanager
+def preserve_auto_timestamps(model_list):
+    """
+    Временно отключает auto_now/auto_now_add, чтобы bulk_create сохранил
+    исходные даты создания и обновления при переносе данных.
+    """
+    changed = []
+    for model in model_list:
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.DateField) and (field.auto_now or field.auto_now_add):
+                changed.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in changed:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def reset_sequences(model_list, using=DEFAULT_DB_ALIAS):
+    """Сдвигает счетчики автоинкремента после вставки строк с явными id (PostgreSQL)"""
+    connection = connections[using]
+    statements = connection.ops.sequence_reset_sql(no_style(), model_list)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def register_sqlite_database(alias, path):
+    """Подключает дополнительный файл SQLite под указанным алиасом"""
+    # configure_settings дополняет словарь значениями по умолчанию (OPTIONS, TEST и т.д.)
+    configured = connections.configure_settings({
+        DEFAULT_DB_ALIAS: {'ENGINE': 'django.db.backends.dummy'},
+        alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(path)},
+    })
+    connections.settings[alias] = configured[alias]
+    return connections[alias]
+
+
+# Допустимые значения строковых PRAGMA, которые можно задать через .env
+SQLITE_PRAGMA_CHOICES = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'},
+}
+
+SQLITE_SYNCHRONOUS_NAMES = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+SQLITE_TEMP_STORE_NAMES = {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'}
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """
+    Обработчик connection_created: применяет PRAGMA из settings.SQLITE_PRAGMAS
+    к каждому новому соединению SQLite (WAL, busy_timeout, mmap, кэш страниц).
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None) or {}
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            if value is None or value == '':
+                continue
+            if name in SQLITE_PRAGMA_CHOICES:
+                value = str(value).upper()
+                if value not in SQLITE_PRAGMA_CHOICES[name]:
+                    raise ValueError(f'Недопустимое значение PRAGMA {name}: {value}')
+            else:
+                value = int(value)
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def immediate_atomic(using=DEFAULT_DB_ALIAS):
+    """
+    transaction.atomic(), который на SQLite начинается с BEGIN IMMEDIATE.
+
+    Блокировка на запись берется сразу, и конкурирующий писатель ждет
+    busy_timeout, а не получает "database is locked" при попытке
+    повысить читающую транзакцию до пишущей.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    connection.ensure_connection()
+    previous_mode = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            connection.transaction_mode = previous_mode
+            yield
+    finally:
+        connection.transaction_mode = previous_mode
+
+
+def wrap_connections(stack, wrapper, aliases=None):
+    """
+    execute_wrapper на соединениях текущего потока (всех или aliases) до
+    закрытия stack. Соединения привязаны к потоку: под ASGI синхронная
+    часть запроса выполняется в отдельном потоке, поэтому async-middleware
+    ставят обертку через sync_to_async(wrap_connections).
+    """
+    for connection in [connections[alias] for alias in aliases] if aliases else connections.all():
+        stack.enter_context(connection.execute_wrapper(wrapper))
+
+
+def sqlite_status(using=DEFAULT_DB_ALIAS):
+    """Текущие PRAGMA и размеры файлов БД/WAL для страницы диагностики"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return None
+    values = {}
+    with connection.cursor() as cursor:
+        for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size',
+                     'temp_store', 'page_size', 'page_count', 'freelist_count', 'wal_autocheckpoint'):
+            cursor.execute(f'PRAGMA {name}')
+            row = cursor.fetchone()
+            values[name] = row[0] if row else None
+    values['synchronous'] = SQLITE_SYNCHRONOUS_NAMES.get(values['synchronous'], values['synchronous'])
+    values['temp_store'] = SQLITE_TEMP_STORE_NAMES.get(values['temp_store'], values['temp_store'])
+
+    path = str(connection.settings_dict['NAME'])
+    files = {}
+    for label, file_path in (('db', path), ('wal', path + '-wal'), ('shm', path + '-shm')):
+        files[label] = os.path.getsize(file_path) if os.path.exists(file_path) else None
+    return {
+        'path': path,
+        'pragmas': values,
+        'db_size': files['db'],
+        'wal_size': files['wal'],
+        'shm_size': files['shm'],
+        'transaction_mode': connection.transaction_mode or 'DEFERRED',
+    }
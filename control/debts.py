@@ -0,0 +1,173 @@
+"""
+Долги контрагентов.
+
+DebtPosition хранит по каждому контрагенту суммы долговых операций
+нарастающим итогом и остатки: receivable (должен нам: выдано в долг
+минус возвращено нам) и payable (мы должны: взято в долг минус
+возвращено нами). Позиция меняется на разницу при каждом сохранении
+и удалении транзакции (сигналы в control/signals.py), без пересчета
+истории. Массовые операции сигналов не вызывают - после них позиции
+пересчитываются командой rebuild_debt_positions, а вклад новых строк
+bulk_create добавляется через apply_created_debts.
+Перенос в архив позиций не меняет: архивные транзакции тоже учитываются.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .db import immediate_atomic
+from .models import DebtPosition, LedgerTransaction
+
+
+# Тип операции -> накопительное поле позиции
+DEBT_FIELDS = {
+    'debt_give': 'given',
+    'debt_received': 'returned',
+    'debt_receive': 'borrowed',
+    'debt_repay': 'repaid',
+}
+
+_paused = ContextVar('control_debt_tracking_paused', default=False)
+
+
+@contextmanager
+def debt_tracking_paused():
+    """Не менять позиции внутри блока (перенос транзакций между таблицами)"""
+    token = _paused.set(True)
+    try:
+        yield
+    finally:
+        _paused.reset(token)
+
+
+def _effect(values, sign):
+    """Вклад транзакции в позиции: {contractor_id: {поле: сумма, 'count': n}}"""
+    contractor_id, transaction_type, amount = values
+    field = DEBT_FIELDS.get(transaction_type)
+    if field is None or contractor_id is None:
+        return {}
+    return {contractor_id: {field: sign * Decimal(str(amount)), 'count': sign}}
+
+
+def _transaction_values(transaction):
+    return transaction.contractor_id, transaction.transaction_type, transaction.amount
+
+
+def apply_debt_changes(changes, using=DEFAULT_DB_ALIAS):
+    """Прибавляет изменения {contractor_id: {поле: сумма, 'count': n}} к позициям одним UPDATE на контрагента"""
+    for contractor_id, delta in changes.items():
+        sums = {field: delta.get(field, Decimal('0')) for field in DEBT_FIELDS.values()}
+        if not any(sums.values()) and not delta.get('count'):
+            continue
+        manager = DebtPosition.objects.using(using)
+        manager.get_or_create(contractor_id=contractor_id)
+        manager.filter(contractor_id=contractor_id).update(
+            **{field: F(field) + value for field, value in sums.items() if value},
+            receivable=F('receivable') + sums['given'] - sums['returned'],
+            payable=F('payable') + sums['borrowed'] - sums['repaid'],
+            operations_count=F('operations_count') + delta.get('count', 0),
+            updated_at=timezone.now(),
+        )
+
+
+def _merge(*effects):
+    result = {}
+    for effect in effects:
+        for contractor_id, delta in effect.items():
+            target = result.setdefault(contractor_id, {})
+            for key, value in delta.items():
+                target[key] = target.get(key, 0) + value
+    return result
+
+
+def apply_created_debts(transactions, using=DEFAULT_DB_ALIAS):
+    """Вклад созданных без сигналов транзакций (bulk_create) в позиции"""
+    apply_debt_changes(
+        _merge(*(_effect(_transaction_values(transaction), 1) for transaction in transactions)), using=using,
+    )
+
+
+def remember_debt_values(sender, instance, raw=False, using=None, **kwargs):
+    """pre_save: прежние контрагент, тип и сумма изменяемой транзакции"""
+    instance._debt_previous = None
+    if raw or _paused.get() or instance._state.adding or instance.pk is None:
+        return
+    instance._debt_previous = (
+        sender._base_manager.using(using).filter(pk=instance.pk)
+        .values_list('contractor_id', 'transaction_type', 'amount').first()
+    )
+
+
+def update_debt_on_save(sender, instance, created=False, raw=False, using=None, **kwargs):
+    """post_save: позиция меняется на разницу между новым и прежним вкладом"""
+    if raw or _paused.get():
+        return
+    previous = getattr(instance, '_debt_previous', None)
+    changes = _merge(
+        _effect(_transaction_values(instance), 1),
+        _effect(previous, -1) if previous else {},
+    )
+    apply_debt_changes(changes, using=using or DEFAULT_DB_ALIAS)
+
+
+def update_debt_on_delete(sender, instance, using=None, **kwargs):
+    """post_delete: вклад удаленной транзакции вычитается"""
+    if _paused.get():
+        return
+    apply_debt_changes(_effect(_transaction_values(instance), -1), using=using or DEFAULT_DB_ALIAS)
+
+
+def compute_debt_positions(using=DEFAULT_DB_ALIAS):
+    """Позиции по всем транзакциям с архивом одним группирующим запросом: {contractor_id: DebtPosition}"""
+    rows = (
+        LedgerTransaction.objects.using(using)
+        .filter(transaction_type__in=list(DEBT_FIELDS), contractor__isnull=False)
+        .order_by().values('contractor_id', 'transaction_type')
+        .annotate(total=Sum('amount'), count=Count('id'))
+    )
+    positions = {}
+    for row in rows:
+        position = positions.get(row['contractor_id'])
+        if position is None:
+            position = positions[row['contractor_id']] = DebtPosition(contractor_id=row['contractor_id'])
+        # SQLite теряет масштаб DecimalField в SUM - возвращаем копейки явно
+        total = (row['total'] or Decimal('0')).quantize(Decimal('0.01'))
+        setattr(position, DEBT_FIELDS[row['transaction_type']], total)
+        position.operations_count += row['count']
+    for position in positions.values():
+        position.receivable = position.given - position.returned
+        position.payable = position.borrowed - position.repaid
+    return positions
+
+
+def rebuild_debt_positions(using=DEFAULT_DB_ALIAS):
+    """Пересчитать все позиции заново, возвращает их число"""
+    positions = compute_debt_positions(using)
+    with immediate_atomic(using=using):
+        DebtPosition.objects.using(using).all().delete()
+        DebtPosition.objects.using(using).bulk_create(positions.values(), batch_size=1000)
+    return len(positions)
+
+
+def check_debt_positions(using=DEFAULT_DB_ALIAS):
+    """Расхождения сохраненных позиций с пересчетом: [(contractor_id, сохранено, пересчет)]"""
+    fields = list(DEBT_FIELDS.values()) + ['receivable', 'payable', 'operations_count']
+    expected = {
+        contractor_id: tuple(getattr(position, field) for field in fields)
+        for contractor_id, position in compute_debt_positions(using).items()
+    }
+    stored = {
+        row[0]: tuple(row[1:])
+        for row in DebtPosition.objects.using(using).values_list('contractor_id', *fields)
+        # Нулевые позиции (все долги удалены) равны отсутствующим
+        if any(row[1:])
+    }
+    return [
+        (contractor_id, stored.get(contractor_id), expected.get(contractor_id))
+        for contractor_id in sorted(stored.keys() | expected.keys())
+        if stored.get(contractor_id) != expected.get(contractor_id)
+    ]
@@ -0,0 +1,246 @@
+"""
+Экспорт смет: расчет строк по аудитории, XLSX, HTML-предпросмотр
+и потоковые ZIP-архивы по проекту, объекту или этапу
+"""
+import io
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+
+from .models import Estimate, EstimateItem, Object, Project, Stage
+from .snapshots import estimate_lines
+
+
+AUDIENCES = ('client', 'self', 'contractor')
+EXPORT_FORMATS = ('xlsx', 'html')
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Сколько смет забирать из БД за один проход prefetch
+EXPORT_CHUNK_SIZE = 50
+
+
+def xlsx_available():
+    """Установлен ли xlsxwriter"""
+    try:
+        import xlsxwriter  # noqa: F401
+    except Exception:
+        return False
+    return True
+
+
+def estimate_for_export():
+    """
+    Сметы с этапом/объектом/проектом и текущим снимком одним запросом.
+    Утвержденная смета читается из снимка, остальные дочитывают позиции
+    при обращении (control/snapshots.py: estimate_lines).
+    """
+    return Estimate.objects.select_related('stage__object__project', 'current_snapshot')
+
+
+def estimates_with_items(queryset=None):
+    """
+    Сметы с этапом/объектом/проектом, снимком и позициями с прайсом.
+    Позиции и прайсовые позиции подгружаются одним проходом prefetch,
+    кроме позиций утвержденных смет со снимком - они читаются из снимка.
+    """
+    if queryset is None:
+        queryset = Estimate.objects.all()
+    items = (
+        EstimateItem.objects.select_related('price_item')
+        .exclude(estimate__status__in=Estimate.APPROVED_STATUSES, estimate__current_snapshot__isnull=False)
+        .order_by('id')
+    )
+    return queryset.select_related('stage__object__project', 'current_snapshot').prefetch_related(
+        Prefetch('items', queryset=items)
+    )
+
+
+def estimates_under(nodes):
+    """Все сметы под выбранными проектами, объектами или этапами (QuerySet узлов)"""
+    model = nodes.model
+    if model is Project:
+        lookup = 'stage__object__project__in'
+    elif model is Object:
+        lookup = 'stage__object__in'
+    elif model is Stage:
+        lookup = 'stage__in'
+    else:
+        raise ValueError(f'Экспорт смет не поддерживается для {model.__name__}')
+    return Estimate.objects.filter(**{lookup: nodes}).order_by(
+        'stage__object__project__name', 'stage__object__name', 'stage__order', 'id'
+    )
+
+
+def get_audience_total(item, audience):
+    """Сумма позиции для выбранной аудитории"""
+    if audience in ('self', 'contractor'):
+        return item.contractor_price
+    return item.client_price
+
+
+def build_preview_context(estimate, audience):
+    """Данные для HTML-предпросмотра: позиции сгруппированы на материалы и работы"""
+    materials_data, works_data = [], []
+    total_materials, total_works = 0.0, 0.0
+    for item in estimate_lines(estimate):
+        quantity = float(item.quantity)
+        total = float(get_audience_total(item, audience))
+        unit_price = float(total / quantity) if quantity else float(item.unit_price)
+        record = {
+            'name': item.get_item_name(),
+            'unit': item.get_unit(),
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'unit_price_str': f"{unit_price:.2f}",
+            'total': total,
+            'total_str': f"{total:.2f}",
+        }
+        # Группируем по типу price_item (материал/работа)
+        if item.is_material:
+            materials_data.append(record)
+            total_materials += total
+        else:
+            works_data.append(record)
+            total_works += total
+    overall_total = total_materials + total_works
+    return {
+        'estimate': estimate,
+        'audience': audience,
+        'materials_data': materials_data,
+        'works_data': works_data,
+        'total_materials': total_materials,
+        'total_works': total_works,
+        'overall_total': overall_total,
+        'total_materials_str': f"{total_materials:.2f}",
+        'total_works_str': f"{total_works:.2f}",
+        'overall_total_str': f"{overall_total:.2f}",
+    }
+
+
+def render_estimate_preview(estimate, audience, request=None):
+    """HTML предпросмотра сметы строкой"""
+    return render_to_string(
+        'admin/control/estimate/export/preview.html',
+        build_preview_context(estimate, audience),
+        request=request,
+    )
+
+
+def render_estimate_xlsx(estimate, audience):
+    """XLSX сметы для выбранной аудитории (bytes)"""
+    import xlsxwriter
+
+    output = io.BytesIO()
+    wb = xlsxwriter.Workbook(output, {'in_memory': True})
+    ws = wb.add_worksheet('Смета')
+    headers = ['Наименование', 'Ед.', 'Кол-во', 'Цена', 'Сумма']
+    for c, h in enumerate(headers):
+        ws.write(0, c, h)
+    row = 1
+    for item in estimate_lines(estimate):
+        qty = float(item.quantity)
+        # цена по аудитории
+        if item.quantity:
+            price = float(get_audience_total(item, audience) / item.quantity)
+        else:
+            price = float(item.unit_price)
+        ws.write(row, 0, item.get_item_name())
+        ws.write(row, 1, item.get_unit() or '')
+        ws.write(row, 2, qty)
+        ws.write(row, 3, price)
+        ws.write(row, 4, qty * price)
+        row += 1
+    wb.close()
+    return output.getvalue()
+
+
+def _safe_name(value):
+    """Имя папки/файла в архиве без запрещенных символов"""
+    value = re.sub(r'[\\/:*?"<>|\r\n\t]+', '_', str(value)).strip(' .')
+    return value[:80] or '_'
+
+
+def estimate_archive_path(estimate, audience, fmt):
+    """Путь файла сметы внутри архива: проект/объект/этап/смета"""
+    stage = estimate.stage
+    return '/'.join([
+        _safe_name(stage.object.project.name),
+        _safe_name(stage.object.name),
+        _safe_name(f'{stage.order:02d} {stage.name}'),
+        f'estimate_{estimate.pk}_{audience}.{fmt}',
+    ])
+
+
+def _render_estimate_files(estimate, audience, formats):
+    """Рендер всех файлов одной сметы (выполняется в пуле потоков)"""
+    try:
+        files = []
+        if 'xlsx' in formats:
+            files.append((estimate_archive_path(estimate, audience, 'xlsx'), render_estimate_xlsx(estimate, audience)))
+        if 'html' in formats:
+            html = render_estimate_preview(estimate, audience)
+            files.append((estimate_archive_path(estimate, audience, 'html'), html.encode('utf-8')))
+        return files
+    finally:
+        # Данные уже подгружены, но если поток все же открыл соединение - закрываем его
+        connections.close_all()
+
+
+class _ZipStreamBuffer:
+    """
+    Файлоподобный буфер без seek: zipfile пишет в него,
+    а генератор забирает накопленные байты и отдает клиенту.
+    """
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_estimates_zip(estimates, audience='client', formats=EXPORT_FORMATS, workers=None):
+    """
+    Генератор ZIP-архива со сметами.
+
+    Сметы читаются из БД пачками (prefetch позиций на пачку), файлы
+    рендерятся в пуле потоков, а в памяти держится только окно
+    из нескольких готовых смет и текущий кусок архива.
+    """
+    workers = workers or settings.EXPORT_WORKERS
+    buffer = _ZipStreamBuffer()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            pending = deque()
+            for estimate in estimates_with_items(estimates).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                pending.append(pool.submit(_render_estimate_files, estimate, audience, formats))
+                if len(pending) >= workers * 2:
+                    for name, content in pending.popleft().result():
+                        archive.writestr(name, content)
+                        yield buffer.drain()
+            while pending:
+                for name, content in pending.popleft().result():
+                    archive.writestr(name, content)
+                    yield buffer.drain()
+    # Центральный каталог архива дописывается при закрытии
+    yield buffer.drain()
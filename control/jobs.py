@@ -0,0 +1,281 @@
+"""
+Фоновые задачи без внешнего брокера: очередь хранится в таблице BackgroundJob,
+задачи выполняет команда run_jobs в пуле потоков.
+
+Пример:
+    python manage.py run_jobs --workers 2
+"""
+import os
+import socket
+import tempfile
+import time
+import traceback
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import connections
+from django.utils import timezone
+
+from . import metrics, tracing
+from .db import immediate_atomic
+from .models import BackgroundJob
+
+
+# Зарегистрированные обработчики: kind -> (функция, название)
+JOB_HANDLERS = {}
+
+# Право на постановку задачи: kind -> permission (None - только суперпользователь)
+JOB_PERMISSIONS = {}
+
+# Задачи, которые нельзя повторять после падения воркера: часть работы могла
+# быть записана, а повтор создаст ее второй раз
+NON_IDEMPOTENT_KINDS = set()
+
+# Задачи, которые можно поставить через JSON-API (BackgroundJobAdmin.enqueue_view);
+# остальные ставятся только из своих форм и действий админки
+HTTP_ENQUEUE_KINDS = ('export_estimates_zip', 'export_estimate_xlsx', 'recalculate_estimates')
+
+# Модели, сметы которых выгружаются задачей export_estimates_zip
+EXPORT_ZIP_MODELS = ('control.Project', 'control.Object', 'control.Stage')
+
+# Как часто (сек) записывать прогресс в БД
+PROGRESS_INTERVAL = 1.0
+
+
+def register_job(kind, label, permission=None, idempotent=True):
+    """
+    Декоратор обработчика задачи: handler(ctx, **params); permission - право
+    на постановку; idempotent=False - зависшая задача не перезапускается
+    """
+    def decorator(func):
+        JOB_HANDLERS[kind] = (func, label)
+        JOB_PERMISSIONS[kind] = permission
+        if not idempotent:
+            NON_IDEMPOTENT_KINDS.add(kind)
+        return func
+    return decorator
+
+
+def can_enqueue(user, kind):
+    """Может ли пользователь поставить задачу этого типа"""
+    if kind not in JOB_HANDLERS or not user.is_active:
+        return False
+    if user.is_superuser:
+        return True
+    permission = JOB_PERMISSIONS[kind]
+    return permission is not None and user.has_perm(permission)
+
+
+def get_job_label(kind):
+    handler = JOB_HANDLERS.get(kind)
+    return handler[1] if handler else kind
+
+
+def enqueue(kind, params=None, user=None):
+    """Поставить задачу в очередь и вернуть ее"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'Неизвестный тип задачи: {kind}')
+    return BackgroundJob.objects.create(
+        kind=kind,
+        params=params or {},
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class JobContext:
+    """Передается обработчику: прогресс и сохранение результата"""
+
+    def __init__(self, job):
+        self.job = job
+        self._last_progress = 0.0
+
+    def progress(self, done, total, message=''):
+        """Отметить прогресс; в БД пишется не чаще PROGRESS_INTERVAL"""
+        now = time.monotonic()
+        if now - self._last_progress < PROGRESS_INTERVAL and done < total:
+            return
+        self._last_progress = now
+        percent = int(done * 100 / total) if total else 0
+        BackgroundJob.objects.filter(pk=self.job.pk).update(
+            progress=min(percent, 99), message=message[:255], updated_at=timezone.now(),
+        )
+
+    def save_result(self, filename, content):
+        """Сохранить результат: bytes или открытый файл"""
+        if isinstance(content, (bytes, bytearray)):
+            content = ContentFile(content)
+        else:
+            content = File(content)
+        self.job.result_file.save(filename, content, save=False)
+        BackgroundJob.objects.filter(pk=self.job.pk).update(result_file=self.job.result_file.name)
+
+
+def claim_next_job(worker):
+    """Взять первую задачу из очереди (условный UPDATE защищает от гонки воркеров)"""
+    while True:
+        with immediate_atomic():
+            job = BackgroundJob.objects.filter(status='queued').order_by('created_at', 'id').first()
+            if job is None:
+                return None
+            claimed = BackgroundJob.objects.filter(pk=job.pk, status='queued').update(
+                status='running', worker=worker, started_at=timezone.now(), updated_at=timezone.now(),
+            )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def run_job(job):
+    """Выполнить задачу и записать итоговый статус"""
+    try:
+        func, _label = JOB_HANDLERS[job.kind]
+        trace = tracing.start_trace(f'job {job.kind}', **{'job.id': job.pk}) if tracing.sampled() else nullcontext()
+        with trace:
+            message = func(JobContext(job), **job.params) or ''
+        BackgroundJob.objects.filter(pk=job.pk).update(
+            status='done', progress=100, message=str(message)[:255],
+            finished_at=timezone.now(), updated_at=timezone.now(),
+        )
+        metrics.inc('background_jobs_total', kind=job.kind, status='done')
+    except Exception as e:
+        BackgroundJob.objects.filter(pk=job.pk).update(
+            status='failed', message=str(e)[:255], error=traceback.format_exc(),
+            finished_at=timezone.now(), updated_at=timezone.now(),
+        )
+        metrics.inc('background_jobs_total', kind=job.kind, status='failed')
+    finally:
+        # Задача выполнялась в потоке пула - закрываем его соединения
+        connections.close_all()
+
+
+def requeue_stale_jobs(stale_after):
+    """
+    Задачи, зависшие в статусе running (воркер упал): идемпотентные
+    возвращаются в очередь, остальные помечаются failed - их результат
+    проверяют и при необходимости ставят заново вручную.
+    Возвращает (возвращено в очередь, помечено failed).
+    """
+    threshold = timezone.now() - timedelta(seconds=stale_after)
+    stale = BackgroundJob.objects.filter(status='running', updated_at__lt=threshold)
+    with immediate_atomic():
+        failed = stale.filter(kind__in=NON_IDEMPOTENT_KINDS).update(
+            status='failed', message='Воркер остановился во время выполнения: повтор может задвоить результат',
+            finished_at=timezone.now(), updated_at=timezone.now(),
+        )
+        requeued = stale.update(status='queued', worker='', started_at=None, updated_at=timezone.now())
+    return requeued, failed
+
+
+def periodic_jobs():
+    """Задачи по расписанию: kind -> интервал в секундах (из настроек)"""
+    schedule = {}
+    if settings.SQLITE_BACKUP_INTERVAL_HOURS > 0:
+        schedule['sqlite_backup'] = settings.SQLITE_BACKUP_INTERVAL_HOURS * 3600
+    return schedule
+
+
+def enqueue_periodic_jobs():
+    """
+    Ставит задачи по расписанию, если с постановки прошлой прошло больше
+    интервала и такая задача еще не ждет в очереди. Вызывается воркером.
+    """
+    created = []
+    for kind, interval in periodic_jobs().items():
+        last = BackgroundJob.objects.filter(kind=kind).order_by('-created_at').first()
+        if last is not None and (
+            last.status in ('queued', 'running')
+            or (timezone.now() - last.created_at).total_seconds() < interval
+        ):
+            continue
+        created.append(enqueue(kind, {}))
+    return created
+
+
+# --- Обработчики ---
+
+@register_job('export_estimates_zip', 'Архив смет (ZIP)', permission='control.view_estimate')
+def export_estimates_zip_job(ctx, model, ids, audience='client'):
+    from .exports import estimates_under, iter_estimates_zip
+    if model not in EXPORT_ZIP_MODELS:
+        raise ValueError(f'Выгрузка смет по модели {model} не поддерживается')
+    nodes = apps.get_model(model)._default_manager.filter(pk__in=ids)
+    estimates = estimates_under(nodes)
+    total = estimates.count()
+    with tempfile.TemporaryFile() as tmp:
+        for chunk in iter_estimates_zip(estimates, audience):
+            tmp.write(chunk)
+        tmp.seek(0)
+        ctx.save_result(f'estimates_{nodes.model._meta.model_name}_{audience}.zip', tmp)
+    metrics.inc('estimate_exports_total', audience=audience, format='zip')
+    return f'Смет в архиве: {total}'
+
+
+@register_job('export_estimate_xlsx', 'Смета (XLSX)', permission='control.view_estimate')
+def export_estimate_xlsx_job(ctx, estimate_id, audience='client'):
+    from .exports import estimates_with_items, render_estimate_xlsx
+    from .snapshots import estimate_lines
+    estimate = estimates_with_items().get(pk=estimate_id)
+    ctx.save_result(f'estimate_{estimate_id}_{audience}.xlsx', render_estimate_xlsx(estimate, audience))
+    metrics.inc('estimate_exports_total', audience=audience, format='xlsx')
+    return f'Позиций: {len(estimate_lines(estimate))}'
+
+
+@register_job(
+    'create_transactions', 'Создание транзакций по позициям', permission='control.add_transaction', idempotent=False,
+)
+def create_transactions_job(ctx, item_ids, data):
+    from .models import EstimateItem
+    from .utils import create_wizard_transactions
+    items = EstimateItem.objects.filter(id__in=item_ids).select_related('price_item').order_by('id')
+    with immediate_atomic():
+        created_count = create_wizard_transactions(items, data, progress=ctx.progress)
+    metrics.inc('wizard_transactions_created_total', created_count, source='job')
+    return f'Создано транзакций: {created_count}'
+
+
+@register_job('recalculate_estimates', 'Пересчет сумм смет', permission='control.change_estimateitem')
+def recalculate_estimates_job(ctx, estimate_ids):
+    from .models import EstimateItem
+    from .snapshots import refresh_snapshot
+    updated = 0
+    for index, estimate_id in enumerate(estimate_ids):
+        ctx.progress(index, len(estimate_ids), f'Смета #{estimate_id}')
+        items = list(EstimateItem.objects.filter(estimate_id=estimate_id))
+        for item in items:
+            item._calculate_amounts()
+        with immediate_atomic():
+            EstimateItem.objects.bulk_update(
+                items, ['base_price', 'income_amount', 'client_price', 'contractor_price'], batch_size=500,
+            )
+        # bulk_update не вызывает сигналов - новая ревизия снимка, если суммы утвержденной сметы изменились
+        refresh_snapshot(estimate_id)
+        updated += len(items)
+    return f'Пересчитано позиций: {updated}'
+
+
+@register_job('sqlite_backup', 'Резервная копия SQLite')
+def sqlite_backup_job(ctx):
+    from .backup import sqlite_hot_backup
+    report = sqlite_hot_backup(progress=ctx.progress)
+    return (f'{os.path.basename(report["file"])}: {report["size"] / 1024 / 1024:.1f} МБ '
+            f'за {report["timings"]["total"]:.1f} с')
+
+
+@register_job('archive_transactions', 'Архивация транзакций', permission='control.add_archivedtransaction')
+def archive_transactions_job(ctx, project_ids=None, before=None, finished_projects=False, restore=False):
+    from datetime import date
+    from .archive import archive_candidates, archive_transactions, restore_candidates, restore_transactions
+    before = date.fromisoformat(before) if before else None
+    if restore:
+        queryset = restore_candidates(before, project_ids)
+        return f'Возвращено из архива: {restore_transactions(queryset, progress=ctx.progress)}'
+    queryset = archive_candidates(before, finished_projects, project_ids)
+    return f'Перенесено в архив: {archive_transactions(queryset, progress=ctx.progress)}'
@@ -0,0 +1,52 @@
+"""
+Журналы в формате JSON lines с ротацией по размеру (медленные SQL, трассировки)
+"""
+import json
+import logging
+import os
+import threading
+from logging.handlers import RotatingFileHandler
+
+
+_handler_lock = threading.Lock()
+
+
+def get_json_logger(name, path, max_bytes, backups):
+    """Логгер, пишущий сообщения как есть в файл с ротацией; файл создается при первой записи"""
+    logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
+    with _handler_lock:
+        if logger.handlers:
+            return logger
+        path = str(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+def iter_json_lines(path):
+    """Записи журнала, включая ротированные файлы (.1, .2, ...), от старых к новым"""
+    path = str(path)
+    files = []
+    index = 1
+    while os.path.exists(f'{path}.{index}'):
+        files.append(f'{path}.{index}')
+        index += 1
+    files.reverse()
+    if os.path.exists(path):
+        files.append(path)
+    for file_path in files:
+        with open(file_path, encoding='utf-8') as fh:
+            for line in fh:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
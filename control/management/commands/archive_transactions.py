@@ -0,0 +1,71 @@
+"""
+Перенос транзакций завершенных проектов и закрытых периодов в архив
+(и обратно с --restore) пачками. До и после переноса сверяются итоги
+по всем транзакциям вместе с архивом - они должны совпасть.
+
+Пример:
+    python manage.py archive_transactions --finished-projects
+    python manage.py archive_transactions --before 2024-01-01 --dry-run
+    python manage.py archive_transactions --restore --project 12
+"""
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from control.archive import (
+    ArchiveError, archive_candidates, archive_transactions, ledger_totals, restore_candidates, restore_transactions,
+)
+from control.models import ArchivedTransaction, Transaction
+
+
+class Command(BaseCommand):
+    help = 'Переносит транзакции завершенных проектов или старше даты в архивную таблицу (или возвращает с --restore)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=date.fromisoformat, default=None,
+                            help='Транзакции с датой раньше указанной (ГГГГ-ММ-ДД)')
+        parser.add_argument('--finished-projects', action='store_true',
+                            help='Транзакции неактивных (завершенных) проектов')
+        parser.add_argument('--project', type=int, action='append', dest='projects', default=[],
+                            help='Только транзакции проекта с этим id (можно повторять)')
+        parser.add_argument('--restore', action='store_true', help='Вернуть транзакции из архива')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Размер пачки (по умолчанию ARCHIVE_BATCH_SIZE)')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, сколько транзакций будет перенесено')
+
+    def handle(self, *args, **options):
+        try:
+            if options['restore']:
+                if options['finished_projects']:
+                    raise CommandError('--finished-projects не используется с --restore')
+                queryset = restore_candidates(options['before'], options['projects'])
+            else:
+                queryset = archive_candidates(options['before'], options['finished_projects'], options['projects'])
+        except ArchiveError as e:
+            raise CommandError(str(e))
+
+        count = queryset.count()
+        action = 'Вернуть из архива' if options['restore'] else 'Перенести в архив'
+        self.stdout.write(f'{action}: {count} транзакций')
+        if options['dry_run'] or not count:
+            return
+
+        before = ledger_totals()
+        started = time.monotonic()
+
+        def progress(done, total, message=''):
+            self.stdout.write(f'  {done}/{total}')
+
+        move = restore_transactions if options['restore'] else archive_transactions
+        try:
+            moved = move(queryset, batch_size=options['batch_size'], progress=progress)
+        except ArchiveError as e:
+            raise CommandError(str(e))
+        after = ledger_totals()
+        if after != before:
+            raise CommandError(f'Итоги с архивом изменились: было {before}, стало {after}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено {moved} транзакций за {time.monotonic() - started:.1f} с, итоги совпали '
+            f'(в рабочей таблице {Transaction.objects.count()}, в архиве {ArchivedTransaction.objects.count()})'
+        ))
@@ -0,0 +1,51 @@
+"""
+Закрытие месяца или квартала: остатки на конец периода сохраняются
+в PeriodBalance, транзакции периода блокируются от изменений.
+
+Пример:
+    python manage.py close_period 2025-09
+    python manage.py close_period 2025-Q3 --verify
+    python manage.py close_period --reopen
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from control.periods import close_period, reopen_last_period, verify_period
+
+
+class Command(BaseCommand):
+    help = 'Закрывает период (ГГГГ-ММ или ГГГГ-QN) с сохранением остатков или открывает последний (--reopen)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('period', nargs='?', help='Месяц ГГГГ-ММ или квартал ГГГГ-QN')
+        parser.add_argument('--reopen', action='store_true', help='Открыть последний закрытый период')
+        parser.add_argument('--verify', action='store_true',
+                            help='Сверить сохраненные остатки с полным пересчетом по всем транзакциям')
+
+    def handle(self, *args, **options):
+        if options['reopen']:
+            period = reopen_last_period()
+            if period is None:
+                raise CommandError('Закрытых периодов нет')
+            self.stdout.write(self.style.SUCCESS(f'Период {period} открыт'))
+            return
+        if not options['period']:
+            raise CommandError('Укажите период: ГГГГ-ММ или ГГГГ-QN')
+
+        started = time.monotonic()
+        try:
+            period = close_period(options['period'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f'Период {period} закрыт за {time.monotonic() - started:.2f} с: '
+            f'транзакций за период {period.transactions_count}, строк остатков {period.balances.count()}'
+        )
+        if options['verify']:
+            mismatches = verify_period(period)
+            if mismatches:
+                sample = '; '.join(f'{key}: {values}' for key, values in list(mismatches.items())[:10])
+                raise CommandError(f'Остатки не совпали с полным пересчетом ({len(mismatches)}): {sample}')
+            self.stdout.write('Остатки совпали с полным пересчетом')
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,92 @@
+"""
+Перенос данных из файла SQLite в текущую базу (обычно PostgreSQL).
+
+Пример:
+    DB_ENGINE=postgresql python manage.py migrate
+    DB_ENGINE=postgresql python manage.py copy_from_sqlite db.sqlite3
+"""
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.core.management.sql import sql_flush
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from control.db import ordered_models, preserve_auto_timestamps, register_sqlite_database, reset_sequences
+
+
+SOURCE_ALIAS = 'sqlite_source'
+
+
+class Command(BaseCommand):
+    help = 'Копирует все данные из файла SQLite в текущую БД пачками bulk_create и сверяет количество строк'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Путь к файлу SQLite (например, db.sqlite3)')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Алиас целевой БД')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Размер пачки вставки')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Не спрашивать подтверждение очистки целевой БД')
+
+    def handle(self, *args, **options):
+        source_path = Path(options['source'])
+        if not source_path.exists():
+            raise CommandError(f'Файл {source_path} не найден')
+        target_alias = options['database']
+        target = connections[target_alias]
+        if target.vendor == 'sqlite' and Path(str(target.settings_dict['NAME'])).resolve() == source_path.resolve():
+            raise CommandError('Источник и целевая БД совпадают')
+
+        if options['interactive']:
+            answer = input(f'Все данные в целевой БД ({target.vendor}: {target.settings_dict["NAME"]}) '
+                           f'будут удалены. Продолжить? [y/N] ')
+            if answer.strip().lower() not in ('y', 'yes', 'д', 'да'):
+                raise CommandError('Отменено')
+
+        register_sqlite_database(SOURCE_ALIAS, source_path)
+        model_list = ordered_models()
+        batch_size = options['batch_size']
+
+        with transaction.atomic(using=target_alias), preserve_auto_timestamps(model_list):
+            # Очищаем таблицы целевой БД (в т.ч. contenttypes/permissions, созданные migrate)
+            target.ops.execute_sql_flush(sql_flush(no_style(), target, reset_sequences=True))
+
+            for model in model_list:
+                copied = self._copy_model(model, target_alias, batch_size)
+                self.stdout.write(f'  {model._meta.label}: {copied}')
+
+            reset_sequences(model_list, using=target_alias)
+
+        self._verify(model_list, target_alias)
+        connections[SOURCE_ALIAS].close()
+
+    def _copy_model(self, model, target_alias, batch_size):
+        """Копирует одну модель пачками, возвращает число строк"""
+        manager = model._base_manager
+        rows = manager.using(SOURCE_ALIAS).order_by('pk').iterator(chunk_size=batch_size)
+        batch, copied = [], 0
+        for obj in rows:
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                manager.using(target_alias).bulk_create(batch, batch_size=batch_size)
+                copied += len(batch)
+                batch = []
+        if batch:
+            manager.using(target_alias).bulk_create(batch, batch_size=batch_size)
+            copied += len(batch)
+        return copied
+
+    def _verify(self, model_list, target_alias):
+        """Сверка количества строк в источнике и в целевой БД"""
+        mismatches = []
+        self.stdout.write('Проверка количества строк:')
+        for model in model_list:
+            source_count = model._base_manager.using(SOURCE_ALIAS).count()
+            target_count = model._base_manager.using(target_alias).count()
+            status = 'OK' if source_count == target_count else 'РАСХОЖДЕНИЕ'
+            self.stdout.write(f'  {model._meta.label:<40} {source_count:>10} {target_count:>10}  {status}')
+            if source_count != target_count:
+                mismatches.append(model._meta.label)
+        if mismatches:
+            raise CommandError(f'Количество строк не совпало: {", ".join(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Данные перенесены, количество строк совпадает'))
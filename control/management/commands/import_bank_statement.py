@@ -0,0 +1,61 @@
+"""
+Импорт банковской выписки (CSV или формат обмена с 1С) в транзакции.
+Категории и контрагенты - по правилам импорта выписки (админка), строки
+без подходящего правила получают категорию --category или пропускаются.
+Повторный запуск с тем же файлом ничего не дублирует.
+
+Пример:
+    python manage.py import_bank_statement kl_to_1c.txt --category "Прочее"
+    python manage.py import_bank_statement statement_2025.csv --dry-run
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from control import metrics
+from control.bank_import import StatementError, import_statement, iter_statement_rows, open_statement
+from control.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Потоково импортирует банковскую выписку (CSV или 1С) в транзакции, без дубликатов при повторном запуске'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл выписки: CSV или 1CClientBankExchange')
+        parser.add_argument('--category', default=None,
+                            help='Категория (название или id) для строк без подходящего правила')
+        parser.add_argument('--encoding', default=None, help='Кодировка файла (по умолчанию определяется)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Размер пачки вставки (по умолчанию BANK_IMPORT_BATCH_SIZE)')
+        parser.add_argument('--dry-run', action='store_true', help='Выполнить импорт и откатить транзакцию')
+
+    def handle(self, *args, **options):
+        category = None
+        if options['category']:
+            lookup = {'pk': options['category']} if options['category'].isdigit() else {'name': options['category']}
+            category = Category.objects.filter(**lookup).first()
+            if category is None:
+                raise CommandError(f'Категория {options["category"]} не найдена')
+
+        started = time.monotonic()
+        try:
+            with open_statement(options['path'], options['encoding']) as fh:
+                stats = import_statement(
+                    iter_statement_rows(fh), default_category=category, batch_size=options['batch_size'],
+                    dry_run=options['dry_run'],
+                )
+        except FileNotFoundError:
+            raise CommandError(f'Файл {options["path"]} не найден')
+        except (StatementError, UnicodeDecodeError, LookupError) as e:
+            raise CommandError(f'Ошибка чтения {options["path"]}: {e}')
+
+        summary = (
+            f'строк {stats["rows"]}, создано {stats["created"]}, дубликатов {stats["duplicates"]}, '
+            f'без категории {stats["unmatched"]}, в закрытых периодах {stats["closed"]} '
+            f'за {time.monotonic() - started:.1f} с'
+        )
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Проверка: {summary} (dry-run, изменения отменены)'))
+            return
+        metrics.inc('bank_import_transactions_total', stats['created'])
+        self.stdout.write(self.style.SUCCESS(f'Импорт завершен: {summary}'))
@@ -0,0 +1,363 @@
+"""
+Импорт старых копий dumpdata (например, backup_20251107_151319.json),
+которые loaddata уже не загружает в текущую схему.
+
+Файл читается потоково по одному объекту. Контрагенты control.contractor
+становятся пользователями CustomUser, внешние ключи проектов, объектов,
+смет и транзакций пересчитываются через таблицу соответствия старых и
+новых id. Записи вставляются пачками bulk_create в одной транзакции,
+в конце печатается сверка: количество строк и суммы по файлу и по БД.
+
+Справочники (виды работ и материалов, категории, позиции прайса), которые
+уже есть в БД, сопоставляются по естественному ключу (NATURAL_KEYS) и не
+вставляются повторно. У проектов, смет и транзакций такого ключа нет:
+повторный импорт той же копии создаст их еще раз.
+
+Пример:
+    python manage.py import_legacy_json backup_20251107_151319.json
+    python manage.py import_legacy_json old.json.gz --dry-run
+"""
+import re
+import time
+from collections import Counter, defaultdict
+from decimal import Decimal
+from pathlib import Path
+
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections
+
+from control.backup import iter_json_array, open_text
+from control.cache import VERSIONED_MODELS, bump_version
+from control.db import immediate_atomic, preserve_auto_timestamps
+from control.debts import rebuild_debt_positions
+
+
+# Модели копии, которые переносятся (остальные - журнал админки, права,
+# сессии, типы содержимого - создаются заново и пропускаются)
+IMPORTED_MODELS = (
+    'control.customuser',
+    'control.contractor',
+    'control.worktype',
+    'control.materialtype',
+    'control.priceitem',
+    'control.category',
+    'control.project',
+    'control.object',
+    'control.stage',
+    'control.estimate',
+    'control.estimateitem',
+    'control.transaction',
+)
+
+# Естественные ключи справочников: существующая в БД запись с тем же ключом
+# используется вместо вставки (повторный импорт той же копии)
+NATURAL_KEYS = {
+    'control.worktype': ('name',),
+    'control.materialtype': ('name',),
+    'control.category': ('name',),
+    'control.priceitem': ('material_id', 'work_type_id', 'unit', 'name'),
+}
+
+# Поля, которые до миграции 0012 ссылались на control.contractor
+CONTRACTOR_FIELDS = {('control.project', 'contractor'), ('control.transaction', 'contractor')}
+
+# Суммы для сверки: модель -> поля
+RECONCILED_SUMS = {
+    'control.estimateitem': ('client_price', 'contractor_price'),
+    'control.transaction': ('amount',),
+}
+
+PHONE_RE = re.compile(r'\+?[78][\s\-()]*(?:\d[\s\-()]*){10}')
+
+
+class DryRunRollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Потоково импортирует старую копию dumpdata: контрагенты -> пользователи, '
+            'пересчет внешних ключей, вставка пачками, отчет сверки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл JSON (или .json.gz) из dumpdata')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Алиас целевой БД')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Размер пачки вставки')
+        parser.add_argument('--dry-run', action='store_true', help='Выполнить импорт и откатить транзакцию')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден')
+        self.alias = options['database']
+        if not connections[self.alias].features.can_return_rows_from_bulk_insert:
+            raise CommandError('БД не возвращает id из bulk_create (нужен SQLite 3.35+ или PostgreSQL)')
+        self.batch_size = options['batch_size']
+
+        self.id_map = defaultdict(dict)  # модель копии -> {старый id: новый id}
+        self.pending = []  # (старый id, объект) текущей пачки
+        self.pending_label = None
+        self.stats = defaultdict(Counter)
+        self.dropped_fields = defaultdict(Counter)
+        self.source_sums = defaultdict(Decimal)
+        self.contractor_details = 0
+        self.skipped_models = Counter()
+        self.known_keys = {}  # модель копии -> {естественный ключ: id в БД}
+
+        started = time.monotonic()
+        target_models = [self._target_model(label) for label in IMPORTED_MODELS]
+        counts_before = {model: model._base_manager.using(self.alias).count() for model in dict.fromkeys(target_models)}
+        try:
+            with immediate_atomic(using=self.alias), preserve_auto_timestamps(target_models):
+                with open_text(path) as fh:
+                    for record in iter_json_array(fh):
+                        self._import_record(record)
+                self._flush()
+                # bulk_create не вызывает сигналов - позиции долгов пересчитываются целиком
+                rebuild_debt_positions(using=self.alias)
+                # Сверка внутри транзакции: при расхождении импорт откатывается
+                problems = self._report(counts_before)
+                summary = f'за {time.monotonic() - started:.1f} с'
+                if problems:
+                    raise CommandError(f'Сверка не сошлась ({", ".join(problems)}), изменения отменены')
+                if options['dry_run']:
+                    raise DryRunRollback()
+        except DryRunRollback:
+            self.stdout.write(self.style.SUCCESS(f'Проверка завершена {summary} (dry-run, изменения отменены)'))
+            return
+        except ValueError as e:
+            raise CommandError(f'Ошибка чтения {path}: {e}')
+        except IntegrityError as e:
+            raise CommandError(
+                f'Записи {self.pending_label} уже есть в БД ({e}): похоже, копия уже импортирована. '
+                f'Изменения отменены'
+            )
+
+        for model in counts_before:
+            if model._meta.label in VERSIONED_MODELS:
+                bump_version(model)
+        self.stdout.write(self.style.SUCCESS(f'Импорт завершен {summary}'))
+
+    # --- Разбор записей ---
+
+    @staticmethod
+    def _target_model(label):
+        if label == 'control.contractor':
+            return apps.get_model('control', 'CustomUser')
+        return apps.get_model(label)
+
+    def _import_record(self, record):
+        label = record.get('model', '').lower()
+        if label not in IMPORTED_MODELS:
+            self.skipped_models[label] += 1
+            return
+        if label != self.pending_label:
+            # dumpdata пишет модели по порядку зависимостей: родители вставлены раньше детей
+            self._flush()
+            self.pending_label = label
+        self.stats[label]['read'] += 1
+        fields = record.get('fields', {})
+        for field_name in RECONCILED_SUMS.get(label, ()):
+            if fields.get(field_name) is not None:
+                self.source_sums[(label, field_name)] += Decimal(str(fields[field_name]))
+
+        if label == 'control.contractor':
+            obj = self._contractor_to_user(record['pk'], fields)
+        elif label == 'control.customuser':
+            obj = self._existing_user(record['pk'], fields)
+        else:
+            obj = self._build(label, fields)
+        if obj is None:
+            return
+        self.pending.append((record['pk'], obj))
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+
+    def _build(self, label, fields):
+        """Объект текущей модели из полей копии; None, если запись пропущена"""
+        model = self._target_model(label)
+        values = {}
+        for name, value in fields.items():
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                field = None
+            if field is None or not field.concrete or field.many_to_many:
+                # Поле удалено из модели (старая схема) или M2M
+                self.dropped_fields[label][name] += 1
+                continue
+            if field.is_relation:
+                if value is None:
+                    values[field.attname] = None
+                    continue
+                source_label = self._fk_source(label, field)
+                new_id = self.id_map[source_label].get(value)
+                if new_id is None:
+                    if not field.null:
+                        self.stats[label][f'пропущено: нет {source_label} #{value}'] += 1
+                        return None
+                    self.stats[label][f'обнулена ссылка {name}'] += 1
+                values[field.attname] = new_id
+            else:
+                values[field.attname] = field.to_python(value) if value is not None else None
+        return model(**values)
+
+    def _fk_source(self, label, field):
+        if (label, field.name) in CONTRACTOR_FIELDS and 'control.contractor' in self.stats:
+            return 'control.contractor'
+        return field.related_model._meta.label_lower
+
+    def _existing_user(self, old_pk, fields):
+        """Пользователь копии: существующий с тем же телефоном или новый"""
+        User = self._target_model('control.customuser')
+        existing = User._base_manager.using(self.alias).filter(phone=fields.get('phone')).values_list('pk', flat=True).first()
+        if existing is not None:
+            self.id_map['control.customuser'][old_pk] = existing
+            self.stats['control.customuser']['сопоставлено'] += 1
+            return None
+        fields = {name: value for name, value in fields.items() if name not in ('groups', 'user_permissions')}
+        return self._build('control.customuser', fields)
+
+    def _contractor_to_user(self, old_pk, fields):
+        """Контрагент -> CustomUser; повторный импорт находит пользователя по ext_id"""
+        User = self._target_model('control.customuser')
+        ext_id = f'contractor:{old_pk}'
+        existing = User._base_manager.using(self.alias).filter(ext_id=ext_id).values_list('pk', flat=True).first()
+        if existing is not None:
+            self.id_map['control.contractor'][old_pk] = existing
+            self.stats['control.contractor']['сопоставлено'] += 1
+            return None
+        if any(fields.get(name) for name in ('address', 'inn', 'kpp', 'bank_details')):
+            # В CustomUser нет реквизитов - считаем, чтобы показать в отчете
+            self.contractor_details += 1
+
+        name = (fields.get('name') or '').split(maxsplit=1)
+        phone = self._contractor_phone(fields.get('contacts') or '', User) or f'contractor-{old_pk}'
+        return User(
+            phone=phone,
+            last_name=name[0] if name else None,
+            first_name=name[1] if len(name) > 1 else None,
+            ext_id=ext_id,
+            is_active=fields.get('is_active', True),
+            password=make_password(None),
+            date_joined=User._meta.get_field('date_joined').to_python(fields.get('created_at')),
+        )
+
+    def _contractor_phone(self, contacts, User):
+        """Телефон из контактов в формате +7XXXXXXXXXX, если он еще не занят"""
+        match = PHONE_RE.search(contacts)
+        if not match:
+            return None
+        digits = re.sub(r'\D', '', match.group())
+        phone = f'+7{digits[-10:]}'
+        taken = User._base_manager.using(self.alias).filter(phone=phone).exists() or any(
+            obj.phone == phone for _pk, obj in self.pending
+        )
+        return None if taken else phone
+
+    def _flush(self):
+        """Вставить текущую пачку и запомнить соответствие id"""
+        if not self.pending:
+            return
+        label = self.pending_label
+        model = self._target_model(label)
+        pending = self._match_natural_keys(label, model)
+        objs = list({id(obj): obj for _old_pk, obj in pending}.values())
+        model._base_manager.using(self.alias).bulk_create(objs, batch_size=self.batch_size)
+        for old_pk, obj in pending:
+            self.id_map[label][old_pk] = obj.pk
+        if label in NATURAL_KEYS:
+            # Следующие пачки сопоставляются и с только что вставленными записями
+            self.known_keys[label].update((self._natural_key(label, obj), obj.pk) for obj in objs)
+        if objs:
+            self.stats[label]['создано'] += len(objs)
+        self.pending = []
+
+    @staticmethod
+    def _natural_key(label, obj):
+        return tuple(getattr(obj, name) for name in NATURAL_KEYS[label])
+
+    def _match_natural_keys(self, label, model):
+        """
+        Пачка без справочных записей, которые уже есть в БД (их id сразу
+        пишутся в id_map). Повтор ключа внутри пачки ссылается на один объект.
+        """
+        if label not in NATURAL_KEYS:
+            return self.pending
+        if label not in self.known_keys:
+            rows = model._base_manager.using(self.alias).values_list(*NATURAL_KEYS[label], 'pk')
+            self.known_keys[label] = {tuple(row[:-1]): row[-1] for row in rows}
+        known = self.known_keys[label]
+        batch = {}
+        pending = []
+        for old_pk, obj in self.pending:
+            key = self._natural_key(label, obj)
+            if key in known:
+                self.id_map[label][old_pk] = known[key]
+                self.stats[label]['сопоставлено'] += 1
+            else:
+                pending.append((old_pk, batch.setdefault(key, obj)))
+        return pending
+
+    # --- Сверка ---
+
+    def _db_sums(self):
+        """Суммы по импортированным записям в БД"""
+        sums = {}
+        for label, field_names in RECONCILED_SUMS.items():
+            new_ids = list(self.id_map[label].values())
+            model = self._target_model(label)
+            for field_name in field_names:
+                total = Decimal('0')
+                for start in range(0, len(new_ids), 500):
+                    chunk = new_ids[start:start + 500]
+                    values = model._base_manager.using(self.alias).filter(pk__in=chunk).values_list(field_name, flat=True)
+                    total += sum(values, Decimal('0'))
+                sums[(label, field_name)] = total
+        return sums
+
+    def _report(self, counts_before):
+        """Печатает отчет сверки и возвращает список расхождений"""
+        self.stdout.write('Записи копии:')
+        for label in IMPORTED_MODELS:
+            stats = self.stats.get(label)
+            if not stats:
+                continue
+            details = ', '.join(f'{key} {value}' for key, value in stats.items() if key != 'read')
+            self.stdout.write(f'  {label:<24} прочитано {stats["read"]:>8}  {details}')
+        if self.skipped_models:
+            self.stdout.write('Пропущены (создаются заново): ' + ', '.join(
+                f'{label} {count}' for label, count in sorted(self.skipped_models.items())
+            ))
+        for label, fields in self.dropped_fields.items():
+            self.stdout.write(f'  {label}: нет в текущей схеме полей ' + ', '.join(
+                f'{name} ({count})' for name, count in fields.items()
+            ))
+        if self.contractor_details:
+            self.stdout.write(self.style.WARNING(
+                f'  У {self.contractor_details} контрагентов были адрес/ИНН/КПП/реквизиты - в CustomUser их нет'
+            ))
+
+        problems = []
+        self.stdout.write('Сверка строк в БД:')
+        for model, before in counts_before.items():
+            labels = [label for label in IMPORTED_MODELS if self._target_model(label) is model]
+            created = sum(self.stats[label]['создано'] for label in labels)
+            after = model._base_manager.using(self.alias).count()
+            status = 'OK' if after - before == created else 'РАСХОЖДЕНИЕ'
+            if status != 'OK':
+                problems.append(model._meta.label)
+            self.stdout.write(f'  {model._meta.label:<24} было {before:>8}  стало {after:>8}  '
+                              f'создано {created:>8}  {status}')
+
+        self.stdout.write('Сверка сумм (файл / БД):')
+        for (label, field_name), db_total in self._db_sums().items():
+            source_total = self.source_sums.get((label, field_name), Decimal('0'))
+            skipped = any(key.startswith('пропущено') for key in self.stats[label])
+            status = 'OK' if source_total == db_total else ('есть пропуски' if skipped else 'РАСХОЖДЕНИЕ')
+            if status == 'РАСХОЖДЕНИЕ':
+                problems.append(f'{label}.{field_name}')
+            self.stdout.write(f'  {label}.{field_name:<18} {source_total:>16} {db_total:>16}  {status}')
+        return problems
@@ -0,0 +1,35 @@
+"""
+Пересчет позиций долгов контрагентов по всем транзакциям (с архивом)
+одним группирующим запросом. Нужен после массовых операций, которые
+не вызывают сигналов (update, bulk_create, загрузка данных).
+
+Пример:
+    python manage.py rebuild_debt_positions
+    python manage.py rebuild_debt_positions --check
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from control.debts import check_debt_positions, rebuild_debt_positions
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает позиции долгов контрагентов (или только сверяет их с --check)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только сверить сохраненные позиции с пересчетом, без записи')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['check']:
+            mismatches = check_debt_positions()
+            for contractor_id, stored, expected in mismatches[:20]:
+                self.stdout.write(f'  контрагент #{contractor_id}: сохранено {stored}, пересчет {expected}')
+            if mismatches:
+                raise CommandError(f'Позиции расходятся с транзакциями: {len(mismatches)} контрагентов')
+            self.stdout.write(self.style.SUCCESS(f'Позиции совпадают с транзакциями ({time.monotonic() - started:.2f} с)'))
+            return
+        count = rebuild_debt_positions()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано позиций: {count} за {time.monotonic() - started:.2f} с'))
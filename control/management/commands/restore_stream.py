@@ -0,0 +1,129 @@
+"""
+Восстановление из копии backup_stream: проверка контрольных сумм, очистка
+таблиц из манифеста и вставка пачками bulk_create в порядке зависимостей.
+Внешние ключи проверяются один раз в конце, сигналы save не вызываются.
+
+Пример:
+    python manage.py restore_stream backups/backup_20251107_151319
+"""
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from control.backup import FORMAT, FORMAT_VERSION, MANIFEST_NAME, file_sha256, open_ndjson, row_decoder
+from control.cache import VERSIONED_MODELS, bump_version
+from control.db import ordered_models, preserve_auto_timestamps, reset_sequences
+
+
+class Command(BaseCommand):
+    help = 'Восстанавливает БД из копии backup_stream пачками bulk_create с отложенной проверкой внешних ключей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Каталог копии с manifest.json')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Алиас целевой БД')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Размер пачки вставки')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Не спрашивать подтверждение очистки таблиц')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        manifest = self._read_manifest(path)
+        entries = {entry['model']: entry for entry in manifest['models']}
+        # Порядок зависимостей текущих моделей, а не порядок в манифесте
+        model_list = [model for model in ordered_models() if model._meta.label_lower in entries]
+        unknown = set(entries) - {model._meta.label_lower for model in model_list}
+        if unknown:
+            raise CommandError(f'В проекте нет моделей из копии: {", ".join(sorted(unknown))}')
+        self._check_fields(model_list, entries)
+
+        self.stdout.write('Проверка контрольных сумм...')
+        for entry in entries.values():
+            if file_sha256(path / entry['file']) != entry['sha256']:
+                raise CommandError(f'Контрольная сумма не совпала: {entry["file"]}')
+
+        alias = options['database']
+        connection = connections[alias]
+        if options['interactive']:
+            answer = input(f'Данные {len(model_list)} моделей в БД ({connection.vendor}: '
+                           f'{connection.settings_dict["NAME"]}) будут заменены. Продолжить? [y/N] ')
+            if answer.strip().lower() not in ('y', 'yes', 'д', 'да'):
+                raise CommandError('Отменено')
+
+        started = time.monotonic()
+        tables = [model._meta.db_table for model in model_list]
+        with transaction.atomic(using=alias), preserve_auto_timestamps(model_list):
+            with connection.constraint_checks_disabled():
+                connection.ops.execute_sql_flush(
+                    connection.ops.sql_flush(no_style(), tables, reset_sequences=True)
+                )
+                for model in model_list:
+                    model_started = time.monotonic()
+                    restored = self._restore_model(model, entries[model._meta.label_lower], path, alias,
+                                                   options['batch_size'])
+                    self.stdout.write(f'  {model._meta.label_lower:<40} {restored:>10}  '
+                                      f'{time.monotonic() - model_started:.1f} с')
+            # Ссылочная целостность - одной проверкой по всем таблицам
+            connection.check_constraints(table_names=tables)
+            reset_sequences(model_list, using=alias)
+            self._verify(model_list, entries, alias)
+
+        for model in model_list:
+            if model._meta.label in VERSIONED_MODELS:
+                bump_version(model)
+        self.stdout.write(self.style.SUCCESS(
+            f'Восстановлено {sum(entries[m._meta.label_lower]["count"] for m in model_list)} записей '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
+
+    def _read_manifest(self, path):
+        try:
+            with open(path / MANIFEST_NAME, encoding='utf-8') as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Не удалось прочитать {path / MANIFEST_NAME}: {e}')
+        if manifest.get('format') != FORMAT or manifest.get('version') != FORMAT_VERSION:
+            raise CommandError(f'Неподдерживаемый формат копии: {manifest.get("format")} v{manifest.get("version")}')
+        return manifest
+
+    def _check_fields(self, model_list, entries):
+        """Поля копии должны совпадать с текущей схемой (копия сделана на той же миграции)"""
+        for model in model_list:
+            current = {field.attname for field in model._meta.concrete_fields}
+            saved = set(entries[model._meta.label_lower]['fields'])
+            if saved - current:
+                raise CommandError(f'{model._meta.label}: в модели нет полей {", ".join(sorted(saved - current))}')
+            missing = [
+                field.attname for field in model._meta.concrete_fields
+                if field.attname not in saved and not field.null and not field.has_default()
+            ]
+            if missing:
+                raise CommandError(f'{model._meta.label}: в копии нет обязательных полей {", ".join(missing)}')
+
+    def _restore_model(self, model, entry, path, alias, batch_size):
+        """Загружает одну модель пачками, возвращает число строк"""
+        by_attname = {field.attname: field for field in model._meta.concrete_fields}
+        fields = [by_attname[attname] for attname in entry['fields']]
+        decode = row_decoder(fields)
+        manager = model._base_manager.using(alias)
+        restored = 0
+        with open_ndjson(path / entry['file']) as fh:
+            while True:
+                batch = [model(**decode(line)) for line in islice(fh, batch_size)]
+                if not batch:
+                    break
+                manager.bulk_create(batch, batch_size=batch_size)
+                restored += len(batch)
+        return restored
+
+    def _verify(self, model_list, entries, alias):
+        mismatches = [
+            model._meta.label for model in model_list
+            if model._base_manager.using(alias).count() != entries[model._meta.label_lower]['count']
+        ]
+        if mismatches:
+            raise CommandError(f'Количество строк не совпало с манифестом: {", ".join(mismatches)}')
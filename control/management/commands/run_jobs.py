@@ -0,0 +1,69 @@
+"""
+Воркер фоновых задач: забирает задачи из таблицы BackgroundJob
+и выполняет их в пуле потоков.
+
+Пример:
+    python manage.py run_jobs --workers 2
+    python manage.py run_jobs --once   # выполнить очередь и выйти (cron)
+
+Задачи по расписанию (например, SQLITE_BACKUP_INTERVAL_HOURS) воркер
+ставит в очередь сам.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+
+from control.jobs import claim_next_job, enqueue_periodic_jobs, requeue_stale_jobs, run_job, worker_name
+
+
+# Как часто (сек) проверять задачи по расписанию
+SCHEDULE_CHECK_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди в БД (экспорт, создание транзакций, пересчет)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Число потоков')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Пауза опроса пустой очереди, сек')
+        parser.add_argument('--stale-after', type=int, default=3600,
+                            help='Через сколько секунд без прогресса считать задачу running зависшей')
+        parser.add_argument('--once', action='store_true', help='Выполнить задачи из очереди и выйти')
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        worker = worker_name()
+        requeued, failed = requeue_stale_jobs(options['stale_after'])
+        if requeued:
+            self.stdout.write(f'Возвращено в очередь зависших задач: {requeued}')
+        if failed:
+            self.stdout.write(f'Зависшие задачи без повтора помечены failed: {failed}')
+        self.stdout.write(f'Воркер {worker}: потоков {workers}')
+
+        running = set()
+        schedule_checked = 0.0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                while True:
+                    if time.monotonic() - schedule_checked >= SCHEDULE_CHECK_INTERVAL:
+                        schedule_checked = time.monotonic()
+                        for job in enqueue_periodic_jobs():
+                            self.stdout.write(f'  По расписанию: #{job.pk} {job.kind}')
+                    # Заполняем свободные потоки задачами из очереди
+                    while len(running) < workers:
+                        job = claim_next_job(worker)
+                        if job is None:
+                            break
+                        self.stdout.write(f'  #{job.pk} {job.kind}')
+                        running.add(pool.submit(run_job, job))
+                    if running:
+                        done, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                        running = set(running)
+                    elif options['once']:
+                        break
+                    else:
+                        time.sleep(options['poll_interval'])
+            except KeyboardInterrupt:
+                self.stdout.write('Остановка: ждем завершения выполняемых задач')
+        self.stdout.write(self.style.SUCCESS('Воркер остановлен'))
@@ -0,0 +1,78 @@
+"""
+Сводка журнала медленных SQL по формам запросов.
+
+Пример:
+    python manage.py slow_queries_report --top 10 --sort total
+    python manage.py slow_queries_report --since 2025-11-01 --explain
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from control.jsonlog import iter_json_lines
+
+
+SORT_KEYS = {
+    'total': lambda group: group['total_ms'],
+    'count': lambda group: group['count'],
+    'max': lambda group: group['max_ms'],
+    'avg': lambda group: group['total_ms'] / group['count'],
+}
+
+
+class Command(BaseCommand):
+    help = 'Группирует журнал медленных SQL по форме запроса: количество, время, места вызова, план'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=None, help='Файл журнала (по умолчанию SLOW_QUERY_LOG)')
+        parser.add_argument('--top', type=int, default=20, help='Сколько форм запросов показать')
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='total', help='Сортировка')
+        parser.add_argument('--since', default=None, help='Только записи начиная с даты/времени ISO')
+        parser.add_argument('--explain', action='store_true', help='Показать сохраненный план запроса')
+
+    def handle(self, *args, **options):
+        path = options['file'] or settings.SLOW_QUERY_LOG
+        groups = {}
+        for entry in iter_json_lines(path):
+            if options['since'] and entry.get('ts', '') < options['since']:
+                continue
+            key = entry.get('fingerprint')
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    'shape': entry.get('shape', ''),
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'call_sites': Counter(),
+                    'explain': None,
+                    'last_ts': '',
+                }
+            duration = entry.get('duration_ms', 0)
+            group['count'] += 1
+            group['total_ms'] += duration
+            group['max_ms'] = max(group['max_ms'], duration)
+            group['call_sites'][entry.get('call_site') or '?'] += 1
+            group['last_ts'] = max(group['last_ts'], entry.get('ts', ''))
+            if entry.get('explain') and group['explain'] is None:
+                group['explain'] = entry['explain']
+
+        if not groups:
+            raise CommandError(f'В журнале {path} нет записей')
+
+        ordered = sorted(groups.items(), key=lambda item: SORT_KEYS[options['sort']](item[1]), reverse=True)
+        self.stdout.write(f'Форм запросов: {len(groups)}, записей: {sum(g["count"] for g in groups.values())}')
+        for fingerprint, group in ordered[:options['top']]:
+            self.stdout.write('')
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'[{fingerprint}] x{group["count"]}  всего {group["total_ms"]:.1f} мс  '
+                f'сред. {group["total_ms"] / group["count"]:.1f} мс  макс. {group["max_ms"]:.1f} мс  '
+                f'последний {group["last_ts"][:19]}'
+            ))
+            self.stdout.write(f'  {group["shape"][:500]}')
+            for call_site, count in group['call_sites'].most_common(3):
+                self.stdout.write(f'  ← {call_site} (x{count})')
+            if options['explain'] and group['explain']:
+                for line in group['explain']:
+                    self.stdout.write(f'    {line}')
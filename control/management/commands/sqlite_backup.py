@@ -0,0 +1,40 @@
+"""
+Горячая копия базы SQLite без остановки сайта (online backup API),
+с проверкой integrity_check, сжатием и ротацией старых копий.
+
+Пример:
+    python manage.py sqlite_backup
+    python manage.py sqlite_backup --keep 14 --max-age-days 90
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from control.backup import BackupError, sqlite_hot_backup
+
+
+class Command(BaseCommand):
+    help = 'Согласованная копия работающей БД SQLite порциями страниц с проверкой, сжатием и ротацией'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='Каталог копий (по умолчанию SQLITE_BACKUP_DIR)')
+        parser.add_argument('--pages', type=int, default=None, help='Страниц за шаг (по умолчанию SQLITE_BACKUP_PAGES)')
+        parser.add_argument('--sleep', type=float, default=None, help='Пауза между шагами, сек')
+        parser.add_argument('--keep', type=int, default=None, help='Сколько последних копий хранить всегда')
+        parser.add_argument('--max-age-days', type=int, default=None, help='Удалять остальные копии старше N дней')
+
+    def handle(self, *args, **options):
+        try:
+            report = sqlite_hot_backup(
+                directory=options['output'], pages=options['pages'], sleep=options['sleep'],
+                keep=options['keep'], max_age_days=options['max_age_days'],
+            )
+        except BackupError as e:
+            raise CommandError(str(e))
+        timings = report['timings']
+        self.stdout.write(f'  Источник:        {report["source"]} ({report.get("pages", 0)} страниц)')
+        self.stdout.write(f'  Копирование:     {timings["copy"]:.2f} с')
+        self.stdout.write(f'  integrity_check: {timings["integrity_check"]:.2f} с')
+        self.stdout.write(f'  Сжатие:          {timings["compress"]:.2f} с '
+                          f'({report["db_size"] / 1024 / 1024:.1f} -> {report["size"] / 1024 / 1024:.1f} МБ)')
+        for path in report['removed']:
+            self.stdout.write(f'  Удалена старая копия: {path}')
+        self.stdout.write(self.style.SUCCESS(f'Копия {report["file"]} за {timings["total"]:.2f} с'))
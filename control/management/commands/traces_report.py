@@ -0,0 +1,85 @@
+"""
+Самые медленные трассы из TRACING_FILE деревом спанов.
+
+Пример:
+    python manage.py traces_report --top 5
+    python manage.py traces_report --name stage --min-ms 1
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from control.jsonlog import iter_json_lines
+
+
+def _attributes(span):
+    result = {}
+    for attribute in span.get('attributes', []):
+        value = attribute.get('value', {})
+        result[attribute['key']] = next(iter(value.values()), None) if value else None
+    return result
+
+
+def _duration_ms(span):
+    return (int(span['endTimeUnixNano']) - int(span['startTimeUnixNano'])) / 1e6
+
+
+class Command(BaseCommand):
+    help = 'Печатает самые медленные трассы деревом спанов с долей времени каждого узла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=None, help='Файл трасс (по умолчанию TRACING_FILE)')
+        parser.add_argument('--top', type=int, default=5, help='Сколько трасс показать')
+        parser.add_argument('--name', default=None, help='Только трассы, в имени корня которых есть подстрока')
+        parser.add_argument('--min-ms', type=float, default=0.5, help='Скрывать спаны короче, мс')
+
+    def handle(self, *args, **options):
+        path = options['file'] or settings.TRACING_FILE
+        traces = []
+        for payload in iter_json_lines(path):
+            spans = [
+                span
+                for resource in payload.get('resourceSpans', [])
+                for scope in resource.get('scopeSpans', [])
+                for span in scope.get('spans', [])
+            ]
+            root = next((span for span in spans if not span.get('parentSpanId')), None)
+            if root is None:
+                continue
+            if options['name'] and options['name'] not in root['name']:
+                continue
+            traces.append((_duration_ms(root), root, spans))
+        if not traces:
+            raise CommandError(f'В файле {path} нет трасс')
+
+        traces.sort(key=lambda item: item[0], reverse=True)
+        for duration, root, spans in traces[:options['top']]:
+            children = {}
+            for span in spans:
+                children.setdefault(span.get('parentSpanId'), []).append(span)
+            self.stdout.write('')
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{root["traceId"]}  {duration:.1f} мс  спанов: {len(spans)}'))
+            self._print_tree(root, children, duration, 0, options['min_ms'])
+
+    def _print_tree(self, span, children, root_duration, depth, min_ms):
+        duration = _duration_ms(span)
+        share = duration * 100 / root_duration if root_duration else 0
+        attributes = _attributes(span)
+        label = span['name']
+        if span['name'] == 'db.query':
+            label = f'SQL {str(attributes.get("db.statement", ""))[:120]}'
+        elif span['name'] == 'template.render':
+            label = f'шаблон {attributes.get("template.name", "")}'
+        mark = ' !' if span.get('status', {}).get('code') == 2 else ''
+        self.stdout.write(f'{"  " * depth}{duration:8.1f} мс {share:5.1f}%  {label}{mark}')
+
+        nested = sorted(children.get(span['spanId'], []), key=lambda item: int(item['startTimeUnixNano']))
+        hidden, hidden_ms = 0, 0.0
+        for child in nested:
+            child_duration = _duration_ms(child)
+            if child_duration < min_ms:
+                hidden += 1
+                hidden_ms += child_duration
+                continue
+            self._print_tree(child, children, root_duration, depth + 1, min_ms)
+        if hidden:
+            self.stdout.write(f'{"  " * (depth + 1)}{hidden_ms:8.1f} мс         ... еще {hidden} коротких спанов')
@@ -0,0 +1,320 @@
+"""
+Метрики в текстовом формате Prometheus без внешних зависимостей.
+
+Каждый процесс (воркер gunicorn, run_jobs) копит счетчики и гистограммы
+в памяти и периодически сбрасывает их в свой файл METRICS_DIR/<pid>.json.
+Endpoint /metrics суммирует файлы всех процессов; файлы завершившихся
+процессов сворачиваются в archive.json, чтобы счетчики не уменьшались.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .db import wrap_connections
+
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Описание метрик: имя -> (тип, подсказка, границы гистограммы)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Время обработки запроса по имени URL', LATENCY_BUCKETS),
+    'http_request_db_queries': ('histogram', 'Число SQL-запросов на HTTP-запрос по имени URL', QUERY_COUNT_BUCKETS),
+    'http_requests_total': ('counter', 'Число HTTP-запросов по имени URL и коду ответа', None),
+    'cache_requests_total': ('counter', 'Обращения к кэшу результатов запросов (hit/miss)', None),
+    'wizard_transactions_created_total': ('counter', 'Транзакции, созданные мастером', None),
+    'estimate_exports_total': ('counter', 'Экспорт смет по аудитории и формату', None),
+    'background_jobs_total': ('counter', 'Завершенные фоновые задачи по типу и статусу', None),
+    'statement_exports_total': ('counter', 'Выгрузки актов сверки по формату', None),
+    'pnl_exports_total': ('counter', 'Выгрузки отчета о прибылях и убытках по формату', None),
+    'cash_flow_exports_total': ('counter', 'Выгрузки отчета о движении денежных средств по формату', None),
+    'estimate_items_bulk_edited_total': ('counter', 'Позиции смет, измененные массовой правкой, по источнику (admin/api)', None),
+    'bank_import_transactions_total': ('counter', 'Транзакции, созданные импортом банковских выписок', None),
+}
+
+ARCHIVE_FILE = 'archive.json'
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+_last_flush = 0.0
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(metric, amount=1, **labels):
+    """Увеличить счетчик"""
+    if not settings.METRICS_ENABLED:
+        return
+    with _lock:
+        _counters[(metric, _labels_key(labels))] += amount
+    _maybe_flush()
+
+
+def observe(metric, value, **labels):
+    """Добавить наблюдение в гистограмму"""
+    if not settings.METRICS_ENABLED:
+        return
+    buckets = METRICS[metric][2]
+    key = (metric, _labels_key(labels))
+    with _lock:
+        state = _histograms.get(key)
+        if state is None:
+            state = _histograms[key] = [[0] * len(buckets), 0.0, 0]
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                state[0][index] += 1
+                break
+        state[1] += value
+        state[2] += 1
+    _maybe_flush()
+
+
+def _snapshot():
+    with _lock:
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [
+                [name, list(labels), list(state[0]), state[1], state[2]]
+                for (name, labels), state in _histograms.items()
+            ],
+        }
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(data, fh)
+    os.replace(tmp_path, path)
+
+
+def flush():
+    """Записать метрики процесса в общий каталог"""
+    global _last_flush
+    if not settings.METRICS_ENABLED:
+        return
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    _last_flush = time.monotonic()
+    _write_json(os.path.join(settings.METRICS_DIR, f'{os.getpid()}.json'), _snapshot())
+
+
+def _maybe_flush():
+    if time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL:
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        pass
+
+
+atexit.register(_flush_at_exit)
+
+
+def _merge(total, data):
+    for name, labels, value in data.get('counters', []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        total['counters'][key] = total['counters'].get(key, 0) + value
+    for name, labels, buckets, value_sum, count in data.get('histograms', []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        state = total['histograms'].get(key)
+        if state is None:
+            state = total['histograms'][key] = [[0] * len(buckets), 0.0, 0]
+        state[0] = [a + b for a, b in zip(state[0], buckets)]
+        state[1] += value_sum
+        state[2] += count
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _to_file_format(total):
+    return {
+        'counters': [[name, [list(pair) for pair in labels], value] for (name, labels), value in total['counters'].items()],
+        'histograms': [
+            [name, [list(pair) for pair in labels], state[0], state[1], state[2]]
+            for (name, labels), state in total['histograms'].items()
+        ],
+    }
+
+
+def _read(path):
+    try:
+        with open(path, encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+@contextmanager
+def _directory_lock(directory):
+    """Блокировка каталога, чтобы два воркера не перенесли один файл в архив дважды"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(os.path.join(directory, '.lock'), 'w') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def collect():
+    """Сумма метрик всех процессов; файлы завершившихся процессов переносятся в архив"""
+    flush()
+    with _directory_lock(settings.METRICS_DIR):
+        return _collect(settings.METRICS_DIR)
+
+
+def _collect(directory):
+    total = {'counters': {}, 'histograms': {}}
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    archive = {'counters': {}, 'histograms': {}}
+    _merge(archive, _read(archive_path))
+    dead = []
+    for filename in os.listdir(directory):
+        name, ext = os.path.splitext(filename)
+        if ext != '.json' or not name.isdigit():
+            continue
+        path = os.path.join(directory, filename)
+        data = _read(path)
+        if _pid_alive(int(name)):
+            _merge(total, data)
+        else:
+            _merge(archive, data)
+            dead.append(path)
+    if dead:
+        _write_json(archive_path, _to_file_format(archive))
+        for path in dead:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    _merge(total, _to_file_format(archive))
+    return total
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def render_metrics():
+    """Текст в формате Prometheus exposition 0.0.4"""
+    total = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(total['counters'].items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value:g}')
+        else:
+            for (metric, labels), (counts, value_sum, count) in sorted(total['histograms'].items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", f"{bound:g}")])} {cumulative}')
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {value_sum:.6f}')
+                lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+    # Счетчики без описания в METRICS не теряются: выводятся с общим типом counter
+    unregistered = sorted({metric for metric, _labels in total['counters']} - set(METRICS))
+    for name in unregistered:
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in sorted(total['counters'].items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value:g}')
+
+    # Доля попаданий в кэш по всем процессам
+    hits = sum(v for (m, labels), v in total['counters'].items() if m == 'cache_requests_total' and ('result', 'hit') in labels)
+    misses = sum(v for (m, labels), v in total['counters'].items() if m == 'cache_requests_total' and ('result', 'miss') in labels)
+    lines.append('# HELP cache_hit_ratio Доля попаданий в кэш результатов запросов')
+    lines.append('# TYPE cache_hit_ratio gauge')
+    lines.append(f'cache_hit_ratio {hits / (hits + misses) if hits + misses else 0:.4f}')
+    return '\n'.join(lines) + '\n'
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Время ответа и число SQL-запросов по имени URL; работает и под ASGI"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        counter = _QueryCounter()
+        start = time.perf_counter()
+        with connections['default'].execute_wrapper(counter):
+            response = self.get_response(request)
+        return self._observe(request, response, counter, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        counter = _QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            # Запросы синхронной части идут в ее потоке и через его соединение
+            await sync_to_async(wrap_connections)(stack, counter, ['default'])
+            response = await self.get_response(request)
+        return self._observe(request, response, counter, time.perf_counter() - start)
+
+    def _observe(self, request, response, counter, duration):
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.view_name if match else 'unresolved'
+        observe('http_request_duration_seconds', duration, url_name=url_name)
+        observe('http_request_db_queries', counter.count, url_name=url_name)
+        inc('http_requests_total', url_name=url_name, status=response.status_code)
+        return response
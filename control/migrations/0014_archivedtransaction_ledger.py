@@ -0,0 +1,78 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+TRANSACTION_COLUMNS = (
+    '"id", "amount", "transaction_type", "category_id", "contractor_id", "description", "date", '
+    '"stage_id", "estimate_id", "estimate_item_id", "created_at", "updated_at"'
+)
+
+# Транзакции вместе с архивом (модель LedgerTransaction)
+CREATE_LEDGER_VIEW = (
+    f'CREATE VIEW "control_transaction_all" AS '
+    f'SELECT {TRANSACTION_COLUMNS}, FALSE AS "is_archived" FROM "control_transaction" '
+    f'UNION ALL '
+    f'SELECT {TRANSACTION_COLUMNS}, TRUE AS "is_archived" FROM "control_archivedtransaction"'
+)
+DROP_LEDGER_VIEW = 'DROP VIEW IF EXISTS "control_transaction_all"'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control', '0013_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerTransaction',
+            fields=[
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15, verbose_name='Сумма')),
+                ('transaction_type', models.CharField(choices=[('income', 'Доход'), ('expense', 'Расход'), ('transfer', 'Перевод'), ('debt_give', 'Дать в долг'), ('debt_receive', 'Получить в долг'), ('debt_repay', 'Вернуть долг'), ('debt_received', 'Получить возврат долга')], max_length=20, verbose_name='Тип операции')),
+                ('description', models.CharField(blank=True, max_length=200, null=True, verbose_name='Описание')),
+                ('date', models.DateField(default=django.utils.timezone.now, verbose_name='Дата')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('is_archived', models.BooleanField(default=False, verbose_name='В архиве')),
+            ],
+            options={
+                'verbose_name': 'Транзакция (с архивом)',
+                'verbose_name_plural': 'Транзакции (с архивом)',
+                'db_table': 'control_transaction_all',
+                'ordering': ['-date', '-created_at'],
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15, verbose_name='Сумма')),
+                ('transaction_type', models.CharField(choices=[('income', 'Доход'), ('expense', 'Расход'), ('transfer', 'Перевод'), ('debt_give', 'Дать в долг'), ('debt_receive', 'Получить в долг'), ('debt_repay', 'Вернуть долг'), ('debt_received', 'Получить возврат долга')], max_length=20, verbose_name='Тип операции')),
+                ('description', models.CharField(blank=True, max_length=200, null=True, verbose_name='Описание')),
+                ('date', models.DateField(default=django.utils.timezone.now, verbose_name='Дата')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('archived_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Дата архивации')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_transactions', to='control.category', verbose_name='Категория')),
+                ('contractor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='archived_transactions', to=settings.AUTH_USER_MODEL, verbose_name='Контрагент')),
+                ('estimate', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_transactions', to='control.estimate', verbose_name='Смета')),
+                ('estimate_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_transactions', to='control.estimateitem', verbose_name='Пункт сметы')),
+                ('stage', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_transactions', to='control.stage', verbose_name='Этап')),
+            ],
+            options={
+                'verbose_name': 'Архивная транзакция',
+                'verbose_name_plural': 'Архив транзакций',
+                'ordering': ['-date', '-created_at'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['date'], name='control_arc_date_011003_idx')],
+            },
+        ),
+        migrations.RunSQL(CREATE_LEDGER_VIEW, DROP_LEDGER_VIEW),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control', '0014_archivedtransaction_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClosedPeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_type', models.CharField(choices=[('month', 'Месяц'), ('quarter', 'Квартал')], max_length=10, verbose_name='Тип периода')),
+                ('date_from', models.DateField(blank=True, null=True, verbose_name='Начало периода')),
+                ('date_to', models.DateField(unique=True, verbose_name='Конец периода')),
+                ('transactions_count', models.PositiveIntegerField(default=0, verbose_name='Транзакций за период')),
+                ('closed_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата закрытия')),
+                ('closed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='closed_periods', to=settings.AUTH_USER_MODEL, verbose_name='Закрыл')),
+            ],
+            options={
+                'verbose_name': 'Закрытый период',
+                'verbose_name_plural': 'Закрытые периоды',
+                'ordering': ['-date_to'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PeriodBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_type', models.CharField(choices=[('income', 'Доход'), ('expense', 'Расход'), ('transfer', 'Перевод'), ('debt_give', 'Дать в долг'), ('debt_receive', 'Получить в долг'), ('debt_repay', 'Вернуть долг'), ('debt_received', 'Получить возврат долга')], max_length=20, verbose_name='Тип операции')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Транзакций')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=17, verbose_name='Сумма')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='period_balances', to='control.category', verbose_name='Категория')),
+                ('contractor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='period_balances', to=settings.AUTH_USER_MODEL, verbose_name='Контрагент')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='control.closedperiod', verbose_name='Период')),
+                ('stage', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='period_balances', to='control.stage', verbose_name='Этап')),
+            ],
+            options={
+                'verbose_name': 'Остаток на конец периода',
+                'verbose_name_plural': 'Остатки на конец периода',
+                'indexes': [models.Index(fields=['period', 'stage'], name='control_per_period__6e77c2_idx')],
+            },
+        ),
+    ]
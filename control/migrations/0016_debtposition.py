@@ -0,0 +1,71 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Тип операции -> накопительное поле позиции (см. control/debts.py)
+DEBT_FIELDS = {
+    'debt_give': 'given',
+    'debt_received': 'returned',
+    'debt_receive': 'borrowed',
+    'debt_repay': 'repaid',
+}
+
+
+def build_positions(apps, schema_editor):
+    """Начальные позиции по уже существующим транзакциям (рабочим и архивным)"""
+    from decimal import Decimal
+    from django.db.models import Count, Sum
+    DebtPosition = apps.get_model('control', 'DebtPosition')
+    alias = schema_editor.connection.alias
+    positions = {}
+    for model_name in ('Transaction', 'ArchivedTransaction'):
+        rows = (
+            apps.get_model('control', model_name).objects.using(alias)
+            .filter(transaction_type__in=list(DEBT_FIELDS), contractor__isnull=False)
+            .order_by().values('contractor_id', 'transaction_type')
+            .annotate(total=Sum('amount'), count=Count('id'))
+        )
+        for row in rows:
+            position = positions.setdefault(row['contractor_id'], DebtPosition(contractor_id=row['contractor_id']))
+            field = DEBT_FIELDS[row['transaction_type']]
+            setattr(position, field, getattr(position, field) + (row['total'] or Decimal('0')).quantize(Decimal('0.01')))
+            position.operations_count += row['count']
+    for position in positions.values():
+        position.receivable = position.given - position.returned
+        position.payable = position.borrowed - position.repaid
+    DebtPosition.objects.using(alias).bulk_create(positions.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control', '0015_closedperiod_periodbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DebtPosition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('given', models.DecimalField(decimal_places=2, default=0, max_digits=17, verbose_name='Выдано в долг')),
+                ('returned', models.DecimalField(decimal_places=2, default=0, max_digits=17, verbose_name='Возвращено нам')),
+                ('borrowed', models.DecimalField(decimal_places=2, default=0, max_digits=17, verbose_name='Взято в долг')),
+                ('repaid', models.DecimalField(decimal_places=2, default=0, max_digits=17, verbose_name='Возвращено нами')),
+                ('receivable', models.DecimalField(decimal_places=2, default=0, max_digits=17, verbose_name='Должен нам')),
+                ('payable', models.DecimalField(decimal_places=2, default=0, max_digits=17, verbose_name='Мы должны')),
+                ('operations_count', models.PositiveIntegerField(default=0, verbose_name='Операций')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('contractor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='debt_position', to=settings.AUTH_USER_MODEL, verbose_name='Контрагент')),
+            ],
+            options={
+                'verbose_name': 'Долг контрагента',
+                'verbose_name_plural': 'Долги контрагентов',
+                'ordering': ['-receivable'],
+                'indexes': [models.Index(fields=['-receivable'], name='control_debt_receivable_idx'), models.Index(fields=['-payable'], name='control_debt_payable_idx')],
+            },
+        ),
+        migrations.RunPython(build_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control', '0016_debtposition'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedtransaction',
+            index=models.Index(fields=['contractor', 'date', 'created_at'], name='control_atx_contractor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['contractor', 'date', 'created_at'], name='control_tx_contractor_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def freeze_approved(apps, schema_editor):
+    """Первые ревизии снимков для уже утвержденных смет (по сохраненным суммам позиций)"""
+    from decimal import Decimal
+    Estimate = apps.get_model('control', 'Estimate')
+    EstimateItem = apps.get_model('control', 'EstimateItem')
+    EstimateSnapshot = apps.get_model('control', 'EstimateSnapshot')
+    alias = schema_editor.connection.alias
+
+    def money(value):
+        return str(Decimal(value or 0).quantize(Decimal('0.01')))
+
+    for estimate in Estimate.objects.using(alias).filter(status__in=('approved', 'completed')).iterator():
+        items = EstimateItem.objects.using(alias).filter(estimate=estimate).select_related('price_item').order_by('id')
+        lines = [
+            [
+                item.id, item.price_item.name if item.price_item else 'Позиция',
+                item.price_item.unit if item.price_item else '', bool(item.price_item and item.price_item.material_id),
+                money(item.quantity), money(item.unit_price), money(item.base_price), item.income_type,
+                money(item.income_value), item.is_percentage, money(item.income_amount),
+                money(item.client_price), money(item.contractor_price),
+            ]
+            for item in items
+        ]
+        totals = {
+            key: money(sum((Decimal(line[index]) for line in lines), Decimal('0')))
+            for key, index in (('client', 11), ('contractor', 12), ('income', 10), ('base', 6))
+        }
+        snapshot = EstimateSnapshot.objects.using(alias).create(
+            estimate=estimate, revision=1, data={'lines': lines, 'totals': totals},
+        )
+        Estimate.objects.using(alias).filter(pk=estimate.pk).update(current_snapshot=snapshot)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control', '0017_transaction_contractor_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstimateSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision', models.PositiveIntegerField(verbose_name='Ревизия')),
+                ('data', models.JSONField(verbose_name='Данные')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('estimate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='control.estimate', verbose_name='Смета')),
+            ],
+            options={
+                'verbose_name': 'Снимок сметы',
+                'verbose_name_plural': 'Снимки смет',
+                'ordering': ['estimate', '-revision'],
+            },
+        ),
+        migrations.AddField(
+            model_name='estimate',
+            name='current_snapshot',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='control.estimatesnapshot', verbose_name='Текущий снимок'),
+        ),
+        migrations.AddConstraint(
+            model_name='estimatesnapshot',
+            constraint=models.UniqueConstraint(fields=('estimate', 'revision'), name='control_snapshot_revision_uniq'),
+        ),
+        migrations.RunPython(freeze_approved, migrations.RunPython.noop),
+    ]
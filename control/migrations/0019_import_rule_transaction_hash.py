@@ -0,0 +1,62 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control', '0018_estimatesnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, verbose_name='Название')),
+                ('field', models.CharField(choices=[('description', 'Назначение платежа'), ('counterparty', 'Контрагент'), ('inn', 'ИНН контрагента')], default='description', max_length=20, verbose_name='Поле выписки')),
+                ('pattern', models.CharField(help_text='Подстрока, регистр не учитывается', max_length=200, verbose_name='Образец')),
+                ('direction', models.CharField(blank=True, choices=[('', 'Любое'), ('income', 'Поступление'), ('expense', 'Списание')], max_length=10, verbose_name='Направление')),
+                ('transaction_type', models.CharField(blank=True, choices=[('income', 'Доход'), ('expense', 'Расход'), ('transfer', 'Перевод'), ('debt_give', 'Дать в долг'), ('debt_receive', 'Получить в долг'), ('debt_repay', 'Вернуть долг'), ('debt_received', 'Получить возврат долга')], help_text='Пусто - доход или расход по знаку суммы', max_length=20, verbose_name='Тип операции')),
+                ('priority', models.PositiveIntegerField(default=100, help_text='Меньше - проверяется раньше', verbose_name='Приоритет')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активно')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Правило импорта выписки',
+                'verbose_name_plural': 'Правила импорта выписки',
+                'ordering': ['priority', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedtransaction',
+            name='import_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Хэш импорта'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='import_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Хэш импорта'),
+        ),
+        migrations.AddConstraint(
+            model_name='archivedtransaction',
+            constraint=models.UniqueConstraint(condition=models.Q(('import_hash__isnull', False)), fields=('import_hash',), name='control_atx_import_hash_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.UniqueConstraint(condition=models.Q(('import_hash__isnull', False)), fields=('import_hash',), name='control_tx_import_hash_uniq'),
+        ),
+        migrations.AddField(
+            model_name='importrule',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='import_rules', to='control.category', verbose_name='Категория'),
+        ),
+        migrations.AddField(
+            model_name='importrule',
+            name='contractor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_rules', to=settings.AUTH_USER_MODEL, verbose_name='Контрагент'),
+        ),
+    ]
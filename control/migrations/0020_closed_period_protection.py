@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:01
+
+import control.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control', '0019_import_rule_transaction_hash'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='closedperiod',
+            options={'ordering': ['-date_to'], 'permissions': [('close_period', 'Может закрывать и открывать периоды')], 'verbose_name': 'Закрытый период', 'verbose_name_plural': 'Закрытые периоды'},
+        ),
+        migrations.AlterField(
+            model_name='archivedtransaction',
+            name='estimate',
+            field=models.ForeignKey(blank=True, null=True, on_delete=control.models.CASCADE_OPEN_PERIODS, related_name='archived_transactions', to='control.estimate', verbose_name='Смета'),
+        ),
+        migrations.AlterField(
+            model_name='archivedtransaction',
+            name='estimate_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=control.models.SET_NULL_OPEN_PERIODS, related_name='archived_transactions', to='control.estimateitem', verbose_name='Пункт сметы'),
+        ),
+        migrations.AlterField(
+            model_name='archivedtransaction',
+            name='stage',
+            field=models.ForeignKey(blank=True, null=True, on_delete=control.models.CASCADE_OPEN_PERIODS, related_name='archived_transactions', to='control.stage', verbose_name='Этап'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='estimate',
+            field=models.ForeignKey(blank=True, null=True, on_delete=control.models.CASCADE_OPEN_PERIODS, related_name='transactions', to='control.estimate', verbose_name='Смета'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='estimate_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=control.models.SET_NULL_OPEN_PERIODS, related_name='transactions', to='control.estimateitem', verbose_name='Пункт сметы'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='stage',
+            field=models.ForeignKey(blank=True, null=True, on_delete=control.models.CASCADE_OPEN_PERIODS, related_name='transactions', to='control.stage', verbose_name='Этап'),
+        ),
+    ]
@@ -4,7 +4,10 @@ from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.core.validators import RegexValidator
 import uuid
+from decimal import Decimal
 from django.core.exceptions import ValidationError
+from django.db.models import Sum
+from .cache import VersionedQuerySet, cached
 
 
 PHONE_PATTERNS = {
@@ -21,7 +24,7 @@ STATUS_MODEL = (
 )
 
 
-class CustomUserManager(BaseUserManager):
+class CustomUserManager(BaseUserManager.from_queryset(VersionedQuerySet)):
     """
     Менеджер пользователей, использующий телефон как логин (USERNAME_FIELD).
     """
@@ -110,6 +113,8 @@ class WorkType(models.Model):
     is_active = models.BooleanField('Активен', default=True)
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
 
+    objects = VersionedQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Вид работ'
         verbose_name_plural = 'Виды работ'
@@ -126,6 +131,8 @@ class MaterialType(models.Model):
     is_active = models.BooleanField('Активен', default=True)
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
 
+    objects = VersionedQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Вид материала'
         verbose_name_plural = 'Виды материалов'
@@ -160,6 +167,8 @@ class PriceItem(models.Model):
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
 
+    objects = VersionedQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Позиция прайса'
         verbose_name_plural = 'Позиции прайса'
@@ -192,6 +201,8 @@ class Category(models.Model):
     is_active = models.BooleanField('Активна', default=True)
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
 
+    objects = VersionedQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Категория'
         verbose_name_plural = 'Категории'
@@ -218,6 +229,8 @@ class Project(models.Model):
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
     is_active = models.BooleanField('Активен', default=True)
 
+    objects = VersionedQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Проект'
         verbose_name_plural = 'Проекты'
@@ -251,6 +264,8 @@ class Object(models.Model):
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
 
+    objects = VersionedQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Объект'
         verbose_name_plural = 'Объекты'
@@ -276,6 +291,8 @@ class Stage(models.Model):
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
 
+    objects = VersionedQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Этап'
         verbose_name_plural = 'Этапы'
@@ -286,6 +303,22 @@ class Stage(models.Model):
         return f"{self.object.name} - {self.name} (этап {self.order})"
 
 
+ESTIMATE_TOTAL_FIELDS = {
+    'client': 'client_price',
+    'contractor': 'contractor_price',
+    'income': 'income_amount',
+    'base': 'base_price',
+}
+
+
+class EstimateQuerySet(VersionedQuerySet):
+    def with_totals(self):
+        """Суммы позиций в том же запросе, что и сметы (для списков без N+1)"""
+        return self.annotate(**{
+            f'totals_{key}': Sum(f'items__{field}') for key, field in ESTIMATE_TOTAL_FIELDS.items()
+        })
+
+
 class Estimate(models.Model):
     """Смета по этапу"""
     STATUS_CHOICES = [
@@ -294,6 +327,8 @@ class Estimate(models.Model):
         ('approved', 'Утвержден'),
         ('completed', 'Выполнен'),
     ]
+    # Статусы утвержденной сметы: читается из снимка (control/snapshots.py)
+    APPROVED_STATUSES = ('approved', 'completed')
     
     stage = models.ForeignKey(
         Stage, 
@@ -302,9 +337,20 @@ class Estimate(models.Model):
         related_name='estimates'
     )
     status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default='draft')
+    current_snapshot = models.ForeignKey(
+        'EstimateSnapshot',
+        on_delete=models.SET_NULL,
+        verbose_name='Текущий снимок',
+        related_name='+',
+        null=True,
+        blank=True,
+        editable=False,
+    )
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
 
+    objects = EstimateQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Смета'
         verbose_name_plural = 'Сметы'
@@ -313,21 +359,37 @@ class Estimate(models.Model):
     def __str__(self):
         return f"Смета {self.stage.name} - {self.get_status_display()}"
     
+    def get_totals(self):
+        """Все суммы по смете одним запросом (кэшируются до изменения позиций)"""
+        if not self.pk:
+            return {'client': Decimal('0'), 'contractor': Decimal('0'), 'income': Decimal('0'), 'base': Decimal('0')}
+        if hasattr(self, 'totals_client'):
+            # Сметы получены через with_totals()
+            return {
+                key: (getattr(self, f'totals_{key}') or Decimal('0')).quantize(Decimal('0.01'))
+                for key in ESTIMATE_TOTAL_FIELDS
+            }
+        return cached('estimate_totals', (self.pk,), ('control.EstimateItem',), self._compute_totals)
+
+    def _compute_totals(self):
+        totals = self.items.aggregate(**{key: Sum(field) for key, field in ESTIMATE_TOTAL_FIELDS.items()})
+        return {key: (value or Decimal('0')).quantize(Decimal('0.01')) for key, value in totals.items()}
+
     def get_client_total(self):
         """Сумма для заказчика (с наценками)"""
-        return sum(item.client_price for item in self.items.all())
+        return self.get_totals()['client']
     
     def get_contractor_total(self):
         """Сумма для исполнителя (без наценок, с откатами)"""
-        return sum(item.contractor_price for item in self.items.all())
+        return self.get_totals()['contractor']
     
     def get_income_total(self):
         """Общий доход по смете"""
-        return sum(item.income_amount for item in self.items.all())
+        return self.get_totals()['income']
     
     def get_base_total(self):
         """Базовая сумма (без наценок и откатов)"""
-        return sum(item.base_price for item in self.items.all())
+        return self.get_totals()['base']
 
 
 
@@ -378,6 +440,8 @@ class EstimateItem(models.Model):
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
 
+    objects = VersionedQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Элемент сметы'
         verbose_name_plural = 'Элементы сметы'
@@ -452,8 +516,69 @@ class EstimateItem(models.Model):
             return f"{self.income_value} руб."
 
 
-class Transaction(models.Model):
-    """Универсальная модель для всех движений средств"""
+class EstimateSnapshot(models.Model):
+    """
+    Снимок утвержденной сметы: строки с рассчитанными суммами, названиями
+    и единицами прайса и итоги по аудиториям в одном JSON (control/snapshots.py).
+    Снимок не изменяется - правка утвержденной сметы создает новую ревизию.
+    """
+    estimate = models.ForeignKey(
+        Estimate, on_delete=models.CASCADE, verbose_name='Смета', related_name='snapshots',
+    )
+    revision = models.PositiveIntegerField('Ревизия')
+    data = models.JSONField('Данные')
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Снимок сметы'
+        verbose_name_plural = 'Снимки смет'
+        ordering = ['estimate', '-revision']
+        constraints = [
+            models.UniqueConstraint(fields=['estimate', 'revision'], name='control_snapshot_revision_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Смета #{self.estimate_id}, ред. {self.revision}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Снимок сметы не изменяется: правка создает новую ревизию')
+        super().save(*args, **kwargs)
+
+
+def _protect_closed_period(field, sub_objs):
+    """ProtectedError, если среди связанных транзакций есть транзакции закрытого периода"""
+    from .periods import closed_until
+    until = closed_until()
+    if until is None:
+        return
+    closed = list(sub_objs.filter(date__lte=until))
+    if closed:
+        raise models.ProtectedError(
+            f'Период по {until:%d.%m.%Y} закрыт: удаление задело бы транзакции закрытого периода '
+            f'({field.model._meta.verbose_name_plural}: {len(closed)})',
+            closed,
+        )
+
+
+def CASCADE_OPEN_PERIODS(collector, field, sub_objs, using):
+    """on_delete: CASCADE, но транзакции закрытого периода защищены, как при PROTECT"""
+    _protect_closed_period(field, sub_objs)
+    models.CASCADE(collector, field, sub_objs, using)
+
+
+def SET_NULL_OPEN_PERIODS(collector, field, sub_objs, using):
+    """on_delete: SET_NULL, но транзакции закрытого периода защищены, как при PROTECT"""
+    _protect_closed_period(field, sub_objs)
+    models.SET_NULL(collector, field, sub_objs, using)
+
+
+class AbstractTransaction(models.Model):
+    """
+    Общие поля и методы транзакции. Наследники: Transaction (рабочая таблица),
+    ArchivedTransaction (архив) и LedgerTransaction (представление обеих);
+    внешние ключи объявлены в каждом наследнике со своими related_name.
+    """
     TRANSACTION_TYPE_CHOICES = [
         ('income', 'Доход'),
         ('expense', 'Расход'),
@@ -466,44 +591,15 @@ class Transaction(models.Model):
     
     amount = models.DecimalField('Сумма', max_digits=15, decimal_places=2)
     transaction_type = models.CharField('Тип операции', max_length=20, choices=TRANSACTION_TYPE_CHOICES)
-    category = models.ForeignKey(Category, on_delete=models.PROTECT, verbose_name='Категория')
-    contractor = models.ForeignKey(CustomUser, on_delete=models.PROTECT, verbose_name='Контрагент', null=True, blank=True)
     
     description = models.CharField('Описание', max_length=200, null=True, blank=True)
     date = models.DateField('Дата', default=timezone.now)
     
-    # Связи с проектами/этапами/сметами
-    stage = models.ForeignKey(
-        Stage, 
-        on_delete=models.CASCADE, 
-        verbose_name='Этап',
-        related_name='transactions',
-        null=True, 
-        blank=True
-    )
-    estimate = models.ForeignKey(
-        Estimate, 
-        on_delete=models.CASCADE, 
-        verbose_name='Смета',
-        related_name='transactions',
-        null=True, 
-        blank=True
-    )
-    estimate_item = models.ForeignKey(
-        EstimateItem, 
-        on_delete=models.SET_NULL, 
-        verbose_name='Пункт сметы',
-        related_name='transactions',
-        null=True, 
-        blank=True
-    )
-    
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
 
     class Meta:
-        verbose_name = 'Транзакция'
-        verbose_name_plural = 'Транзакции'
+        abstract = True
         ordering = ['-date', '-created_at']
 
     def __str__(self):
@@ -538,3 +634,346 @@ class Transaction(models.Model):
             return self.estimate.stage
         return None
 
+
+class Transaction(AbstractTransaction):
+    """Универсальная модель для всех движений средств"""
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, verbose_name='Категория')
+    contractor = models.ForeignKey(CustomUser, on_delete=models.PROTECT, verbose_name='Контрагент', null=True, blank=True)
+    
+    # Связи с проектами/этапами/сметами
+    stage = models.ForeignKey(
+        Stage, 
+        on_delete=CASCADE_OPEN_PERIODS, 
+        verbose_name='Этап',
+        related_name='transactions',
+        null=True, 
+        blank=True
+    )
+    estimate = models.ForeignKey(
+        Estimate, 
+        on_delete=CASCADE_OPEN_PERIODS, 
+        verbose_name='Смета',
+        related_name='transactions',
+        null=True, 
+        blank=True
+    )
+    estimate_item = models.ForeignKey(
+        EstimateItem, 
+        on_delete=SET_NULL_OPEN_PERIODS, 
+        verbose_name='Пункт сметы',
+        related_name='transactions',
+        null=True, 
+        blank=True
+    )
+    # Хэш строки банковской выписки (control/bank_import.py): повторный импорт не дублирует транзакции
+    import_hash = models.CharField('Хэш импорта', max_length=64, null=True, blank=True, editable=False)
+
+    objects = VersionedQuerySet.as_manager()
+
+    class Meta(AbstractTransaction.Meta):
+        verbose_name = 'Транзакция'
+        verbose_name_plural = 'Транзакции'
+        # Акт сверки: движения контрагента в порядке (дата, создание)
+        indexes = [models.Index(fields=['contractor', 'date', 'created_at'], name='control_tx_contractor_idx')]
+        # Частичный уникальный индекс: только импортированные строки
+        constraints = [
+            models.UniqueConstraint(
+                fields=['import_hash'], condition=models.Q(import_hash__isnull=False), name='control_tx_import_hash_uniq',
+            ),
+        ]
+
+    def clean(self):
+        from .periods import PeriodClosedError, check_period_open
+        super().clean()
+        try:
+            check_period_open(self)
+        except PeriodClosedError as e:
+            raise ValidationError({'date': e.messages})
+
+    def save(self, *args, **kwargs):
+        """Транзакции закрытых периодов не меняются (см. control/periods.py)"""
+        from .periods import check_period_open
+        check_period_open(self)
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        from .periods import check_period_open
+        check_period_open(self)
+        return super().delete(*args, **kwargs)
+
+
+class ArchivedTransaction(AbstractTransaction):
+    """
+    Архив транзакций завершенных проектов и закрытых периодов: те же
+    колонки и те же id, что в Transaction (см. control/archive.py)
+    """
+    id = models.BigIntegerField(primary_key=True)
+    category = models.ForeignKey(
+        Category, on_delete=models.PROTECT, verbose_name='Категория', related_name='archived_transactions',
+    )
+    contractor = models.ForeignKey(
+        CustomUser, on_delete=models.PROTECT, verbose_name='Контрагент', related_name='archived_transactions',
+        null=True, blank=True,
+    )
+    stage = models.ForeignKey(
+        Stage, on_delete=CASCADE_OPEN_PERIODS, verbose_name='Этап', related_name='archived_transactions',
+        null=True, blank=True,
+    )
+    estimate = models.ForeignKey(
+        Estimate, on_delete=CASCADE_OPEN_PERIODS, verbose_name='Смета', related_name='archived_transactions',
+        null=True, blank=True,
+    )
+    estimate_item = models.ForeignKey(
+        EstimateItem, on_delete=SET_NULL_OPEN_PERIODS, verbose_name='Пункт сметы', related_name='archived_transactions',
+        null=True, blank=True,
+    )
+    import_hash = models.CharField('Хэш импорта', max_length=64, null=True, blank=True, editable=False)
+    archived_at = models.DateTimeField('Дата архивации', default=timezone.now, db_index=True)
+
+    objects = VersionedQuerySet.as_manager()
+
+    class Meta(AbstractTransaction.Meta):
+        verbose_name = 'Архивная транзакция'
+        verbose_name_plural = 'Архив транзакций'
+        indexes = [
+            models.Index(fields=['date']),
+            models.Index(fields=['contractor', 'date', 'created_at'], name='control_atx_contractor_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['import_hash'], condition=models.Q(import_hash__isnull=False), name='control_atx_import_hash_uniq',
+            ),
+        ]
+
+
+class LedgerTransaction(AbstractTransaction):
+    """
+    Транзакции вместе с архивом: представление control_transaction_all
+    (UNION ALL рабочей и архивной таблиц), только для чтения
+    """
+    id = models.BigIntegerField(primary_key=True)
+    category = models.ForeignKey(
+        Category, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+', verbose_name='Категория',
+    )
+    contractor = models.ForeignKey(
+        CustomUser, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+', verbose_name='Контрагент',
+        null=True, blank=True,
+    )
+    stage = models.ForeignKey(
+        Stage, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+', verbose_name='Этап',
+        null=True, blank=True,
+    )
+    estimate = models.ForeignKey(
+        Estimate, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+', verbose_name='Смета',
+        null=True, blank=True,
+    )
+    estimate_item = models.ForeignKey(
+        EstimateItem, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+', verbose_name='Пункт сметы',
+        null=True, blank=True,
+    )
+    is_archived = models.BooleanField('В архиве', default=False)
+
+    objects = models.Manager()
+
+    class Meta(AbstractTransaction.Meta):
+        managed = False
+        db_table = 'control_transaction_all'
+        verbose_name = 'Транзакция (с архивом)'
+        verbose_name_plural = 'Транзакции (с архивом)'
+
+
+class ImportRule(models.Model):
+    """
+    Правило импорта банковской выписки (control/bank_import.py): строка,
+    в поле которой встречается образец, получает категорию и контрагента
+    правила. Правила проверяются по приоритету, срабатывает первое.
+    """
+    FIELD_CHOICES = [
+        ('description', 'Назначение платежа'),
+        ('counterparty', 'Контрагент'),
+        ('inn', 'ИНН контрагента'),
+    ]
+    DIRECTION_CHOICES = [
+        ('', 'Любое'),
+        ('income', 'Поступление'),
+        ('expense', 'Списание'),
+    ]
+
+    name = models.CharField('Название', max_length=200)
+    field = models.CharField('Поле выписки', max_length=20, choices=FIELD_CHOICES, default='description')
+    pattern = models.CharField('Образец', max_length=200, help_text='Подстрока, регистр не учитывается')
+    direction = models.CharField('Направление', max_length=10, choices=DIRECTION_CHOICES, blank=True)
+    category = models.ForeignKey(
+        Category, on_delete=models.PROTECT, verbose_name='Категория', related_name='import_rules',
+    )
+    contractor = models.ForeignKey(
+        CustomUser, on_delete=models.SET_NULL, verbose_name='Контрагент', related_name='import_rules',
+        null=True, blank=True,
+    )
+    transaction_type = models.CharField(
+        'Тип операции', max_length=20, choices=AbstractTransaction.TRANSACTION_TYPE_CHOICES, blank=True,
+        help_text='Пусто - доход или расход по знаку суммы',
+    )
+    priority = models.PositiveIntegerField('Приоритет', default=100, help_text='Меньше - проверяется раньше')
+    is_active = models.BooleanField('Активно', default=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Правило импорта выписки'
+        verbose_name_plural = 'Правила импорта выписки'
+        ordering = ['priority', 'id']
+
+    def __str__(self):
+        return f"{self.name}: {self.get_field_display()} ~ «{self.pattern}»"
+
+
+class ClosedPeriod(models.Model):
+    """
+    Закрытый период (месяц или квартал): транзакции с датой до date_to
+    включительно не меняются, а остатки на конец периода хранятся
+    в PeriodBalance, чтобы отчеты на дату не читали всю историю
+    """
+    PERIOD_TYPE_CHOICES = [
+        ('month', 'Месяц'),
+        ('quarter', 'Квартал'),
+    ]
+
+    period_type = models.CharField('Тип периода', max_length=10, choices=PERIOD_TYPE_CHOICES)
+    date_from = models.DateField('Начало периода', null=True, blank=True)
+    date_to = models.DateField('Конец периода', unique=True)
+    transactions_count = models.PositiveIntegerField('Транзакций за период', default=0)
+    closed_by = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        verbose_name='Закрыл',
+        related_name='closed_periods',
+        null=True,
+        blank=True,
+    )
+    closed_at = models.DateTimeField('Дата закрытия', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Закрытый период'
+        verbose_name_plural = 'Закрытые периоды'
+        ordering = ['-date_to']
+        permissions = [('close_period', 'Может закрывать и открывать периоды')]
+
+    def __str__(self):
+        if self.period_type == 'quarter':
+            return f"{(self.date_to.month - 1) // 3 + 1} квартал {self.date_to.year}"
+        return f"{self.date_to:%m.%Y}"
+
+
+class PeriodBalance(models.Model):
+    """
+    Остаток нарастающим итогом на конец закрытого периода в разрезе
+    этапа, категории, контрагента и типа операции. Объект и проект -
+    через этап; строки без этапа - транзакции без привязки к проекту.
+    """
+    period = models.ForeignKey(ClosedPeriod, on_delete=models.CASCADE, verbose_name='Период', related_name='balances')
+    # Удаление этапа или справочника с историей закрытых периодов запрещено,
+    # иначе остатки разойдутся с транзакциями
+    stage = models.ForeignKey(
+        Stage, on_delete=models.PROTECT, verbose_name='Этап', related_name='period_balances', null=True, blank=True,
+    )
+    category = models.ForeignKey(
+        Category, on_delete=models.PROTECT, verbose_name='Категория', related_name='period_balances',
+    )
+    contractor = models.ForeignKey(
+        CustomUser, on_delete=models.PROTECT, verbose_name='Контрагент', related_name='period_balances',
+        null=True, blank=True,
+    )
+    transaction_type = models.CharField(
+        'Тип операции', max_length=20, choices=AbstractTransaction.TRANSACTION_TYPE_CHOICES,
+    )
+    count = models.PositiveIntegerField('Транзакций', default=0)
+    amount = models.DecimalField('Сумма', max_digits=17, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = 'Остаток на конец периода'
+        verbose_name_plural = 'Остатки на конец периода'
+        indexes = [models.Index(fields=['period', 'stage'])]
+
+    def __str__(self):
+        return f"{self.period}: {self.get_transaction_type_display()} {self.amount}"
+
+
+class DebtPosition(models.Model):
+    """
+    Долги по контрагенту нарастающим итогом (с учетом архива): обновляется
+    при сохранении и удалении транзакций долговых типов, пересчитывается
+    командой rebuild_debt_positions (см. control/debts.py)
+    """
+    contractor = models.OneToOneField(
+        CustomUser, on_delete=models.CASCADE, verbose_name='Контрагент', related_name='debt_position',
+    )
+    given = models.DecimalField('Выдано в долг', max_digits=17, decimal_places=2, default=0)
+    returned = models.DecimalField('Возвращено нам', max_digits=17, decimal_places=2, default=0)
+    borrowed = models.DecimalField('Взято в долг', max_digits=17, decimal_places=2, default=0)
+    repaid = models.DecimalField('Возвращено нами', max_digits=17, decimal_places=2, default=0)
+    # Хранятся отдельно, чтобы отчет сортировался и фильтровался по индексу
+    receivable = models.DecimalField('Должен нам', max_digits=17, decimal_places=2, default=0)
+    payable = models.DecimalField('Мы должны', max_digits=17, decimal_places=2, default=0)
+    operations_count = models.PositiveIntegerField('Операций', default=0)
+    updated_at = models.DateTimeField('Дата обновления', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Долг контрагента'
+        verbose_name_plural = 'Долги контрагентов'
+        ordering = ['-receivable']
+        indexes = [
+            models.Index(fields=['-receivable'], name='control_debt_receivable_idx'),
+            models.Index(fields=['-payable'], name='control_debt_payable_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.contractor}: должен {self.receivable}, мы должны {self.payable}"
+
+    @property
+    def net(self):
+        """Сальдо: положительное - контрагент должен нам"""
+        return self.receivable - self.payable
+
+
+class BackgroundJob(models.Model):
+    """Фоновая задача (экспорт, массовое создание транзакций, пересчет сумм)"""
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+    ]
+
+    kind = models.CharField('Тип задачи', max_length=50)
+    params = models.JSONField('Параметры', default=dict, blank=True)
+    status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    progress = models.PositiveSmallIntegerField('Прогресс, %', default=0)
+    message = models.CharField('Сообщение', max_length=255, blank=True)
+    result_file = models.FileField('Результат', upload_to='jobs/%Y/%m/', blank=True)
+    error = models.TextField('Ошибка', blank=True)
+    worker = models.CharField('Воркер', max_length=100, blank=True)
+    created_by = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        verbose_name='Автор',
+        related_name='background_jobs',
+        null=True,
+        blank=True,
+    )
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата обновления', auto_now=True)
+    started_at = models.DateTimeField('Начало выполнения', null=True, blank=True)
+    finished_at = models.DateTimeField('Окончание выполнения', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"Задача #{self.pk} {self.kind} ({self.get_status_display()})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
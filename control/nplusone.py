@@ -0,0 +1,279 @@
+"""
+Детектор N+1 запросов для разработки и тестов.
+
+В пределах запроса (NPlusOneMiddleware) или теста (assert_no_nplusone)
+считает формы SQL-запросов (fingerprint_sql). Если одна форма повторяется
+больше NPLUSONE_THRESHOLD раз, детектор пишет предупреждение в лог
+или бросает NPlusOneError (NPLUSONE_MODE = log / raise). В отчете - место
+вызова в коде проекта и атрибут модели, ленивая загрузка которого дала
+запрос (например, Transaction.stage).
+
+Исключения: NPLUSONE_ALLOWLIST в настройках (подстроки формы запроса,
+атрибута или места вызова) и allow_nplusone(...) в коде.
+
+Пример теста:
+    @assert_no_nplusone()
+    def test_transactions_changelist(self):
+        self.client.get(reverse('admin:control_transaction_changelist'))
+"""
+import logging
+import os
+import sys
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from .db import wrap_connections
+from .profiling import fingerprint_sql
+from .slowlog import _project_frames
+
+
+logger = logging.getLogger('control.nplusone')
+
+_current_scope = ContextVar('control_nplusone_scope', default=None)
+_current_access = ContextVar('control_nplusone_access', default=None)
+_allowed = ContextVar('control_nplusone_allowed', default=())
+
+# allow_nplusone() без аргументов: не считать запросы вовсе
+ALLOW_ALL = '*'
+
+
+def _origin_frame():
+    """Ближайший кадр вне ORM - место вызова, если в стеке нет кода проекта"""
+    db_dir = os.path.join('django', 'db', '')
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if db_dir not in filename and not filename.endswith(('nplusone.py', 'contextlib.py')):
+            name = getattr(frame.f_code, 'co_qualname', frame.f_code.co_name)
+            return f'{filename}:{frame.f_lineno} {name}'
+        frame = frame.f_back
+    return None
+
+
+class NPlusOneError(AssertionError):
+    """Найдены повторяющиеся формы запросов (режим raise)"""
+
+
+def get_mode():
+    mode = getattr(settings, 'NPLUSONE_MODE', 'off')
+    return mode if mode in ('log', 'raise') else 'off'
+
+
+class NPlusOneScope:
+    """Счетчик форм запросов одного HTTP-запроса или теста"""
+
+    def __init__(self, threshold, mode, allow=(), label=''):
+        self.threshold = threshold
+        self.mode = mode
+        self.allow = tuple(allow) + tuple(getattr(settings, 'NPLUSONE_ALLOWLIST', ()))
+        self.label = label
+        self.counts = Counter()
+        self.attributes = {}
+        self.findings = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        """execute_wrapper: учет формы каждого запроса"""
+        result = execute(sql, params, many, context)
+        allowed = _allowed.get()
+        if many or ALLOW_ALL in allowed:
+            return result
+        shape = fingerprint_sql(sql)
+        self.counts[shape] += 1
+        attribute = _current_access.get()
+        if attribute:
+            self.attributes.setdefault(shape, Counter())[attribute] += 1
+        if self.counts[shape] == self.threshold + 1 and shape not in self.findings:
+            stack = _project_frames()
+            finding = {
+                'shape': shape,
+                'call_site': stack[0] if stack else _origin_frame(),
+                'stack': stack,
+            }
+            patterns = self.allow + tuple(allowed)
+            # Ближайший кадр вне ORM - для исключений на код Django (AutocompleteMixin.optgroups)
+            texts = [shape, attribute or '', finding['call_site'] or '', _origin_frame() or ''] + stack
+            if not any(pattern in text for pattern in patterns for text in texts):
+                self.findings[shape] = finding
+        return result
+
+    def report(self):
+        """Находки с итоговым числом повторов и атрибутами ленивой загрузки"""
+        result = []
+        for shape, finding in self.findings.items():
+            attributes = self.attributes.get(shape)
+            attribute = attributes.most_common(1)[0][0] if attributes else None
+            if attribute and any(pattern in attribute for pattern in self.allow):
+                continue
+            result.append(dict(finding, count=self.counts[shape], attribute=attribute))
+        return sorted(result, key=lambda item: -item['count'])
+
+    def format_report(self, findings):
+        lines = [f'N+1 запросы{f" ({self.label})" if self.label else ""}:']
+        for finding in findings:
+            lines.append(f'  {finding["count"]} x {finding["shape"][:300]}')
+            if finding['attribute']:
+                lines.append(f'    ленивая загрузка: {finding["attribute"]}')
+            if finding['call_site']:
+                lines.append(f'    место вызова: {finding["call_site"]}')
+        return '\n'.join(lines)
+
+
+@contextmanager
+def detect_nplusone(threshold=None, mode=None, allow=(), label=''):
+    """
+    Область подсчета запросов. Вложенная область присоединяется к внешней
+    (например, middleware внутри assert_no_nplusone), отчет делает внешняя.
+    """
+    outer = _current_scope.get()
+    if outer is not None:
+        yield outer
+        return
+    install_lazy_load_tracking()
+    scope = NPlusOneScope(
+        threshold if threshold is not None else settings.NPLUSONE_THRESHOLD,
+        mode or get_mode(), allow, label,
+    )
+    token = _current_scope.set(scope)
+    try:
+        with ExitStack() as stack:
+            wrap_connections(stack, scope)
+            yield scope
+    finally:
+        _current_scope.reset(token)
+    findings = scope.report()
+    if not findings:
+        return
+    message = scope.format_report(findings)
+    if scope.mode == 'raise':
+        raise NPlusOneError(message)
+    logger.warning(message)
+
+
+@asynccontextmanager
+async def adetect_nplusone(threshold=None, mode=None, allow=(), label=''):
+    """detect_nplusone для async-кода: запросы считаются и в потоке синхронной части запроса"""
+    outer = _current_scope.get()
+    with detect_nplusone(threshold, mode, allow, label) as scope, ExitStack() as stack:
+        if outer is None:
+            await sync_to_async(wrap_connections)(stack, scope)
+        yield scope
+
+
+class allow_nplusone(ContextDecorator):
+    """
+    Разрешить повторы внутри блока или функции. С аргументами - только
+    для форм запросов, атрибутов и мест вызова, содержащих подстроки;
+    без аргументов - запросы внутри блока не учитываются.
+    """
+
+    def __init__(self, *patterns):
+        self.patterns = patterns or (ALLOW_ALL,)
+        self._tokens = []
+
+    def __enter__(self):
+        self._tokens.append(_allowed.set(_allowed.get() + self.patterns))
+        return self
+
+    def __exit__(self, *exc_info):
+        _allowed.reset(self._tokens.pop())
+        return False
+
+
+class assert_no_nplusone(ContextDecorator):
+    """
+    Для тестов: блок или тест падает с NPlusOneError, если форма запроса
+    повторилась больше threshold раз (по умолчанию NPLUSONE_THRESHOLD).
+    Работает независимо от NPLUSONE_MODE.
+    """
+
+    def __init__(self, threshold=None, allow=()):
+        self.threshold = threshold
+        self.allow = allow
+        self._contexts = []
+
+    def __enter__(self):
+        context = detect_nplusone(self.threshold, 'raise', self.allow, label='тест')
+        self._contexts.append(context)
+        return context.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self._contexts.pop().__exit__(*exc_info)
+
+
+def _tracked(original, describe):
+    """Обертка метода дескриптора: запоминает атрибут, загрузка которого идет сейчас"""
+    def wrapper(self, instance, *args, **kwargs):
+        if instance is None or _current_scope.get() is None:
+            return original(self, instance, *args, **kwargs)
+        token = _current_access.set(describe(self, instance))
+        try:
+            return original(self, instance, *args, **kwargs)
+        finally:
+            _current_access.reset(token)
+    wrapper._control_nplusone = True
+    return wrapper
+
+
+def install_lazy_load_tracking():
+    """
+    Оборачивает ленивые загрузки Django: ForeignKey/OneToOne (прямая
+    и обратная сторона) и отложенные поля (defer/only). Вне области
+    подсчета обертки сразу вызывают исходные методы.
+    """
+    from django.db.models.fields.related_descriptors import (
+        ForwardManyToOneDescriptor, ReverseOneToOneDescriptor,
+    )
+    from django.db.models.query_utils import DeferredAttribute
+
+    if getattr(ForwardManyToOneDescriptor.get_object, '_control_nplusone', False):
+        return
+    # get_object вызывается только при промахе кэша связи - это и есть ленивая загрузка
+    ForwardManyToOneDescriptor.get_object = _tracked(
+        ForwardManyToOneDescriptor.get_object,
+        lambda descriptor, instance: f'{type(instance).__name__}.{descriptor.field.name}',
+    )
+    ReverseOneToOneDescriptor.__get__ = _tracked(
+        ReverseOneToOneDescriptor.__get__,
+        lambda descriptor, instance: f'{type(instance).__name__}.{descriptor.related.get_accessor_name()}',
+    )
+    # Дескриптор без __set__: вызывается, только если значения нет в __dict__ экземпляра
+    DeferredAttribute.__get__ = _tracked(
+        DeferredAttribute.__get__,
+        lambda descriptor, instance: f'{type(instance).__name__}.{descriptor.field.attname}',
+    )
+
+
+class NPlusOneMiddleware:
+    """Поиск N+1 в каждом запросе при NPLUSONE_MODE = log или raise; работает и под ASGI"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if get_mode() == 'off' and _current_scope.get() is None:
+            return self.get_response(request)
+        with detect_nplusone(label=f'{request.method} {request.path}'):
+            response = self.get_response(request)
+            # Отложенный рендер TemplateResponse тоже дает запросы
+            if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                response.render()
+        return response
+
+    async def __acall__(self, request):
+        if get_mode() == 'off' and _current_scope.get() is None:
+            return await self.get_response(request)
+        async with adetect_nplusone(label=f'{request.method} {request.path}'):
+            response = await self.get_response(request)
+            if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                await sync_to_async(response.render)()
+        return response
@@ -0,0 +1,218 @@
+"""
+Закрытие периодов и остатки на дату.
+
+close_period считает остатки нарастающим итогом на конец месяца или
+квартала одним группирующим запросом: остатки предыдущего закрытого
+периода + транзакции только нового периода (вместе с архивом).
+Строки хранятся в PeriodBalance в разрезе этапа, категории, контрагента
+и типа операции, проект и объект берутся через этап.
+
+balances_as_of(дата) начинает с последнего закрытого периода до этой
+даты и дочитывает только транзакции открытого периода, а не всю историю.
+
+Транзакции с датой по последний закрытый период включительно не
+создаются, не меняются и не удаляются (Transaction.save/delete/clean),
+в том числе каскадом при удалении этапа, сметы или пункта сметы
+(CASCADE_OPEN_PERIODS и SET_NULL_OPEN_PERIODS в models.py).
+Команда: close_period.
+"""
+import calendar
+import datetime
+import re
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cache import cached
+from .db import immediate_atomic
+from .models import ClosedPeriod, LedgerTransaction, PeriodBalance
+from .utils import EXPENSE_TYPES
+
+
+# Разрезы отчета: имя -> (путь в PeriodBalance, выражение для транзакции)
+DIMENSIONS = {
+    'project': ('stage__object__project', Coalesce(
+        'stage__object__project', 'estimate__stage__object__project',
+        'estimate_item__estimate__stage__object__project',
+    )),
+    'object': ('stage__object', Coalesce('stage__object', 'estimate__stage__object', 'estimate_item__estimate__stage__object')),
+    'stage': ('stage', Coalesce('stage', 'estimate__stage', 'estimate_item__estimate__stage')),
+    'category': ('category', F('category')),
+    'contractor': ('contractor', F('contractor')),
+}
+
+# Ключ строки PeriodBalance
+BALANCE_KEY = ('stage', 'category', 'contractor', 'transaction_type')
+
+_PERIOD_RE = re.compile(r'^(\d{4})-(?:(\d{2})|[QqКк](\d))$')
+
+
+class PeriodClosedError(ValidationError):
+    """Изменение транзакции закрытого периода"""
+
+
+def parse_period(value):
+    """'2025-09' - месяц, '2025-Q3' - квартал. Возвращает (тип, начало, конец)"""
+    match = _PERIOD_RE.match(value.strip())
+    if not match:
+        raise ValueError(f'Период {value!r}: ожидается ГГГГ-ММ или ГГГГ-QN')
+    year = int(match.group(1))
+    if match.group(2):
+        period_type, first_month, last_month = 'month', int(match.group(2)), int(match.group(2))
+    else:
+        quarter = int(match.group(3))
+        period_type, first_month, last_month = 'quarter', quarter * 3 - 2, quarter * 3
+    if not 1 <= first_month <= last_month <= 12:
+        raise ValueError(f'Период {value!r}: неверный месяц или квартал')
+    return (
+        period_type,
+        datetime.date(year, first_month, 1),
+        datetime.date(year, last_month, calendar.monthrange(year, last_month)[1]),
+    )
+
+
+def closed_until():
+    """Конец последнего закрытого периода (None, если закрытых нет)"""
+    return cached(
+        'closed_until', (), ('control.ClosedPeriod',),
+        lambda: ClosedPeriod.objects.order_by('-date_to').values_list('date_to', flat=True).first(),
+    )
+
+
+def check_period_open(transaction):
+    """PeriodClosedError, если транзакция была или станет транзакцией закрытого периода"""
+    until = closed_until()
+    if until is None:
+        return
+    dates = [transaction._meta.get_field('date').to_python(transaction.date)]
+    if transaction.pk is not None:
+        dates.append(type(transaction)._base_manager.filter(pk=transaction.pk).values_list('date', flat=True).first())
+    if any(value is not None and value <= until for value in dates):
+        raise PeriodClosedError(f'Период по {until:%d.%m.%Y} закрыт: транзакции этих дат не меняются')
+
+
+def _money(value):
+    # SQLite теряет масштаб DecimalField в SUM - возвращаем копейки явно
+    return (value or Decimal('0')).quantize(Decimal('0.01'))
+
+
+def _transaction_totals(date_from, date_to, dimensions, filters=None):
+    """Число и суммы транзакций (с архивом) за даты (date_from, date_to] в разрезах dimensions"""
+    qs = LedgerTransaction.objects.filter(date__lte=date_to)
+    if date_from is not None:
+        qs = qs.filter(date__gt=date_from)
+    filters = filters or {}
+    names = set(dimensions) | set(filters)
+    annotations = {f'_{name}': DIMENSIONS[name][1] for name in names if name != 'transaction_type'}
+    keys = [f'_{name}' if name != 'transaction_type' else name for name in dimensions]
+    qs = qs.order_by().annotate(**annotations).filter(**{f'_{name}': value for name, value in filters.items()})
+    rows = qs.values(*keys).annotate(count=Count('id'), amount=Sum('amount'))
+    return {tuple(row[key] for key in keys): (row['count'], _money(row['amount'])) for row in rows}
+
+
+def _balance_totals(period, dimensions, filters=None):
+    """То же по сохраненным остаткам периода"""
+    keys = [DIMENSIONS[name][0] if name != 'transaction_type' else name for name in dimensions]
+    rows = (
+        PeriodBalance.objects.filter(period=period)
+        .filter(**{DIMENSIONS[name][0]: value for name, value in (filters or {}).items()}).order_by()
+        .values(*keys).annotate(count=Sum('count'), amount=Sum('amount'))
+    )
+    return {tuple(row[key] for key in keys): (row['count'], _money(row['amount'])) for row in rows}
+
+
+def _merge(*parts):
+    result = {}
+    for part in parts:
+        for key, (count, amount) in part.items():
+            old_count, old_amount = result.get(key, (0, Decimal('0')))
+            result[key] = (old_count + count, old_amount + amount)
+    return result
+
+
+def close_period(period, user=None):
+    """
+    Закрыть период ('2025-09' или '2025-Q3'): остатки на его конец =
+    остатки предыдущего закрытого периода + транзакции после него.
+    Возвращает ClosedPeriod.
+    """
+    period_type, first_day, date_to = parse_period(period)
+    if date_to >= timezone.localdate():
+        raise ValueError(f'Период {period} еще не закончился')
+    with immediate_atomic():
+        previous = ClosedPeriod.objects.order_by('-date_to').first()
+        if previous is not None and previous.date_to >= date_to:
+            raise ValueError(f'Период по {previous.date_to:%d.%m.%Y} уже закрыт')
+        date_from = previous.date_to + datetime.timedelta(days=1) if previous is not None else None
+        if date_from is not None and date_from > first_day:
+            raise ValueError(f'Период {period} пересекается с закрытым периодом по {previous.date_to:%d.%m.%Y}')
+        added = _transaction_totals(previous.date_to if previous else None, date_to, BALANCE_KEY)
+        totals = _merge(_balance_totals(previous, BALANCE_KEY) if previous else {}, added)
+        closed = ClosedPeriod.objects.create(
+            period_type=period_type, date_from=date_from, date_to=date_to,
+            transactions_count=sum(count for count, _amount in added.values()),
+            closed_by=user if user is not None and user.is_authenticated else None,
+        )
+        PeriodBalance.objects.bulk_create([
+            PeriodBalance(
+                period=closed, stage_id=stage_id, category_id=category_id, contractor_id=contractor_id,
+                transaction_type=transaction_type, count=count, amount=amount,
+            )
+            for (stage_id, category_id, contractor_id, transaction_type), (count, amount) in totals.items()
+        ], batch_size=1000)
+    return closed
+
+
+def verify_period(period):
+    """
+    Сверка сохраненных остатков периода с полным пересчетом по всем
+    транзакциям до его конца. Возвращает расхождения {ключ: (сохранено, пересчет)}.
+    """
+    stored = _balance_totals(period, BALANCE_KEY)
+    full = _transaction_totals(None, period.date_to, BALANCE_KEY)
+    return {
+        key: (stored.get(key), full.get(key))
+        for key in stored.keys() | full.keys()
+        if stored.get(key) != full.get(key)
+    }
+
+
+def reopen_last_period():
+    """Открыть последний закрытый период (удалить его остатки). Возвращает его или None"""
+    with immediate_atomic():
+        last = ClosedPeriod.objects.order_by('-date_to').first()
+        if last is not None:
+            last.delete()
+    return last
+
+
+def balances_as_of(as_of, dimensions=('project',), filters=None):
+    """
+    Остатки на дату as_of включительно в разрезах dimensions (имена из
+    DIMENSIONS и 'transaction_type'): список словарей с ключами разрезов,
+    count, income, expense и balance. filters - отбор по разрезам,
+    например {'contractor': 5}. Второй элемент - закрытый период,
+    от которого начат расчет (None - расчет по всей истории).
+    """
+    by_type = 'transaction_type' in dimensions
+    # Тип операции нужен всегда - по нему доход отделяется от расхода
+    keys = tuple(name for name in dimensions if name != 'transaction_type') + ('transaction_type',)
+    period = ClosedPeriod.objects.filter(date_to__lte=as_of).order_by('-date_to').first()
+    totals = _merge(
+        _balance_totals(period, keys, filters) if period else {},
+        _transaction_totals(period.date_to if period else None, as_of, keys, filters),
+    )
+    rows = {}
+    for key, (count, amount) in totals.items():
+        group = key if by_type else key[:-1]
+        row = rows.get(group)
+        if row is None:
+            row = rows[group] = dict(zip(keys, group), count=0, income=Decimal('0'), expense=Decimal('0'))
+        row['count'] += count
+        row['expense' if key[-1] in EXPENSE_TYPES else 'income'] += amount
+    for row in rows.values():
+        row['balance'] = row['income'] - row['expense']
+    return list(rows.values()), period
@@ -0,0 +1,225 @@
+"""
+Профилирование запросов в продакшене без DEBUG: число и время SQL,
+самые медленные запросы, повторяющиеся формы запросов, время рендера
+шаблонов и представления. Итоги пишутся в заголовок Server-Timing,
+последние профили хранятся в кольцевом буфере процесса и доступны
+сотрудникам на странице admin/diagnostics/profiles/.
+
+Включается долей сэмплирования PROFILER_SAMPLE_RATE (0 - выключено,
+1 - каждый запрос); при выключенном сэмплировании middleware сразу
+передает запрос дальше.
+"""
+import heapq
+import itertools
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .db import wrap_connections
+
+
+_current_profile = ContextVar('control_request_profile', default=None)
+
+_buffer_lock = threading.Lock()
+_buffer = deque(maxlen=getattr(settings, 'PROFILER_BUFFER_SIZE', 100))
+_ids = itertools.count(1)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST_RE = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def fingerprint_sql(sql):
+    """
+    Форма запроса: литералы и параметры заменены на ?, списки IN свернуты.
+    Запросы, отличающиеся только значениями, получают одинаковую форму.
+    """
+    shape = _STRING_RE.sub('?', sql)
+    shape = _NUMBER_RE.sub('?', shape)
+    shape = shape.replace('%s', '?')
+    shape = _PLACEHOLDER_LIST_RE.sub('(...)', shape)
+    return _SPACES_RE.sub(' ', shape).strip()
+
+
+class RequestProfile:
+    """Накопитель метрик одного запроса"""
+
+    def __init__(self, slowest_count):
+        self.slowest_count = slowest_count
+        self.query_count = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.slowest = []  # куча (время, порядковый номер, sql)
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        """execute_wrapper: замер каждого SQL-запроса"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.query_count += 1
+            self.db_time += duration
+            self.shapes[fingerprint_sql(sql)] += 1
+            entry = (duration, self.query_count, sql)
+            if len(self.slowest) < self.slowest_count:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def duplicates(self):
+        return [(count, shape) for shape, count in self.shapes.most_common() if count > 1]
+
+
+def install_template_timer():
+    """
+    Оборачивает рендер шаблонов Django, чтобы учитывать его время в профиле.
+    Вне профилируемого запроса обертка сразу вызывает исходный метод.
+    """
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, '_control_profiled', False):
+        return
+    original = Template.render
+
+    def render(self, context=None, request=None):
+        profile = _current_profile.get()
+        if profile is None:
+            return original(self, context, request)
+        # Учитываем только внешний рендер, вложенные include уже входят в него
+        profile.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            profile.template_depth -= 1
+            if profile.template_depth == 0:
+                profile.template_time += time.perf_counter() - start
+
+    render._control_profiled = True
+    Template.render = render
+
+
+def _sampled():
+    rate = settings.PROFILER_SAMPLE_RATE
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+class ProfilerMiddleware:
+    """Сэмплирующий профилировщик запросов (см. описание модуля); работает и под ASGI"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not _sampled():
+            return self.get_response(request)
+
+        profile = RequestProfile(settings.PROFILER_SLOWEST_QUERIES)
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                wrap_connections(stack, profile)
+                response = self.get_response(request)
+                view_time = time.perf_counter() - start
+                # Отложенный рендер TemplateResponse тоже входит в профиль
+                if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                    response.render()
+        finally:
+            _current_profile.reset(token)
+        return self._finish(request, response, profile, start, view_time)
+
+    async def __acall__(self, request):
+        if not _sampled():
+            return await self.get_response(request)
+
+        profile = RequestProfile(settings.PROFILER_SLOWEST_QUERIES)
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                await sync_to_async(wrap_connections)(stack, profile)
+                response = await self.get_response(request)
+                view_time = time.perf_counter() - start
+                if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                    await sync_to_async(response.render)()
+        finally:
+            _current_profile.reset(token)
+        # request.user - ленивый объект, его загрузка обращается к БД
+        return await sync_to_async(self._finish)(request, response, profile, start, view_time)
+
+    def _finish(self, request, response, profile, start, view_time):
+        total_time = time.perf_counter() - start
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={profile.db_time * 1000:.1f};desc="SQL x{profile.query_count}"',
+            f'tpl;dur={profile.template_time * 1000:.1f}',
+            f'view;dur={view_time * 1000:.1f}',
+            f'total;dur={total_time * 1000:.1f}',
+        ])
+        record_profile(request, response, profile, view_time, total_time)
+        return response
+
+
+def record_profile(request, response, profile, view_time, total_time):
+    """Сохранить профиль в кольцевой буфер процесса"""
+    match = getattr(request, 'resolver_match', None)
+    user = getattr(request, 'user', None)
+    entry = {
+        'id': next(_ids),
+        'timestamp': timezone.now(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'url_name': match.view_name if match else '',
+        'status': response.status_code,
+        'user': str(user) if user is not None and user.is_authenticated else '',
+        'total_ms': round(total_time * 1000, 1),
+        'view_ms': round(view_time * 1000, 1),
+        'db_ms': round(profile.db_time * 1000, 1),
+        'template_ms': round(profile.template_time * 1000, 1),
+        'query_count': profile.query_count,
+        'slowest': [
+            {'ms': round(duration * 1000, 2), 'sql': sql}
+            for duration, _order, sql in sorted(profile.slowest, reverse=True)
+        ],
+        'duplicates': [{'count': count, 'shape': shape} for count, shape in profile.duplicates()],
+    }
+    with _buffer_lock:
+        _buffer.append(entry)
+    return entry
+
+
+def get_profiles():
+    """Профили из буфера, новые первыми"""
+    with _buffer_lock:
+        return list(reversed(_buffer))
+
+
+def get_profile(profile_id):
+    with _buffer_lock:
+        for entry in _buffer:
+            if entry['id'] == profile_id:
+                return entry
+    return None
+
+
+def clear_profiles():
+    with _buffer_lock:
+        _buffer.clear()
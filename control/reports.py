@@ -0,0 +1,351 @@
+"""
+Отчеты по проектам.
+
+План-факт (profit_and_loss): план по сметам против факта по транзакциям
+на каждом уровне иерархии (проект, объект, этап). План - суммы позиций
+смет этапа: выручка по ценам заказчика, затраты по ценам исполнителя.
+Факт - доходы и расходы транзакций этапа (с архивом; этап берется из
+транзакции, ее сметы или пункта сметы). Отчет строится фиксированным
+числом запросов: три запроса иерархии и по одному группирующему запросу
+на план и факт; объекты и проекты суммируются в Python.
+
+Денежный поток (cash_flow): поступления и выбытия по категориям и месяцам.
+БД группирует по месяцу (TruncMonth) и категории, сводная таблица,
+нарастающие итоги, изменения к прошлому месяцу и скользящее среднее
+считаются массивами NumPy в копейках (int64), без вложенных словарей.
+
+Оба отчета кэшируются до изменения данных, от которых зависят.
+"""
+import calendar
+import csv
+import datetime
+import io
+from decimal import Decimal
+
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncMonth
+
+from .cache import cached
+from .models import Category, Estimate, EstimateItem, LedgerTransaction, Object, Project, Stage
+from .periods import DIMENSIONS
+from .utils import EXPENSE_TYPES
+
+
+# Модели, от которых зависит отчет
+PNL_DEPENDENCIES = (
+    'control.Project', 'control.Object', 'control.Stage', 'control.Estimate', 'control.EstimateItem',
+    'control.Transaction', 'control.ArchivedTransaction',
+)
+
+# Суммы строки отчета
+PNL_AMOUNTS = ('plan_revenue', 'plan_cost', 'actual_revenue', 'actual_cost')
+
+PNL_COLUMNS = [
+    'Уровень', 'Название', 'План: выручка', 'План: затраты', 'План: маржа',
+    'Факт: доходы', 'Факт: расходы', 'Факт: маржа', 'Отклонение выручки', 'Отклонение затрат',
+    'Отклонение маржи', 'Маржа, %',
+]
+
+LEVEL_LABELS = {'project': 'Проект', 'object': 'Объект', 'stage': 'Этап', 'unassigned': '', 'total': ''}
+
+def _money(value):
+    # SQLite теряет масштаб DecimalField в SUM - возвращаем копейки явно
+    return (value or Decimal('0')).quantize(Decimal('0.01'))
+
+
+def _empty_amounts():
+    return {key: Decimal('0.00') for key in PNL_AMOUNTS}
+
+
+def _finish(row):
+    """Маржа, отклонения (факт минус план) и маржинальность строки"""
+    row['plan_margin'] = row['plan_revenue'] - row['plan_cost']
+    row['actual_margin'] = row['actual_revenue'] - row['actual_cost']
+    row['revenue_variance'] = row['actual_revenue'] - row['plan_revenue']
+    row['cost_variance'] = row['actual_cost'] - row['plan_cost']
+    row['margin_variance'] = row['actual_margin'] - row['plan_margin']
+    row['margin_percent'] = (
+        (row['actual_margin'] * 100 / row['actual_revenue']).quantize(Decimal('0.1'))
+        if row['actual_revenue'] else None
+    )
+    return row
+
+
+def _plan_by_stage(project_id, approved_only):
+    """{stage_id: (выручка, затраты)} по позициям смет одним запросом"""
+    qs = EstimateItem.objects.all()
+    if project_id is not None:
+        qs = qs.filter(estimate__stage__object__project_id=project_id)
+    if approved_only:
+        qs = qs.filter(estimate__status__in=Estimate.APPROVED_STATUSES)
+    rows = (
+        qs.order_by().values('estimate__stage_id')
+        .annotate(revenue=Sum('client_price'), cost=Sum('contractor_price'))
+    )
+    return {row['estimate__stage_id']: (_money(row['revenue']), _money(row['cost'])) for row in rows}
+
+
+def _actual_by_stage(project_id):
+    """{stage_id или None: (доходы, расходы)} по транзакциям с архивом одним запросом"""
+    qs = LedgerTransaction.objects.order_by().annotate(_stage=DIMENSIONS['stage'][1])
+    if project_id is not None:
+        qs = qs.annotate(_project=DIMENSIONS['project'][1]).filter(_project=project_id)
+    rows = qs.values('_stage').annotate(
+        revenue=Sum('amount', filter=Q(transaction_type='income')),
+        cost=Sum('amount', filter=Q(transaction_type='expense')),
+    )
+    return {row['_stage']: (_money(row['revenue']), _money(row['cost'])) for row in rows}
+
+
+def _compute_profit_and_loss(project_id, approved_only):
+    projects = Project._default_manager.order_by('name')
+    objects = Object.objects.order_by('name')
+    stages = Stage.objects.order_by('order', 'name')
+    if project_id is not None:
+        projects = projects.filter(pk=project_id)
+        objects = objects.filter(project_id=project_id)
+        stages = stages.filter(object__project_id=project_id)
+    plan = _plan_by_stage(project_id, approved_only)
+    actual = _actual_by_stage(project_id)
+
+    stages_by_object = {}
+    for stage in stages.values('id', 'name', 'order', 'object_id'):
+        revenue, cost = plan.get(stage['id'], (Decimal('0.00'), Decimal('0.00')))
+        actual_revenue, actual_cost = actual.get(stage['id'], (Decimal('0.00'), Decimal('0.00')))
+        stages_by_object.setdefault(stage['object_id'], []).append(_finish({
+            'level': 'stage', 'id': stage['id'], 'name': stage['name'],
+            'plan_revenue': revenue, 'plan_cost': cost, 'actual_revenue': actual_revenue, 'actual_cost': actual_cost,
+        }))
+    objects_by_project = {}
+    for obj in objects.values('id', 'name', 'project_id'):
+        objects_by_project.setdefault(obj['project_id'], []).append(obj)
+
+    rows = []
+    total = {'level': 'total', 'id': None, 'name': 'Итого', **_empty_amounts()}
+    for project in projects.values('id', 'name'):
+        project_row = {'level': 'project', 'id': project['id'], 'name': project['name'], **_empty_amounts()}
+        rows.append(project_row)
+        for obj in objects_by_project.get(project['id'], []):
+            object_row = {'level': 'object', 'id': obj['id'], 'name': obj['name'], **_empty_amounts()}
+            rows.append(object_row)
+            for stage_row in stages_by_object.get(obj['id'], []):
+                rows.append(stage_row)
+                for key in PNL_AMOUNTS:
+                    object_row[key] += stage_row[key]
+            _finish(object_row)
+            for key in PNL_AMOUNTS:
+                project_row[key] += object_row[key]
+        _finish(project_row)
+        for key in PNL_AMOUNTS:
+            total[key] += project_row[key]
+    unassigned = None
+    if project_id is None and None in actual:
+        # Транзакции без этапа, сметы и пункта сметы: только факт
+        revenue, cost = actual[None]
+        unassigned = _finish({
+            'level': 'unassigned', 'id': None, 'name': 'Без этапа', **_empty_amounts(),
+            'actual_revenue': revenue, 'actual_cost': cost,
+        })
+        total['actual_revenue'] += revenue
+        total['actual_cost'] += cost
+    return {'rows': rows, 'unassigned': unassigned, 'total': _finish(total)}
+
+
+def profit_and_loss(project_id=None, approved_only=False):
+    """
+    План и факт по всем проектам (или одному project_id): словарь rows
+    (проект, его объекты и этапы подряд; level - уровень строки),
+    unassigned (факт без этапа) и total. approved_only - план только
+    по утвержденным и выполненным сметам.
+    """
+    return cached(
+        'profit_and_loss', (project_id, approved_only), PNL_DEPENDENCIES,
+        lambda: _compute_profit_and_loss(project_id, approved_only),
+    )
+
+
+def _export_rows(report):
+    rows = list(report['rows'])
+    if report['unassigned']:
+        rows.append(report['unassigned'])
+    rows.append(report['total'])
+    for row in rows:
+        yield [
+            LEVEL_LABELS[row['level']], row['name'],
+            row['plan_revenue'], row['plan_cost'], row['plan_margin'],
+            row['actual_revenue'], row['actual_cost'], row['actual_margin'],
+            row['revenue_variance'], row['cost_variance'], row['margin_variance'],
+            row['margin_percent'] if row['margin_percent'] is not None else '',
+        ]
+
+
+def render_pnl_csv(report):
+    """CSV отчета (UTF-8 с BOM и ';' - открывается в Excel)"""
+    output = io.StringIO()
+    output.write('\ufeff')
+    writer = csv.writer(output, delimiter=';')
+    writer.writerow(PNL_COLUMNS)
+    writer.writerows(_export_rows(report))
+    return output.getvalue().encode('utf-8')
+
+
+def render_pnl_xlsx(report):
+    """XLSX отчета (bytes)"""
+    import xlsxwriter
+
+    output = io.BytesIO()
+    wb = xlsxwriter.Workbook(output, {'in_memory': True})
+    ws = wb.add_worksheet('План-факт')
+    money = wb.add_format({'num_format': '#,##0.00'})
+    bold_money = wb.add_format({'num_format': '#,##0.00', 'bold': True})
+    ws.write_row(0, 0, PNL_COLUMNS)
+    for index, values in enumerate(_export_rows(report), start=1):
+        # Проекты и итог - жирным
+        number_format = bold_money if values[0] in ('Проект', '') else money
+        ws.write(index, 0, values[0])
+        ws.write(index, 1, values[1])
+        for column, value in enumerate(values[2:], start=2):
+            if value == '':
+                continue
+            ws.write_number(index, column, float(value), number_format)
+    ws.set_column(1, 1, 40)
+    ws.set_column(2, len(PNL_COLUMNS) - 1, 16)
+    wb.close()
+    return output.getvalue()
+
+
+# Показатели денежного потока по категориям
+CASH_FLOW_MEASURES = {
+    'net': 'Сальдо',
+    'income': 'Поступления',
+    'expense': 'Выбытия',
+    'cumulative': 'Нарастающий итог',
+}
+
+CASH_FLOW_DEPENDENCIES = (
+    'control.Category', 'control.Transaction', 'control.ArchivedTransaction',
+    'control.EstimateItem', 'control.Estimate', 'control.Stage', 'control.Object',
+)
+
+# Окно скользящего среднего сальдо, месяцев
+MOVING_AVERAGE_MONTHS = 3
+
+
+def month_range(first_month, last_month):
+    """Первые числа всех месяцев от first_month до last_month включительно"""
+    months = []
+    year, month = first_month.year, first_month.month
+    while (year, month) <= (last_month.year, last_month.month):
+        months.append(datetime.date(year, month, 1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def _cash_flow_rows(months, project_id):
+    """(категория, месяц, поступления, выбытия) одним группирующим запросом"""
+    last_day = months[-1].replace(day=calendar.monthrange(months[-1].year, months[-1].month)[1])
+    qs = LedgerTransaction.objects.filter(date__gte=months[0], date__lte=last_day).order_by()
+    if project_id is not None:
+        qs = qs.annotate(_project=DIMENSIONS['project'][1]).filter(_project=project_id)
+    return (
+        qs.annotate(month=TruncMonth('date'))
+        .values_list('category_id', 'month')
+        .annotate(
+            income=Sum('amount', filter=~Q(transaction_type__in=EXPENSE_TYPES)),
+            expense=Sum('amount', filter=Q(transaction_type__in=EXPENSE_TYPES)),
+        )
+    )
+
+
+def _to_money(values):
+    """Копейки (массив NumPy) -> список Decimal"""
+    return [Decimal(int(value)).scaleb(-2) for value in values]
+
+
+def _compute_cash_flow(first_month, last_month, project_id):
+    import numpy as np
+
+    months = month_range(first_month, last_month)
+    rows = list(_cash_flow_rows(months, project_id))
+    names = dict(Category.objects.filter(pk__in={row[0] for row in rows}).values_list('id', 'name'))
+    category_ids = sorted(names, key=lambda pk: names[pk])
+    category_index = {pk: index for index, pk in enumerate(category_ids)}
+    month_index = {month: index for index, month in enumerate(months)}
+
+    # Сводная таблица категории x месяцы в копейках
+    shape = (len(category_ids), len(months))
+    income, expense = np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=np.int64)
+    if rows:
+        categories, row_months, row_income, row_expense = zip(*rows)
+        rows_index = (
+            np.fromiter((category_index[pk] for pk in categories), dtype=np.intp, count=len(rows)),
+            np.fromiter((month_index[month] for month in row_months), dtype=np.intp, count=len(rows)),
+        )
+        income[rows_index] = np.fromiter((int(_money(v) * 100) for v in row_income), dtype=np.int64, count=len(rows))
+        expense[rows_index] = np.fromiter((int(_money(v) * 100) for v in row_expense), dtype=np.int64, count=len(rows))
+    net = income - expense
+    series = {'income': income, 'expense': expense, 'net': net, 'cumulative': np.cumsum(net, axis=1)}
+    # Итог строки: сумма за период, для нарастающего итога - последний месяц
+    row_totals = {key: values.sum(axis=1) for key, values in series.items()}
+    row_totals['cumulative'] = row_totals['net']
+
+    month_net = net.sum(axis=0)
+    window = MOVING_AVERAGE_MONTHS
+    running = np.concatenate(([0], np.cumsum(month_net)))
+    moving_average = np.rint((running[window:] - running[:-window]) / window).astype(np.int64)
+    return {
+        'months': months,
+        'categories': [
+            {
+                'id': pk, 'name': names[pk],
+                **{key: _to_money(values[index]) for key, values in series.items()},
+                'totals': {key: Decimal(int(values[index])).scaleb(-2) for key, values in row_totals.items()},
+            }
+            for index, pk in enumerate(category_ids)
+        ],
+        'totals': {
+            'income': _to_money(income.sum(axis=0)),
+            'expense': _to_money(expense.sum(axis=0)),
+            'net': _to_money(month_net),
+            'cumulative': _to_money(running[1:]),
+            'delta': [None] + _to_money(np.diff(month_net)),
+            'moving_average': [None] * min(window - 1, len(months)) + _to_money(moving_average),
+            'period': {key: Decimal(int(values.sum())).scaleb(-2) for key, values in series.items() if key != 'cumulative'},
+        },
+    }
+
+
+def cash_flow(first_month, last_month, project_id=None):
+    """
+    Денежный поток по категориям с first_month по last_month (первые
+    числа месяцев), с архивом, по всем проектам или одному project_id.
+    Словарь months, categories (id, name, ряды income/expense/net/cumulative
+    по месяцам и totals за период) и totals - итоги по месяцам: income,
+    expense, net, cumulative, delta (к прошлому месяцу), moving_average
+    и period (за весь период).
+    """
+    return cached(
+        'cash_flow', (first_month, last_month, project_id), CASH_FLOW_DEPENDENCIES,
+        lambda: _compute_cash_flow(first_month, last_month, project_id),
+    )
+
+
+def render_cash_flow_csv(report, measure='net'):
+    """CSV сводной таблицы по показателю measure с итоговыми строками (UTF-8 с BOM и ';')"""
+    output = io.StringIO()
+    output.write('\ufeff')
+    writer = csv.writer(output, delimiter=';')
+    writer.writerow(['Категория'] + [f'{month:%m.%Y}' for month in report['months']] + ['Итого'])
+    for category in report['categories']:
+        writer.writerow([category['name']] + category[measure] + [category['totals'][measure]])
+    totals = report['totals']
+    writer.writerow(['Итого поступления'] + totals['income'] + [totals['period']['income']])
+    writer.writerow(['Итого выбытия'] + totals['expense'] + [totals['period']['expense']])
+    writer.writerow(['Сальдо'] + totals['net'] + [totals['period']['net']])
+    writer.writerow(['Нарастающий итог'] + totals['cumulative'] + [''])
+    writer.writerow(['Изменение к прошлому месяцу'] + ['' if v is None else v for v in totals['delta']] + [''])
+    writer.writerow(
+        [f'Скользящее среднее ({MOVING_AVERAGE_MONTHS} мес.)']
+        + ['' if v is None else v for v in totals['moving_average']] + ['']
+    )
+    return output.getvalue().encode('utf-8')
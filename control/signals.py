@@ -0,0 +1,35 @@
+"""
+Подключение обработчиков сигналов моделей (импортируется в ControlConfig.ready)
+"""
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .cache import VERSIONED_MODELS, bump_version_on_change
+from .debts import remember_debt_values, update_debt_on_delete, update_debt_on_save
+from .snapshots import refresh_snapshot_on_estimate_save, refresh_snapshot_on_item_change
+
+
+# Версии моделей для поколенческого кэша
+for _label in VERSIONED_MODELS:
+    _model = apps.get_model(_label)
+    post_save.connect(bump_version_on_change, sender=_model, dispatch_uid=f'cache_version_save_{_label}')
+    post_delete.connect(bump_version_on_change, sender=_model, dispatch_uid=f'cache_version_delete_{_label}')
+
+# Позиции долгов контрагентов (control/debts.py)
+_transaction = apps.get_model('control.Transaction')
+pre_save.connect(remember_debt_values, sender=_transaction, dispatch_uid='debt_positions_pre_save')
+post_save.connect(update_debt_on_save, sender=_transaction, dispatch_uid='debt_positions_save')
+post_delete.connect(update_debt_on_delete, sender=_transaction, dispatch_uid='debt_positions_delete')
+# Архив тоже входит в позиции: удаление из архива (в том числе каскадом) вычитает вклад,
+# перенос между таблицами идет в debt_tracking_paused
+post_delete.connect(
+    update_debt_on_delete, sender=apps.get_model('control.ArchivedTransaction'),
+    dispatch_uid='debt_positions_archived_delete',
+)
+
+# Снимки утвержденных смет (control/snapshots.py)
+_estimate = apps.get_model('control.Estimate')
+post_save.connect(refresh_snapshot_on_estimate_save, sender=_estimate, dispatch_uid='estimate_snapshot_save')
+_estimate_item = apps.get_model('control.EstimateItem')
+post_save.connect(refresh_snapshot_on_item_change, sender=_estimate_item, dispatch_uid='estimate_snapshot_item_save')
+post_delete.connect(refresh_snapshot_on_item_change, sender=_estimate_item, dispatch_uid='estimate_snapshot_item_delete')
@@ -0,0 +1,138 @@
+"""
+Журнал медленных SQL-запросов.
+
+execute_wrapper на каждом соединении замеряет запросы и пишет в JSON lines
+(с ротацией) все, что дольше SLOW_QUERY_MS: параметры, место вызова в коде
+проекта (метод админки, функция utils) и план выполнения (EXPLAIN QUERY PLAN
+на SQLite, EXPLAIN на PostgreSQL) при первом появлении формы запроса.
+
+Сводка по формам запросов: python manage.py slow_queries_report
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .jsonlog import get_json_logger
+from .profiling import fingerprint_sql
+
+
+# Модули, которые сами не являются "местом вызова" запроса
+_INFRASTRUCTURE_FILES = ('slowlog.py', 'profiling.py', 'tracing.py', 'metrics.py', 'nplusone.py',
+                         'cache.py', 'db.py')
+
+# Сколько форм запросов помнить, чтобы не повторять EXPLAIN
+EXPLAINED_LIMIT = 5000
+
+_state = threading.local()
+_explained = set()
+_explained_lock = threading.Lock()
+
+
+def query_fingerprint(sql):
+    """Форма запроса и ее короткий хэш для группировки"""
+    shape = fingerprint_sql(sql)
+    return shape, hashlib.md5(shape.encode('utf-8')).hexdigest()[:12]
+
+
+def _project_frames(limit=8):
+    """Кадры стека из кода проекта (без Django, site-packages и служебных модулей)"""
+    base_dir = str(settings.BASE_DIR)
+    frames = []
+    frame = sys._getframe(1)
+    while frame is not None and len(frames) < limit:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(base_dir) and 'site-packages' not in filename
+                and not filename.endswith(_INFRASTRUCTURE_FILES)):
+            name = getattr(frame.f_code, 'co_qualname', frame.f_code.co_name)
+            frames.append(f'{os.path.relpath(filename, base_dir)}:{frame.f_lineno} {name}')
+        frame = frame.f_back
+    return frames
+
+
+def _explain(connection, sql, params):
+    """План запроса; выполняется только для SELECT и не ломает текущую транзакцию"""
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    prefix = connection.ops.explain_query_prefix()
+    try:
+        # Внутри atomic - через точку сохранения, чтобы ошибка EXPLAIN не прервала транзакцию
+        with transaction.atomic(using=connection.alias) if connection.in_atomic_block else nullcontext():
+            with connection.cursor() as cursor:
+                cursor.execute(f'{prefix} {sql}', params)
+                rows = cursor.fetchall()
+    except Exception as e:
+        return [f'EXPLAIN не выполнен: {e}']
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [' '.join(str(value) for value in row) for row in rows]
+
+
+def _first_occurrence(query_hash):
+    with _explained_lock:
+        if query_hash in _explained:
+            return False
+        if len(_explained) >= EXPLAINED_LIMIT:
+            _explained.clear()
+        _explained.add(query_hash)
+        return True
+
+
+def slow_query_wrapper(execute, sql, params, many, context):
+    """execute_wrapper: пишет в журнал запросы дольше SLOW_QUERY_MS"""
+    if getattr(_state, 'active', False):
+        # Запрос EXPLAIN из самого журнала
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        if duration_ms >= settings.SLOW_QUERY_MS:
+            _state.active = True
+            try:
+                log_slow_query(context['connection'], sql, params, many, duration_ms)
+            except Exception:
+                # Журнал не должен ломать сам запрос
+                pass
+            finally:
+                _state.active = False
+
+
+def log_slow_query(connection, sql, params, many, duration_ms):
+    shape, query_hash = query_fingerprint(sql)
+    stack = _project_frames()
+    entry = {
+        'ts': timezone.now().isoformat(),
+        'duration_ms': round(duration_ms, 2),
+        'database': connection.alias,
+        'vendor': connection.vendor,
+        'fingerprint': query_hash,
+        'shape': shape,
+        'sql': sql,
+        'params': f'{len(params)} наборов (executemany)' if many else params,
+        'call_site': stack[0] if stack else None,
+        'stack': stack,
+    }
+    if not many and settings.SLOW_QUERY_EXPLAIN and _first_occurrence(query_hash):
+        entry['explain'] = _explain(connection, sql, params)
+    logger = get_json_logger(
+        'control.slow_queries', settings.SLOW_QUERY_LOG,
+        settings.SLOW_QUERY_LOG_MAX_BYTES, settings.SLOW_QUERY_LOG_BACKUPS,
+    )
+    logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+def install_slow_query_log(sender, connection, **kwargs):
+    """Обработчик connection_created: подключает журнал к новому соединению"""
+    if settings.SLOW_QUERY_MS > 0 and slow_query_wrapper not in connection.execute_wrappers:
+        # В начало списка: execute_wrapper() снимает обертки с конца
+        connection.execute_wrappers.insert(0, slow_query_wrapper)
@@ -0,0 +1,195 @@
+"""
+Снимки утвержденных смет.
+
+При переходе сметы в статус approved/completed ее строки (рассчитанные
+суммы, названия и единицы прайса) и итоги по аудиториям сохраняются
+одним JSON в EstimateSnapshot, смета ссылается на него через
+current_snapshot. Экспорт, предпросмотр и мастер транзакций читают
+утвержденную смету из снимка: смета со снимком - один запрос
+(select_related), без позиций и прайса.
+
+Снимки не меняются. Правка позиций утвержденной сметы создает новую
+ревизию после коммита транзакции - одну на смету, сколько бы позиций
+ни сохранялось в транзакции. Если содержимое не изменилось, новая
+ревизия не создается.
+"""
+from decimal import Decimal
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max
+
+from .db import immediate_atomic
+from .models import Estimate, EstimateSnapshot
+
+
+# Порядок полей строки снимка (строки хранятся списками)
+SNAPSHOT_LINE_FIELDS = (
+    'id', 'name', 'unit', 'is_material', 'quantity', 'unit_price', 'base_price',
+    'income_type', 'income_value', 'is_percentage', 'income_amount', 'client_price', 'contractor_price',
+)
+
+_DECIMAL_FIELDS = {
+    'quantity', 'unit_price', 'base_price', 'income_value', 'income_amount', 'client_price', 'contractor_price',
+}
+
+# Итоги снимка -> поле строки (как ESTIMATE_TOTAL_FIELDS)
+SNAPSHOT_TOTALS = {
+    'client': 'client_price',
+    'contractor': 'contractor_price',
+    'income': 'income_amount',
+    'base': 'base_price',
+}
+
+
+def _money(value):
+    return Decimal(value or 0).quantize(Decimal('0.01'))
+
+
+class SnapshotLine:
+    """
+    Строка сметы для чтения: из снимка или из позиции (from_item).
+    Повторяет атрибуты и методы EstimateItem, которыми пользуются
+    экспорт, предпросмотр и мастер транзакций.
+    """
+    __slots__ = ('estimate_id',) + SNAPSHOT_LINE_FIELDS
+
+    def __init__(self, estimate_id, values):
+        self.estimate_id = estimate_id
+        for field, value in zip(SNAPSHOT_LINE_FIELDS, values):
+            setattr(self, field, Decimal(value) if field in _DECIMAL_FIELDS else value)
+
+    @classmethod
+    def from_item(cls, item):
+        """Строка из позиции с пересчитанными суммами"""
+        item._calculate_amounts()
+        price_item = item.price_item
+        return cls(item.estimate_id, [
+            item.id, item.get_item_name(), item.get_unit(), bool(price_item and price_item.material_id),
+            _money(item.quantity), _money(item.unit_price), _money(item.base_price),
+            item.income_type, _money(item.income_value), item.is_percentage, _money(item.income_amount),
+            _money(item.client_price), _money(item.contractor_price),
+        ])
+
+    def as_row(self):
+        """Список для JSON: десятичные - строками"""
+        return [
+            str(getattr(self, field)) if field in _DECIMAL_FIELDS else getattr(self, field)
+            for field in SNAPSHOT_LINE_FIELDS
+        ]
+
+    def get_item_name(self):
+        return self.name
+
+    def get_unit(self):
+        return self.unit
+
+    def get_income_display(self):
+        """Отображение дохода (как EstimateItem.get_income_display)"""
+        if not self.income_type or not self.income_value:
+            return '-'
+        if self.is_percentage:
+            return f"{self.income_value}%"
+        return f"{self.income_value} руб."
+
+
+def build_snapshot_data(estimate, items=None):
+    """Содержимое снимка по текущим позициям сметы: {'lines': [...], 'totals': {...}}"""
+    if items is None:
+        items = estimate.items.select_related('price_item').order_by('id')
+    lines = [SnapshotLine.from_item(item) for item in items]
+    return {
+        'lines': [line.as_row() for line in lines],
+        'totals': {
+            key: str(sum((getattr(line, field) for line in lines), Decimal('0.00')))
+            for key, field in SNAPSHOT_TOTALS.items()
+        },
+    }
+
+
+def snapshot_lines(snapshot):
+    return [SnapshotLine(snapshot.estimate_id, row) for row in snapshot.data['lines']]
+
+
+def snapshot_totals(snapshot):
+    return {key: Decimal(value) for key, value in snapshot.data['totals'].items()}
+
+
+def frozen_snapshot(estimate):
+    """Снимок, из которого читается смета (None - смета не утверждена или снимка еще нет)"""
+    if estimate.status in Estimate.APPROVED_STATUSES and estimate.current_snapshot_id:
+        return estimate.current_snapshot
+    return None
+
+
+def estimate_lines(estimate):
+    """
+    Строки сметы для чтения: из снимка утвержденной сметы, иначе из
+    позиций (подгруженных prefetch или одним запросом с прайсом)
+    """
+    snapshot = frozen_snapshot(estimate)
+    if snapshot is not None:
+        return snapshot_lines(snapshot)
+    if 'items' in getattr(estimate, '_prefetched_objects_cache', {}):
+        items = estimate.items.all()
+    else:
+        items = estimate.items.select_related('price_item').order_by('id')
+    return [SnapshotLine.from_item(item) for item in items]
+
+
+def refresh_snapshot(estimate_id, using=DEFAULT_DB_ALIAS):
+    """
+    Новая ревизия снимка утвержденной сметы, если содержимое отличается
+    от текущей. Возвращает текущий снимок (None - смета не утверждена).
+    """
+    estimate = Estimate.objects.using(using).select_related('current_snapshot').filter(pk=estimate_id).first()
+    if estimate is None or estimate.status not in Estimate.APPROVED_STATUSES:
+        return None
+    data = build_snapshot_data(estimate, estimate.items.using(using).select_related('price_item').order_by('id'))
+    if estimate.current_snapshot is not None and estimate.current_snapshot.data == data:
+        return estimate.current_snapshot
+    with immediate_atomic(using=using):
+        revision = EstimateSnapshot.objects.using(using).filter(estimate_id=estimate_id).aggregate(
+            last=Max('revision'),
+        )['last'] or 0
+        snapshot = EstimateSnapshot.objects.using(using).create(estimate_id=estimate_id, revision=revision + 1, data=data)
+        # update() - без сигналов сметы, иначе снимок запланировался бы снова
+        Estimate.objects.using(using).filter(pk=estimate_id).update(current_snapshot=snapshot)
+    return snapshot
+
+
+class _RefreshSnapshot:
+    """Отложенное до коммита обновление снимка одной сметы"""
+
+    def __init__(self, estimate_id, using):
+        self.estimate_id = estimate_id
+        self.using = using
+
+    def __call__(self):
+        refresh_snapshot(self.estimate_id, using=self.using)
+
+
+def schedule_snapshot_refresh(estimate_id, using=DEFAULT_DB_ALIAS):
+    """Обновить снимок после коммита; повторные вызовы в той же транзакции не дублируются"""
+    connection = transaction.get_connection(using)
+    for _savepoints, func, *_rest in connection.run_on_commit:
+        if isinstance(func, _RefreshSnapshot) and func.estimate_id == estimate_id:
+            return
+    transaction.on_commit(_RefreshSnapshot(estimate_id, using), using=using)
+
+
+def refresh_snapshot_on_estimate_save(sender, instance, raw=False, using=None, **kwargs):
+    """post_save сметы: утверждение (или правка утвержденной) - снимок после коммита"""
+    if raw or instance.status not in Estimate.APPROVED_STATUSES:
+        return
+    schedule_snapshot_refresh(instance.pk, using=using or DEFAULT_DB_ALIAS)
+
+
+def refresh_snapshot_on_item_change(sender, instance, raw=False, using=None, **kwargs):
+    """post_save/post_delete позиции: смета утверждена - новая ревизия после коммита"""
+    if raw:
+        return
+    status = Estimate.objects.using(using or DEFAULT_DB_ALIAS).filter(pk=instance.estimate_id).values_list(
+        'status', flat=True,
+    ).first()
+    if status in Estimate.APPROVED_STATUSES:
+        schedule_snapshot_refresh(instance.estimate_id, using=using or DEFAULT_DB_ALIAS)
@@ -0,0 +1,193 @@
+"""
+Акт сверки с контрагентом: все движения по Transaction.contractor
+за период (с архивом) с суммой со знаком (правила get_signed_amount)
+и остатком нарастающим итогом.
+
+Остаток считается в SQL оконной функцией SUM() OVER (ORDER BY дата,
+создание, id). Начальный остаток - из остатков закрытых периодов
+(control/periods.py) плюс транзакции после них. Страницы в админке -
+по ключу (дата, создание, id): курсор следующей страницы подписан
+и несет остаток на конец предыдущей, поэтому каждая страница читает
+только свои строки. Выгрузка CSV потоковая, XLSX пишется построчно
+(xlsxwriter constant_memory) во временный файл.
+"""
+import csv
+import datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When, Window
+from django.db.models.expressions import RowRange
+
+from .models import AbstractTransaction, LedgerTransaction
+from .periods import balances_as_of
+from .utils import EXPENSE_TYPES
+
+
+# Порядок строк акта - он же ключ пагинации
+STATEMENT_ORDER = ('date', 'created_at', 'id')
+
+STATEMENT_PAGE_SIZE = 100
+
+STATEMENT_COLUMNS = ['Дата', 'Операция', 'Категория', 'Описание', 'Сумма', 'Остаток']
+
+_CURSOR_SALT = 'control.statements.cursor'
+
+_TYPE_LABELS = dict(AbstractTransaction.TRANSACTION_TYPE_CHOICES)
+
+
+def signed_amount():
+    """Сумма со знаком в SQL: расходные типы - с минусом"""
+    return Case(
+        When(transaction_type__in=EXPENSE_TYPES, then=-F('amount')),
+        default=F('amount'),
+        output_field=DecimalField(max_digits=17, decimal_places=2),
+    )
+
+
+def running_total():
+    """Остаток нарастающим итогом по строкам выборки в порядке акта"""
+    return Window(
+        Sum(signed_amount()),
+        order_by=[F(name).asc() for name in STATEMENT_ORDER],
+        frame=RowRange(start=None, end=0),
+    )
+
+
+def opening_balance(contractor, date_from):
+    """Остаток на начало дня date_from (0 без даты начала)"""
+    if date_from is None:
+        return Decimal('0.00')
+    rows, _period = balances_as_of(date_from - datetime.timedelta(days=1), (), {'contractor': contractor.pk})
+    return rows[0]['balance'] if rows else Decimal('0.00')
+
+
+def statement_queryset(contractor, date_from=None, date_to=None):
+    """Движения контрагента за период (с архивом) с суммой со знаком и остатком от начала периода"""
+    qs = LedgerTransaction.objects.filter(contractor=contractor)
+    if date_from is not None:
+        qs = qs.filter(date__gte=date_from)
+    if date_to is not None:
+        qs = qs.filter(date__lte=date_to)
+    return qs.annotate(signed=signed_amount(), running=running_total()).order_by(*STATEMENT_ORDER)
+
+
+def _money(value):
+    # SQLite теряет масштаб DecimalField в SUM - возвращаем копейки явно
+    return (value or Decimal('0')).quantize(Decimal('0.01'))
+
+
+def encode_cursor(row, balance):
+    return signing.dumps(
+        [row.date.isoformat(), row.created_at.isoformat(), row.pk, str(balance)], salt=_CURSOR_SALT, compress=True,
+    )
+
+
+def decode_cursor(cursor):
+    """(дата, создание, id, остаток) из курсора; ValueError при подделке"""
+    try:
+        date, created_at, pk, balance = signing.loads(cursor, salt=_CURSOR_SALT)
+        return (
+            datetime.date.fromisoformat(date), datetime.datetime.fromisoformat(created_at), int(pk), Decimal(balance),
+        )
+    except (signing.BadSignature, TypeError, ValueError) as e:
+        raise ValueError(f'Неверный курсор: {e}')
+
+
+def statement_page(contractor, date_from=None, date_to=None, cursor=None, page_size=STATEMENT_PAGE_SIZE):
+    """
+    Страница акта после курсора: словарь rows (строки с balance),
+    opening (остаток перед первой строкой страницы) и next_cursor.
+    """
+    qs = statement_queryset(contractor, date_from, date_to)
+    if cursor:
+        date, created_at, pk, opening = decode_cursor(cursor)
+        # Строки после ключа; окно считается по ним, остаток до ключа - из курсора
+        qs = qs.filter(
+            Q(date__gt=date)
+            | Q(date=date, created_at__gt=created_at)
+            | Q(date=date, created_at=created_at, id__gt=pk)
+        )
+    else:
+        opening = opening_balance(contractor, date_from)
+    rows = list(qs.select_related('category')[:page_size + 1])
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    for row in rows:
+        row.signed = _money(row.signed)
+        row.balance = opening + _money(row.running)
+    return {
+        'rows': rows,
+        'opening': opening,
+        'next_cursor': encode_cursor(rows[-1], rows[-1].balance) if has_next else None,
+    }
+
+
+def statement_totals(contractor, date_from=None, date_to=None):
+    """Начальный остаток, обороты и конечный остаток за период (один агрегирующий запрос)"""
+    qs = LedgerTransaction.objects.filter(contractor=contractor)
+    if date_from is not None:
+        qs = qs.filter(date__gte=date_from)
+    if date_to is not None:
+        qs = qs.filter(date__lte=date_to)
+    totals = qs.aggregate(
+        credit=Sum('amount', filter=~Q(transaction_type__in=EXPENSE_TYPES), default=Value(0)),
+        debit=Sum('amount', filter=Q(transaction_type__in=EXPENSE_TYPES), default=Value(0)),
+    )
+    opening = opening_balance(contractor, date_from)
+    credit, debit = _money(totals['credit']), _money(totals['debit'])
+    return {'opening': opening, 'credit': credit, 'debit': debit, 'closing': opening + credit - debit}
+
+
+def iter_statement_rows(contractor, date_from=None, date_to=None, chunk_size=2000):
+    """Строки акта для выгрузки: [дата, операция, категория, описание, сумма, остаток]"""
+    opening = opening_balance(contractor, date_from)
+    rows = (
+        statement_queryset(contractor, date_from, date_to)
+        .values_list('date', 'transaction_type', 'category__name', 'description', 'signed', 'running')
+        .iterator(chunk_size=chunk_size)
+    )
+    for date, transaction_type, category, description, signed, running in rows:
+        yield [date, _TYPE_LABELS.get(transaction_type, transaction_type), category, description or '',
+               _money(signed), opening + _money(running)]
+
+
+class _Echo:
+    """Файлоподобный объект для csv.writer: write возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def iter_statement_csv(contractor, date_from=None, date_to=None):
+    """Потоковый CSV акта (UTF-8 с BOM и ';' - открывается в Excel)"""
+    writer = csv.writer(_Echo(), delimiter=';')
+    yield '\ufeff' + writer.writerow(STATEMENT_COLUMNS)
+    yield writer.writerow(['', 'Начальный остаток', '', '', '', opening_balance(contractor, date_from)])
+    for row in iter_statement_rows(contractor, date_from, date_to):
+        row[0] = row[0].strftime('%d.%m.%Y')
+        yield writer.writerow(row)
+
+
+def write_statement_xlsx(fh, contractor, date_from=None, date_to=None):
+    """XLSX акта в файл fh; строки пишутся по одной, память не растет с числом движений"""
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(fh, {'constant_memory': True})
+    sheet = workbook.add_worksheet('Акт сверки')
+    date_format = workbook.add_format({'num_format': 'dd.mm.yyyy'})
+    money_format = workbook.add_format({'num_format': '#,##0.00'})
+    sheet.write_row(0, 0, STATEMENT_COLUMNS)
+    sheet.write(1, 1, 'Начальный остаток')
+    sheet.write_number(1, 5, float(opening_balance(contractor, date_from)), money_format)
+    row_index = 2
+    for date, operation, category, description, signed, balance in iter_statement_rows(contractor, date_from, date_to):
+        sheet.write_datetime(row_index, 0, datetime.datetime.combine(date, datetime.time()), date_format)
+        sheet.write_string(row_index, 1, operation)
+        sheet.write_string(row_index, 2, category or '')
+        sheet.write_string(row_index, 3, description)
+        sheet.write_number(row_index, 4, float(signed), money_format)
+        sheet.write_number(row_index, 5, float(balance), money_format)
+        row_index += 1
+    workbook.close()
+    return row_index - 2
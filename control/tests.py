@@ -1,3 +1,331 @@
-from django.test import TestCase
+import io
+import operator
+import os
+import tempfile
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db.models import ProtectedError
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .bank_import import import_statement, iter_statement_rows
+from .models import (
+    ArchivedTransaction, Category, CustomUser, DebtPosition, Estimate, EstimateItem, ImportRule, MaterialType,
+    Object, PriceItem, Project, Stage, Transaction, WorkType,
+)
+from .nplusone import assert_no_nplusone
+from .periods import PeriodClosedError, balances_as_of, close_period, closed_until, verify_period
+
+
+# Кэш в памяти процесса: версии моделей не переживают откат теста и не трогают общий кэш
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Строк больше NPLUSONE_THRESHOLD: ленивая загрузка в цикле дала бы повтор формы запроса
+ROWS = 8
+
+
+class AdminNPlusOneTests(TestCase):
+    """Списки и карточки админки не делают запрос на каждую строку"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser('+70000000001', 'password')
+        category = Category.objects.create(name='Материалы')
+        cls.projects = []
+        for index in range(ROWS):
+            contractor = CustomUser.objects.create_user(
+                f'+7000000010{index}', None, last_name=f'Подрядчик {index}', first_name='Иван',
+            )
+            project = Project._default_manager.create(name=f'Проект {index}', contractor=contractor)
+            obj = Object.objects.create(name=f'Объект {index}', project=project)
+            stage = Stage.objects.create(name=f'Этап {index}', object=obj, order=1)
+            estimate = Estimate.objects.create(stage=stage)
+            material = MaterialType.objects.create(name=f'Материал {index}')
+            work = WorkType.objects.create(name=f'Работа {index}')
+            for price_item in (
+                PriceItem.objects.create(material=material, unit='м3', price_per_unit=100 + index),
+                PriceItem.objects.create(work_type=work, unit='ч', price_per_unit=50 + index),
+            ):
+                item = EstimateItem.objects.create(
+                    estimate=estimate, price_item=price_item, quantity=Decimal('2'), unit_price=0,
+                    income_type='markup', income_value=10, is_percentage=True,
+                )
+            Transaction.objects.create(
+                amount=100 + index, transaction_type='expense', category=category, contractor=contractor, stage=stage,
+            )
+            Transaction.objects.create(amount=300, transaction_type='income', category=category, estimate=estimate)
+            Transaction.objects.create(
+                amount=50, transaction_type='debt_give', category=category, contractor=contractor, estimate_item=item,
+            )
+            cls.projects.append(project)
+        # В карточке сметы - позиции с разными позициями прайса
+        for price_item in PriceItem.objects.exclude(estimate_items__estimate=estimate)[:ROWS]:
+            EstimateItem.objects.create(estimate=estimate, price_item=price_item, quantity=Decimal('1'), unit_price=0)
+        cls.estimate = estimate
+        cls.transaction = Transaction.objects.order_by('id').first()
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assertPageOk(self, url):
+        with assert_no_nplusone():
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_transaction_changelist(self):
+        self.assertPageOk(reverse('admin:control_transaction_changelist'))
+
+    def test_transaction_change(self):
+        self.assertPageOk(reverse('admin:control_transaction_change', args=[self.transaction.pk]))
+
+    def test_estimate_changelist(self):
+        self.assertPageOk(reverse('admin:control_estimate_changelist'))
+
+    def test_estimate_change(self):
+        self.assertPageOk(reverse('admin:control_estimate_change', args=[self.estimate.pk]))
+
+    def test_project_changelist(self):
+        self.assertPageOk(reverse('admin:control_project_changelist'))
+
+    def test_project_change(self):
+        self.assertPageOk(reverse('admin:control_project_change', args=[self.projects[0].pk]))
+
+
+STATEMENT_CSV = """Дата;Сумма;Контрагент;Назначение платежа
+10.01.2025;-1 500,00;ООО Песок;Оплата за песок
+15.02.2025;-250,00;ООО Песок;Оплата за песок
+15.02.2025;-250,00;ООО Песок;Оплата за песок
+20.02.2025;10 000,00;ООО Клиент;Оплата по счету 17
+01.03.2025;5000,00;Петров;Займ по договору
+"""
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class BankImportTests(TestCase):
+    """Импорт выписки: дубликаты по хэшу, архив, закрытые периоды, долги"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Прочее')
+        cls.borrower = CustomUser.objects.create_user('+70000000201', None, last_name='Петров')
+        ImportRule.objects.create(
+            name='Займы', field='description', pattern='займ', direction='income', category=cls.category,
+            contractor=cls.borrower, transaction_type='debt_receive', priority=1,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def import_csv(self, text=STATEMENT_CSV):
+        return import_statement(iter_statement_rows(io.StringIO(text)), default_category=self.category)
+
+    def test_second_import_creates_nothing(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+            fh.write(STATEMENT_CSV)
+        self.addCleanup(os.remove, path)
+        call_command('import_bank_statement', path, '--category', self.category.name, stdout=io.StringIO())
+        self.assertEqual(Transaction.objects.count(), 5)
+        stats = self.import_csv()
+        self.assertEqual((stats['created'], stats['duplicates']), (0, 5))
+        self.assertEqual(Transaction.objects.count(), 5)
+
+    def test_archived_rows_are_duplicates(self):
+        from .archive import archive_transactions
+        self.import_csv()
+        archive_transactions(Transaction.objects.filter(date__lt='2025-02-01'))
+        self.assertEqual(ArchivedTransaction.objects.count(), 1)
+        stats = self.import_csv()
+        self.assertEqual((stats['created'], stats['duplicates']), (0, 5))
+        self.assertEqual(Transaction.objects.count(), 4)
+
+    def test_closed_period_rows_are_skipped(self):
+        close_period('2025-01')
+        stats = self.import_csv()
+        self.assertEqual((stats['closed'], stats['created']), (1, 4))
+        self.assertFalse(Transaction.objects.filter(date__lte='2025-01-31').exists())
+
+    def test_debt_positions_follow_bulk_create(self):
+        self.import_csv()
+        position = DebtPosition.objects.get(contractor=self.borrower)
+        self.assertEqual((position.borrowed, position.payable), (Decimal('5000.00'), Decimal('5000.00')))
+        # Повторный импорт ничего не создает - позиция не меняется
+        self.import_csv()
+        position.refresh_from_db()
+        self.assertEqual(position.borrowed, Decimal('5000.00'))
+
+
+class DebtPositionTests(TestCase):
+    """Позиции долгов сходятся с пересчетом после каждой операции с транзакциями"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Займы')
+        cls.first = CustomUser.objects.create_user('+70000000301', None, last_name='Иванов')
+        cls.second = CustomUser.objects.create_user('+70000000302', None, last_name='Сидоров')
+
+    def assertPositionsConsistent(self):
+        from .debts import check_debt_positions
+        self.assertEqual(check_debt_positions(), [])
+
+    def test_create_edit_delete(self):
+        given = Transaction.objects.create(
+            amount=1000, transaction_type='debt_give', category=self.category, contractor=self.first,
+        )
+        Transaction.objects.create(
+            amount=400, transaction_type='debt_received', category=self.category, contractor=self.first,
+        )
+        self.assertPositionsConsistent()
+        self.assertEqual(DebtPosition.objects.get(contractor=self.first).receivable, Decimal('600.00'))
+
+        given.amount = 1500
+        given.save()
+        self.assertPositionsConsistent()
+        given.transaction_type = 'debt_receive'
+        given.save()
+        self.assertPositionsConsistent()
+        given.contractor = self.second
+        given.save()
+        self.assertPositionsConsistent()
+        self.assertEqual(DebtPosition.objects.get(contractor=self.second).payable, Decimal('1500.00'))
+        # Долг, ставший обычным расходом, из позиций уходит
+        given.transaction_type = 'expense'
+        given.save()
+        self.assertPositionsConsistent()
+
+        given.delete()
+        Transaction.objects.filter(contractor=self.first).get().delete()
+        self.assertPositionsConsistent()
+
+    def test_archive_restore_and_archive_delete(self):
+        from .archive import archive_transactions, restore_transactions
+        for amount, transaction_type, contractor in (
+            (1000, 'debt_give', self.first), (300, 'debt_received', self.first),
+            (700, 'debt_receive', self.second), (200, 'debt_repay', self.second),
+        ):
+            Transaction.objects.create(
+                amount=amount, transaction_type=transaction_type, category=self.category, contractor=contractor,
+            )
+        self.assertPositionsConsistent()
+
+        archive_transactions(Transaction.objects.all())
+        self.assertPositionsConsistent()
+        restore_transactions(ArchivedTransaction.objects.filter(contractor=self.second))
+        self.assertPositionsConsistent()
+        self.assertEqual(DebtPosition.objects.get(contractor=self.second).payable, Decimal('500.00'))
+
+        ArchivedTransaction.objects.get(transaction_type='debt_received').delete()
+        self.assertPositionsConsistent()
+        self.assertEqual(DebtPosition.objects.get(contractor=self.first).receivable, Decimal('1000.00'))
+        ArchivedTransaction.objects.all().delete()
+        self.assertPositionsConsistent()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ClosedPeriodTests(TestCase):
+    """Закрытый период: запрет изменений, сверка остатков, расчет остатков от периода"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Материалы')
+        cls.contractor = CustomUser.objects.create_user('+70000000401', None, last_name='Подрядчик')
+        project = Project._default_manager.create(name='Проект', contractor=cls.contractor)
+        obj = Object.objects.create(name='Объект', project=project)
+        cls.stage = Stage.objects.create(name='Этап', object=obj, order=1)
+        cls.project = project
+        for date, amount, transaction_type in (
+            ('2025-01-10', 1000, 'income'), ('2025-01-20', 300, 'expense'), ('2025-01-31', 200, 'debt_give'),
+            ('2025-02-01', 500, 'expense'), ('2025-02-15', 700, 'income'),
+        ):
+            Transaction.objects.create(
+                date=date, amount=amount, transaction_type=transaction_type, category=cls.category,
+                contractor=cls.contractor, stage=cls.stage,
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_closed_transactions_are_locked(self):
+        close_period('2025-01')
+        self.assertEqual(str(closed_until()), '2025-01-31')
+        closed = Transaction.objects.get(date='2025-01-31')
+        closed.amount = 1
+        with self.assertRaises(PeriodClosedError):
+            closed.save()
+        with self.assertRaises(PeriodClosedError):
+            closed.delete()
+        # Перенос открытой транзакции в закрытый период тоже запрещен
+        opened = Transaction.objects.get(date='2025-02-01')
+        opened.date = '2025-01-15'
+        with self.assertRaises(PeriodClosedError):
+            opened.save()
+        with self.assertRaises(PeriodClosedError):
+            Transaction.objects.create(
+                date='2025-01-05', amount=1, transaction_type='expense', category=self.category,
+            )
+        # Каскад от этапа не обходит защиту
+        with self.assertRaises(ProtectedError):
+            self.stage.delete()
+        # Транзакции после закрытого периода меняются
+        opened.refresh_from_db()
+        opened.amount = 550
+        opened.save()
+        opened.delete()
+
+    def test_verify_period_after_close(self):
+        first = close_period('2025-01')
+        self.assertEqual(verify_period(first), {})
+        second = close_period('2025-02')
+        self.assertEqual(second.transactions_count, 2)
+        self.assertEqual(verify_period(second), {})
+
+    def test_balances_match_with_and_without_period(self):
+        dimensions = ('project', 'transaction_type')
+        before = {}
+        for as_of in ('2025-01-31', '2025-02-10', '2025-03-01'):
+            rows, period = balances_as_of(as_of, dimensions)
+            self.assertIsNone(period)
+            before[as_of] = rows
+        close_period('2025-01')
+        key = operator.itemgetter(*dimensions)
+        for as_of, expected in before.items():
+            rows, period = balances_as_of(as_of, dimensions)
+            self.assertIsNotNone(period)
+            self.assertEqual(sorted(rows, key=key), sorted(expected, key=key))
+        rows, _period = balances_as_of('2025-03-01')
+        self.assertEqual(rows[0]['balance'], Decimal('700.00'))
+
+
+class ArchiveRoundTripTests(TestCase):
+    """Архивация и возврат сохраняют id и итоги по типам операций"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Материалы')
+        contractor = CustomUser.objects.create_user('+70000000501', None, last_name='Подрядчик')
+        for index, transaction_type in enumerate(('income', 'expense', 'expense', 'debt_give', 'debt_received')):
+            Transaction.objects.create(
+                date=f'2024-0{index + 1}-15', amount=Decimal('100.50') * (index + 1),
+                transaction_type=transaction_type, category=category, contractor=contractor,
+            )
+
+    def test_archive_restore_keeps_ids_and_totals(self):
+        from .archive import archive_transactions, ledger_totals, restore_transactions
+        ids = set(Transaction.objects.values_list('id', flat=True))
+        totals = ledger_totals()
+        working = ledger_totals(Transaction)
+
+        # Пачками меньше числа строк - проверяется и перенос по частям
+        self.assertEqual(archive_transactions(Transaction.objects.all(), batch_size=2), len(ids))
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(set(ArchivedTransaction.objects.values_list('id', flat=True)), ids)
+        self.assertEqual(ledger_totals(), totals)
+        self.assertEqual(ledger_totals(ArchivedTransaction), working)
+
+        self.assertEqual(restore_transactions(ArchivedTransaction.objects.all(), batch_size=2), len(ids))
+        self.assertFalse(ArchivedTransaction.objects.exists())
+        self.assertEqual(set(Transaction.objects.values_list('id', flat=True)), ids)
+        self.assertEqual(ledger_totals(), totals)
+        self.assertEqual(ledger_totals(Transaction), working)
@@ -0,0 +1,264 @@
+"""
+Легковесная трассировка: спаны вокруг функций utils, панелей админки,
+экспорта и мастера транзакций, а также вокруг каждого SQL-запроса
+и рендера шаблона внутри трассы.
+
+Трасса начинается в TracingMiddleware (или в фоновой задаче) с долей
+TRACING_SAMPLE_RATE; вне трассы span() и @traced ничего не делают.
+Завершенная трасса пишется одной строкой в TRACING_FILE в формате
+OTLP/JSON (как у file exporter OpenTelemetry Collector).
+
+Самые медленные трассы деревом: python manage.py traces_report
+"""
+import functools
+import json
+import os
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .db import wrap_connections
+from .jsonlog import get_json_logger
+
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span = ContextVar('control_current_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'start', 'end', 'attributes', 'status')
+
+    def __init__(self, trace, name, parent_id=None, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_OK
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_otlp(self):
+        data = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end or time.time_ns()),
+            'attributes': [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': self.status},
+        }
+        if self.parent_id:
+            data['parentSpanId'] = self.parent_id
+        return data
+
+
+class Trace:
+    """Спаны одной трассы; пишутся в файл при завершении корневого спана"""
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.dropped = 0
+
+    def add(self, span):
+        if len(self.spans) >= settings.TRACING_MAX_SPANS:
+            self.dropped += 1
+            return False
+        self.spans.append(span)
+        return True
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+def sampled():
+    rate = settings.TRACING_SAMPLE_RATE
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+@contextmanager
+def span(name, kind=SPAN_KIND_INTERNAL, **attributes):
+    """Дочерний спан текущей трассы; вне трассы ничего не делает"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    current = Span(parent.trace, name, parent.span_id, kind, attributes)
+    if not parent.trace.add(current):
+        yield None
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.status = STATUS_ERROR
+        current.set_attribute('exception.message', str(e))
+        raise
+    finally:
+        current.end = time.time_ns()
+        _current_span.reset(token)
+
+
+def traced(name=None):
+    """Декоратор: спан вокруг вызова функции или метода"""
+    def decorator(func):
+        span_name = name or f'{func.__module__.rsplit(".", 1)[-1]}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _sql_span_wrapper(execute, sql, params, many, context):
+    """execute_wrapper: спан на каждый SQL-запрос внутри трассы"""
+    with span('db.query', SPAN_KIND_CLIENT, **{
+        'db.system': context['connection'].vendor,
+        'db.statement': sql[:1000],
+    }):
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def start_trace(name, kind=SPAN_KIND_SERVER, **attributes):
+    """Корневой спан новой трассы (запрос, фоновая задача); пишет трассу в файл"""
+    if _current_span.get() is not None:
+        with span(name, kind, **attributes) as current:
+            yield current
+        return
+    trace = Trace()
+    root = Span(trace, name, None, kind, attributes)
+    trace.add(root)
+    token = _current_span.set(root)
+    try:
+        with connections['default'].execute_wrapper(_sql_span_wrapper):
+            yield root
+    except Exception as e:
+        root.status = STATUS_ERROR
+        root.set_attribute('exception.message', str(e))
+        raise
+    finally:
+        root.end = time.time_ns()
+        _current_span.reset(token)
+        if trace.dropped:
+            root.set_attribute('trace.dropped_spans', trace.dropped)
+        export_trace(trace)
+
+
+def export_trace(trace):
+    """Записать трассу одной строкой OTLP/JSON"""
+    payload = {
+        'resourceSpans': [{
+            'resource': {'attributes': [
+                _otlp_attribute('service.name', settings.TRACING_SERVICE_NAME),
+                _otlp_attribute('process.pid', os.getpid()),
+            ]},
+            'scopeSpans': [{
+                'scope': {'name': 'control.tracing'},
+                'spans': [item.to_otlp() for item in trace.spans],
+            }],
+        }],
+    }
+    logger = get_json_logger(
+        'control.traces', settings.TRACING_FILE,
+        settings.TRACING_FILE_MAX_BYTES, settings.TRACING_FILE_BACKUPS,
+    )
+    logger.info(json.dumps(payload, ensure_ascii=False, default=str))
+
+
+def install_template_spans():
+    """Спан на каждый рендер шаблона Django внутри трассы"""
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, '_control_traced', False):
+        return
+    original = Template.render
+
+    def render(self, context=None, request=None):
+        if _current_span.get() is None:
+            return original(self, context, request)
+        with span('template.render', **{'template.name': getattr(self.template, 'name', None) or ''}):
+            return original(self, context, request)
+
+    render._control_traced = True
+    Template.render = render
+
+
+class TracingMiddleware:
+    """Корневой спан HTTP-запроса для сэмплированных запросов; работает и под ASGI"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        return start_trace(f'{request.method} {request.path}', **{
+            'http.method': request.method,
+            'http.target': request.get_full_path(),
+        })
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not sampled():
+            return self.get_response(request)
+        with self._start(request) as root:
+            response = self.get_response(request)
+            if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                response.render()
+            self._annotate(request, response, root)
+        response['traceparent'] = f'00-{root.trace.trace_id}-{root.span_id}-01'
+        return response
+
+    async def __acall__(self, request):
+        if not sampled():
+            return await self.get_response(request)
+        with self._start(request) as root, ExitStack() as stack:
+            # SQL-спаны: запросы синхронной части идут через соединение ее потока
+            await sync_to_async(wrap_connections)(stack, _sql_span_wrapper, ['default'])
+            response = await self.get_response(request)
+            if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                await sync_to_async(response.render)()
+            self._annotate(request, response, root)
+        response['traceparent'] = f'00-{root.trace.trace_id}-{root.span_id}-01'
+        return response
+
+    def _annotate(self, request, response, root):
+        match = getattr(request, 'resolver_match', None)
+        if match:
+            root.name = f'{request.method} {match.view_name}'
+            root.set_attribute('http.route', match.route)
+        root.set_attribute('http.status_code', response.status_code)
@@ -1,58 +1,82 @@
 """
 Утилиты для системы учета строителя
 """
-from django.db.models import Q
+import asyncio
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, Q, Sum
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
-from .models import Transaction
+from .archive import include_archive, ledger_model
+from .cache import cached
+from .tracing import traced
+from .models import Category, CustomUser, Transaction
+
+
+# Типы операций, уменьшающие баланс (см. Transaction.get_signed_amount)
+EXPENSE_TYPES = ['expense', 'transfer', 'debt_give', 'debt_repay']
+
+# Модели, от которых зависит состав транзакций узла иерархии
+TRANSACTION_SCOPE_DEPENDENCIES = (
+    'control.Transaction', 'control.ArchivedTransaction',
+    'control.EstimateItem', 'control.Estimate', 'control.Stage', 'control.Object',
+)
 
+TRANSACTIONS_PER_PAGE = 20
 
+
+@traced()
 def get_transactions_for_estimate_item(estimate_item):
     """
     Получить все транзакции для пункта сметы
     """
     if not estimate_item or not estimate_item.pk:
-        return Transaction.objects.none()
+        return ledger_model().objects.none()
     
-    return Transaction.objects.filter(
+    return ledger_model().objects.filter(
         estimate_item=estimate_item
     ).order_by('-date')
 
 
+@traced()
 def get_transactions_for_estimate(estimate):
     """
     Получить все транзакции для сметы (включая транзакции пунктов сметы)
     """
     if not estimate or not estimate.pk:
-        return Transaction.objects.none()
+        return ledger_model().objects.none()
     
     # Транзакции, привязанные к смете напрямую
-    estimate_transactions = Transaction.objects.filter(estimate=estimate)
+    estimate_transactions = ledger_model().objects.filter(estimate=estimate)
     
     # Транзакции, привязанные к пунктам сметы
-    item_transactions = Transaction.objects.filter(estimate_item__estimate=estimate)
+    item_transactions = ledger_model().objects.filter(estimate_item__estimate=estimate)
     
     # Объединяем
     return (estimate_transactions | item_transactions).distinct().order_by('-date')
 
 
+@traced()
 def get_transactions_for_stage(stage):
     """
     Получить все транзакции для этапа (включая транзакции смет и пунктов сметы)
     """
     if not stage or not stage.pk:
-        return Transaction.objects.none()
+        return ledger_model().objects.none()
     
     # Транзакции, привязанные к этапу напрямую
-    stage_transactions = Transaction.objects.filter(stage=stage)
+    stage_transactions = ledger_model().objects.filter(stage=stage)
     
     # Транзакции через сметы
-    estimate_transactions = Transaction.objects.filter(
+    estimate_transactions = ledger_model().objects.filter(
         estimate__stage=stage
     )
     
     # Транзакции через пункты смет
-    item_transactions = Transaction.objects.filter(
+    item_transactions = ledger_model().objects.filter(
         estimate_item__estimate__stage=stage
     )
     
@@ -60,23 +84,24 @@ def get_transactions_for_stage(stage):
     return (stage_transactions | estimate_transactions | item_transactions).distinct().order_by('-date')
 
 
+@traced()
 def get_transactions_for_object(object_obj):
     """
     Получить все транзакции для объекта (включая все дочерние этапы, сметы и пункты сметы)
     """
     if not object_obj or not object_obj.pk:
-        return Transaction.objects.none()
+        return ledger_model().objects.none()
     
     # Транзакции через этапы
-    stage_transactions = Transaction.objects.filter(
+    stage_transactions = ledger_model().objects.filter(
         stage__object=object_obj
     )
     
-    estimate_transactions = Transaction.objects.filter(
+    estimate_transactions = ledger_model().objects.filter(
         estimate__stage__object=object_obj
     )
     
-    item_transactions = Transaction.objects.filter(
+    item_transactions = ledger_model().objects.filter(
         estimate_item__estimate__stage__object=object_obj
     )
     
@@ -84,23 +109,24 @@ def get_transactions_for_object(object_obj):
     return (stage_transactions | estimate_transactions | item_transactions).distinct().order_by('-date')
 
 
+@traced()
 def get_transactions_for_project(project):
     """
     Получить все транзакции для проекта (включая все дочерние объекты, этапы, сметы и пункты сметы)
     """
     if not project or not project.pk:
-        return Transaction.objects.none()
+        return ledger_model().objects.none()
     
     # Транзакции через объекты проекта
-    stage_transactions = Transaction.objects.filter(
+    stage_transactions = ledger_model().objects.filter(
         stage__object__project=project
     )
     
-    estimate_transactions = Transaction.objects.filter(
+    estimate_transactions = ledger_model().objects.filter(
         estimate__stage__object__project=project
     )
     
-    item_transactions = Transaction.objects.filter(
+    item_transactions = ledger_model().objects.filter(
         estimate_item__estimate__stage__object__project=project
     )
     
@@ -108,6 +134,7 @@ def get_transactions_for_project(project):
     return (stage_transactions | estimate_transactions | item_transactions).distinct().order_by('-date')
 
 
+@traced()
 def render_transactions_table(transactions, title="Транзакции", show_links=True, page_size=10, page=1):
     """
     Рендерит HTML-таблицу транзакций в стиле Django Admin с пагинацией
@@ -198,8 +225,10 @@ def render_transactions_table(transactions, title="Транзакции", show_l
         # Ссылки на редактирование и просмотр
         if show_links:
             html += '<td style="border: 1px solid var(--border-color, #ddd); padding: 8px; text-align: center;">'
-            html += f'<a href="/admin/control/transaction/{transaction.pk}/change/" style="color: #007cba; text-decoration: none; margin-right: 5px;" title="Редактировать">✏️</a>'
-            html += f'<a href="/admin/control/transaction/{transaction.pk}/" style="color: #28a745; text-decoration: none;" title="Просмотреть">👁️</a>'
+            # Архивные транзакции (LedgerTransaction.is_archived) открываются в разделе архива
+            model_path = 'archivedtransaction' if getattr(transaction, 'is_archived', False) else 'transaction'
+            html += f'<a href="/admin/control/{model_path}/{transaction.pk}/change/" style="color: #007cba; text-decoration: none; margin-right: 5px;" title="Редактировать">✏️</a>'
+            html += f'<a href="/admin/control/{model_path}/{transaction.pk}/" style="color: #28a745; text-decoration: none;" title="Просмотреть">👁️</a>'
             html += '</td>'
         
         html += '</tr>'
@@ -246,31 +275,224 @@ def render_transactions_table(transactions, title="Транзакции", show_l
     return format_html(html)
 
 
+@traced()
 def get_transactions_summary(transactions):
     """
-    Получить сводку по транзакциям
+    Получить сводку по транзакциям (одним агрегирующим запросом)
     """
-    if not transactions.exists():
-        return {
-            'total_income': 0,
-            'total_expense': 0,
-            'balance': 0,
-            'count': 0
-        }
-    
-    total_income = 0
-    total_expense = 0
-    
-    for transaction in transactions:
-        signed_amount = transaction.get_signed_amount()
-        if signed_amount > 0:
-            total_income += signed_amount
-        else:
-            total_expense += abs(signed_amount)
-    
+    totals = transactions.aggregate(
+        total_income=Sum('amount', filter=~Q(transaction_type__in=EXPENSE_TYPES)),
+        total_expense=Sum('amount', filter=Q(transaction_type__in=EXPENSE_TYPES)),
+        count=Count('id'),
+    )
+    total_income = totals['total_income'] or 0
+    total_expense = totals['total_expense'] or 0
     return {
         'total_income': total_income,
         'total_expense': total_expense,
         'balance': total_income - total_expense,
-        'count': transactions.count()
+        'count': totals['count'],
+    }
+
+
+@traced()
+def get_scope_transactions(scope, obj):
+    """
+    Транзакции узла для списков в админке: scope - имя модели
+    (estimate, estimateitem, stage, object, project). С архивом или
+    без - по переключателю include_archive (control/archive.py).
+    """
+    if scope == 'estimate':
+        # Список сметы показывает только транзакции, привязанные к смете напрямую
+        qs = ledger_model().objects.filter(estimate=obj)
+    elif scope == 'estimateitem':
+        qs = ledger_model().objects.filter(estimate_item=obj)
+    elif scope == 'stage':
+        qs = get_transactions_for_stage(obj)
+    elif scope == 'object':
+        qs = get_transactions_for_object(obj)
+    elif scope == 'project':
+        qs = get_transactions_for_project(obj)
+    else:
+        raise ValueError(f'Неизвестный узел: {scope}')
+    return qs.select_related('category', 'contractor').order_by('-date', '-id')
+
+
+@traced()
+def get_transactions_totals(transactions):
+    """Итоги по доходам и расходам для шапки списка транзакций (один запрос)"""
+    totals = transactions.aggregate(
+        income=Sum('amount', filter=Q(transaction_type='income')),
+        expense=Sum('amount', filter=Q(transaction_type='expense')),
+    )
+    # SQLite теряет масштаб DecimalField в SUM - возвращаем копейки явно
+    income = (totals['income'] or Decimal('0')).quantize(Decimal('0.01'))
+    expense = (totals['expense'] or Decimal('0')).quantize(Decimal('0.01'))
+    return {
+        'all_total_income': income,
+        'all_total_expense': expense,
+        'all_total_net': income - expense,
+    }
+
+
+@traced()
+def get_scope_totals(scope, obj):
+    """Итоги узла из кэша; пересчитываются после изменения транзакций или иерархии"""
+    return cached(
+        f'tx_totals_{scope}', (obj.pk, include_archive()), TRANSACTION_SCOPE_DEPENDENCIES,
+        lambda: get_transactions_totals(get_scope_transactions(scope, obj)),
+    )
+
+
+def get_per_page(request, default=TRANSACTIONS_PER_PAGE):
+    """Размер страницы из GET-параметра per_page в разумных пределах"""
+    try:
+        per_page = int(request.GET.get('per_page', default))
+    except Exception:
+        per_page = default
+    return min(max(per_page, 5), 500)
+
+
+@traced()
+def get_transactions_list_context(scope, obj, base_url, page=1, per_page=TRANSACTIONS_PER_PAGE):
+    """Контекст шаблона admin/control/estimate/transactions_list.html"""
+    paginator = Paginator(get_scope_transactions(scope, obj), per_page)
+    context = {
+        'page_obj': paginator.get_page(page),
+        'paginator': paginator,
+        'per_page': per_page,
+        'base_url': base_url,
+        'include_archive': include_archive(),
+    }
+    context.update(get_scope_totals(scope, obj))
+    return context
+
+
+@traced()
+def create_wizard_transactions(items, data, progress=None):
+    """
+    Создать транзакции мастера по данным формы: data - request.POST
+    или словарь с теми же ключами (фоновая задача). Для каждой включенной
+    позиции создается расход и, если отмечен, расход по наценке/откату.
+    Вызывается внутри транзакции БД, возвращает число созданных транзакций.
+    """
+    items = list(items)
+    created_count = 0
+    for index, item in enumerate(items, start=1):
+        if progress:
+            progress(index - 1, len(items))
+        # Проверяем, включена ли позиция
+        if not data.get(f'include_item_{item.id}'):
+            continue
+
+        if data.get(f'include_expense_{item.id}'):
+            expense_amount = data.get(f'expense_amount_{item.id}')
+            expense_category_id = data.get(f'expense_category_{item.id}')
+            expense_contractor_id = data.get(f'expense_contractor_{item.id}')
+
+            if expense_amount and expense_category_id:
+                # Создаем транзакцию расхода
+                Transaction.objects.create(
+                    amount=expense_amount,
+                    transaction_type='expense',
+                    category_id=expense_category_id,
+                    contractor_id=expense_contractor_id if expense_contractor_id else None,
+                    description=f'Расход по смете: {item.get_item_name()}',
+                    estimate_id=item.estimate_id,
+                    estimate_item_id=item.id,
+                )
+                created_count += 1
+
+        if data.get(f'include_income_{item.id}'):
+            income_amount = data.get(f'income_amount_{item.id}')
+            income_category_id = data.get(f'income_category_{item.id}')
+            income_contractor_id = data.get(f'income_contractor_{item.id}')
+
+            if income_amount and income_category_id:
+                # Формируем описание дохода
+                if item.income_type:
+                    description = f'Расход по смете (наценка/откат): {item.get_item_name()} ({item.get_income_display()})'
+                else:
+                    # Дополнительный расход (раньше доход)
+                    income_description = (data.get(f'income_description_{item.id}') or '').strip()
+                    if income_description:
+                        description = f'Дополнительный расход по смете: {item.get_item_name()} - {income_description}'
+                    else:
+                        description = f'Дополнительный расход по смете: {item.get_item_name()}'
+
+                # Создаем как расход (наценки/откаты тоже расходы бюджета)
+                Transaction.objects.create(
+                    amount=income_amount,
+                    transaction_type='expense',
+                    category_id=income_category_id,
+                    contractor_id=income_contractor_id if income_contractor_id else None,
+                    description=description,
+                    estimate_id=item.estimate_id,
+                    estimate_item_id=item.id,
+                )
+                created_count += 1
+    return created_count
+
+
+def _run_read_query(func, *args):
+    """
+    Выполнить читающий запрос в отдельном потоке со своим соединением,
+    чтобы несколько запросов одного async-представления шли параллельно
+    """
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+
+def _get_transactions_page(scope, obj, page, per_page):
+    paginator = Paginator(get_scope_transactions(scope, obj), per_page)
+    page_obj = paginator.get_page(page)
+    # Выполняем запрос страницы здесь, а не при рендере шаблона
+    page_obj.object_list = list(page_obj.object_list)
+    return paginator, page_obj
+
+
+async def aget_transactions_list_context(scope, obj, base_url, page=1, per_page=TRANSACTIONS_PER_PAGE):
+    """
+    Асинхронный вариант get_transactions_list_context: итоги узла
+    и страница транзакций (COUNT + выборка) запрашиваются одновременно
+    """
+    run = sync_to_async(_run_read_query, thread_sensitive=False)
+    totals, (paginator, page_obj) = await asyncio.gather(
+        run(get_scope_totals, scope, obj),
+        run(_get_transactions_page, scope, obj, page, per_page),
+    )
+    context = {
+        'page_obj': page_obj,
+        'paginator': paginator,
+        'per_page': per_page,
+        'base_url': base_url,
+        'include_archive': include_archive(),
     }
+    context.update(totals)
+    return context
+
+
+@traced()
+def get_transaction_form_options():
+    """
+    Списки выбора для мастера создания транзакций: [[id, название], ...]
+    для активных категорий и контрагентов. Передаются на страницу один раз
+    (json_script), кэшируются до изменения категорий или пользователей.
+    """
+    def compute():
+        categories = [
+            [pk, name]
+            for pk, name in Category.objects.filter(is_active=True).order_by('name').values_list('id', 'name')
+        ]
+        contractors = []
+        rows = CustomUser.objects.filter(is_active=True).order_by('last_name', 'first_name')\
+            .values_list('id', 'last_name', 'first_name', 'phone')
+        for pk, last_name, first_name, phone in rows:
+            # То же представление, что и CustomUser.__str__
+            label = f"{last_name or ''} {first_name or ''}".strip() if (last_name or first_name) else phone
+            contractors.append([pk, label])
+        return {'categories': categories, 'contractors': contractors}
+
+    return cached('transaction_form_options', (), ('control.Category', 'control.CustomUser'), compute)
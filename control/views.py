@@ -1,15 +1,43 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_permission_codename
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, JsonResponse
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from .models import PriceItem
+from .cache import acached
+from .models import Estimate, EstimateItem, Object, PriceItem, Project, Stage
 import json
 
 # Create your views here.
 
+async def _get_price_item_payload(price_item_id):
+    """Данные прайсовой позиции; кэшируются до изменения прайса или справочников"""
+    async def compute():
+        price_item = await PriceItem.objects.select_related('material', 'work_type').aget(id=price_item_id)
+        return {
+            'id': price_item.id,
+            'name': price_item.name,
+            'unit': price_item.unit,
+            'price_per_unit': float(price_item.price_per_unit),
+            'material': price_item.material.name if price_item.material else None,
+            'work_type': price_item.work_type.name if price_item.work_type else None,
+        }
+    return await acached(
+        'price_item_data', (price_item_id,),
+        ('control.PriceItem', 'control.MaterialType', 'control.WorkType'),
+        compute,
+    )
+
+
 @csrf_exempt
 @require_http_methods(["GET"])
-def get_price_item_data(request):
+async def get_price_item_data(request):
     """API для получения данных прайсовой позиции по ID"""
     price_item_id = request.GET.get('id')
     
@@ -17,16 +45,328 @@ def get_price_item_data(request):
         return JsonResponse({'error': 'ID не указан'}, status=400)
     
     try:
-        price_item = PriceItem.objects.get(id=price_item_id)
-        return JsonResponse({
-            'id': price_item.id,
-            'name': price_item.name,
-            'unit': price_item.unit,
-            'price_per_unit': float(price_item.price_per_unit),
-            'material': price_item.material.name if price_item.material else None,
-            'work_type': price_item.work_type.name if price_item.work_type else None,
-        })
+        return JsonResponse(await _get_price_item_payload(int(price_item_id)))
+    except ValueError:
+        return JsonResponse({'error': 'Некорректный ID'}, status=400)
     except PriceItem.DoesNotExist:
         return JsonResponse({'error': 'Позиция не найдена'}, status=404)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+
+def sqlite_diagnostics_view(request):
+    """Диагностика SQLite: активные PRAGMA, размер WAL и горячие копии (подключается через admin_view)"""
+    from datetime import datetime
+    from django.conf import settings
+    from django.contrib import admin, messages
+    from django.shortcuts import redirect
+    from django.utils import timezone
+    from .backup import sqlite_backup_files
+    from .db import sqlite_status
+    from django.core.exceptions import PermissionDenied
+    from .jobs import can_enqueue, enqueue
+
+    if request.method == 'POST' and request.POST.get('backup'):
+        if not can_enqueue(request.user, 'sqlite_backup'):
+            raise PermissionDenied
+        job = enqueue('sqlite_backup', {}, user=request.user)
+        messages.info(request, f'Задача резервного копирования #{job.pk} поставлена в очередь.')
+        return redirect(reverse('admin:control_backgroundjob_change', args=[job.pk]))
+    backups = [
+        {'name': path.name, 'created': datetime.fromtimestamp(mtime, tz=timezone.get_current_timezone()), 'size': size}
+        for path, mtime, size in sqlite_backup_files()
+    ]
+    context = dict(
+        admin.site.each_context(request),
+        title='Диагностика SQLite',
+        status=sqlite_status(),
+        backups=backups,
+        backup_dir=settings.SQLITE_BACKUP_DIR,
+        backup_keep=settings.SQLITE_BACKUP_KEEP,
+        backup_max_age_days=settings.SQLITE_BACKUP_MAX_AGE_DAYS,
+        backup_interval_hours=settings.SQLITE_BACKUP_INTERVAL_HOURS,
+    )
+    return render(request, 'admin/control/diagnostics/sqlite.html', context)
+
+
+@require_http_methods(["POST"])
+def archive_toggle_view(request):
+    """
+    Показать/скрыть архивные транзакции в списках и итогах (флаг в сессии,
+    подключается через admin_view). Только POST: меняет состояние сессии.
+    """
+    from django.shortcuts import redirect
+    from django.utils.http import url_has_allowed_host_and_scheme
+    from .archive import SESSION_KEY, include_archive
+
+    request.session[SESSION_KEY] = not include_archive()
+    next_url = request.GET.get('next') or request.META.get('HTTP_REFERER')
+    if not next_url or not url_has_allowed_host_and_scheme(next_url, {request.get_host()}, request.is_secure()):
+        next_url = reverse('admin:index')
+    return redirect(next_url)
+
+
+def periods_view(request):
+    """Закрытие периодов (право control.close_period) и остатки на дату (подключается через admin_view)"""
+    from datetime import date
+    from django.contrib import admin, messages
+    from django.shortcuts import redirect
+    from django.utils import timezone
+    from .models import Category, ClosedPeriod, CustomUser, Object, Project, Stage
+    from django.core.exceptions import PermissionDenied
+    from .periods import DIMENSIONS, balances_as_of, close_period, reopen_last_period
+
+    can_close = request.user.has_perm('control.close_period')
+    if request.method == 'POST':
+        if not can_close:
+            raise PermissionDenied
+        try:
+            if request.POST.get('reopen'):
+                period = reopen_last_period()
+                if period is not None:
+                    messages.info(request, f'Период {period} открыт.')
+            else:
+                period = close_period(request.POST.get('period', ''), user=request.user)
+                messages.info(request, f'Период {period} закрыт: транзакций за период {period.transactions_count}.')
+        except ValueError as e:
+            messages.error(request, str(e))
+        return redirect(reverse('control_periods'))
+
+    try:
+        as_of = date.fromisoformat(request.GET['as_of']) if request.GET.get('as_of') else timezone.localdate()
+    except ValueError:
+        as_of = timezone.localdate()
+    dimension = request.GET.get('group') if request.GET.get('group') in DIMENSIONS else 'project'
+    rows, start_period = balances_as_of(as_of, (dimension,))
+    # Названия разрезов одним запросом на модель
+    models_by_dimension = {
+        'project': Project, 'object': Object, 'stage': Stage, 'category': Category, 'contractor': CustomUser,
+    }
+    names = models_by_dimension[dimension]._default_manager.in_bulk([row[dimension] for row in rows if row[dimension]])
+    for row in rows:
+        row['name'] = str(names[row[dimension]]) if row[dimension] in names else '—'
+    rows.sort(key=lambda row: row['name'])
+    context = dict(
+        admin.site.each_context(request),
+        title='Периоды и остатки',
+        periods=ClosedPeriod.objects.select_related('closed_by')[:24],
+        can_close=can_close,
+        rows=rows,
+        as_of=as_of,
+        group=dimension,
+        start_period=start_period,
+        totals={key: sum(row[key] for row in rows) for key in ('count', 'income', 'expense', 'balance')},
+    )
+    return render(request, 'admin/control/reports/periods.html', context)
+
+
+def pnl_view(request):
+    """План-факт по проектам, объектам и этапам; ?format=csv|xlsx - выгрузка (подключается через admin_view)"""
+    from django.contrib import admin
+    from django.http import HttpResponse
+    from . import metrics
+    from .exports import XLSX_CONTENT_TYPE, xlsx_available
+    from .models import Project
+    from .reports import profit_and_loss, render_pnl_csv, render_pnl_xlsx
+
+    try:
+        project_id = int(request.GET['project']) if request.GET.get('project') else None
+    except ValueError:
+        project_id = None
+    approved_only = bool(request.GET.get('approved'))
+    report = profit_and_loss(project_id, approved_only)
+    export_format = request.GET.get('format')
+    if export_format == 'xlsx':
+        if not xlsx_available():
+            return HttpResponse('xlsxwriter не установлен', status=500)
+        metrics.inc('pnl_exports_total', format='xlsx')
+        response = HttpResponse(render_pnl_xlsx(report), content_type=XLSX_CONTENT_TYPE)
+        response['Content-Disposition'] = 'attachment; filename="pnl.xlsx"'
+        return response
+    if export_format == 'csv':
+        metrics.inc('pnl_exports_total', format='csv')
+        response = HttpResponse(render_pnl_csv(report), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="pnl.csv"'
+        return response
+    query = request.GET.copy()
+    query.pop('format', None)
+    context = dict(
+        admin.site.each_context(request),
+        title='План-факт',
+        report=report,
+        projects=Project._default_manager.order_by('name').values_list('id', 'name'),
+        project_id=project_id,
+        approved_only=approved_only,
+        query=query.urlencode(),
+    )
+    return render(request, 'admin/control/reports/pnl.html', context)
+
+
+def cash_flow_view(request):
+    """Денежный поток по категориям и месяцам; ?format=csv - выгрузка (подключается через admin_view)"""
+    from datetime import date
+    from django.contrib import admin
+    from django.http import HttpResponse
+    from django.utils import timezone
+    from . import metrics
+    from .models import Project
+    from .reports import CASH_FLOW_MEASURES, cash_flow, render_cash_flow_csv
+
+    def parse_month(value, default):
+        try:
+            return date.fromisoformat(f'{value}-01') if value else default
+        except ValueError:
+            return default
+
+    today = timezone.localdate().replace(day=1)
+    last_month = parse_month(request.GET.get('to'), today)
+    # По умолчанию - последние 12 месяцев
+    months = last_month.year * 12 + last_month.month - 12
+    first_month = parse_month(request.GET.get('from'), date(months // 12, months % 12 + 1, 1))
+    if first_month > last_month:
+        first_month, last_month = last_month, first_month
+    try:
+        project_id = int(request.GET['project']) if request.GET.get('project') else None
+    except ValueError:
+        project_id = None
+    measure = request.GET.get('measure') if request.GET.get('measure') in CASH_FLOW_MEASURES else 'net'
+    report = cash_flow(first_month, last_month, project_id)
+    if request.GET.get('format') == 'csv':
+        metrics.inc('cash_flow_exports_total', format='csv')
+        response = HttpResponse(render_cash_flow_csv(report, measure), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="cash_flow_{first_month:%Y-%m}_{last_month:%Y-%m}.csv"'
+        return response
+    query = request.GET.copy()
+    query.pop('format', None)
+    context = dict(
+        admin.site.each_context(request),
+        title='Денежный поток',
+        report=report,
+        rows=[(category, category[measure], category['totals'][measure]) for category in report['categories']],
+        measures=CASH_FLOW_MEASURES.items(),
+        measure=measure,
+        first_month=first_month,
+        last_month=last_month,
+        projects=Project._default_manager.order_by('name').values_list('id', 'name'),
+        project_id=project_id,
+        query=query.urlencode(),
+    )
+    return render(request, 'admin/control/reports/cash_flow.html', context)
+
+
+def profiles_view(request):
+    """Последние профили запросов из кольцевого буфера процесса"""
+    from django.conf import settings
+    from django.contrib import admin
+    from django.shortcuts import redirect
+    from .profiling import clear_profiles, get_profiles
+
+    # В профилях - SQL с параметрами чужих запросов: только суперпользователям
+    if not request.user.is_superuser:
+        raise PermissionDenied
+    if request.method == 'POST' and request.POST.get('clear'):
+        clear_profiles()
+        return redirect(reverse('control_profiles'))
+    context = dict(
+        admin.site.each_context(request),
+        title='Профили запросов',
+        profiles=get_profiles(),
+        sample_rate=settings.PROFILER_SAMPLE_RATE,
+        buffer_size=settings.PROFILER_BUFFER_SIZE,
+    )
+    return render(request, 'admin/control/diagnostics/profiles.html', context)
+
+
+def profile_detail_view(request, profile_id):
+    """Профиль одного запроса: медленные SQL и повторяющиеся формы запросов"""
+    from django.contrib import admin
+    from .profiling import get_profile
+
+    if not request.user.is_superuser:
+        raise PermissionDenied
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise Http404('Профиль вытеснен из буфера')
+    context = dict(
+        admin.site.each_context(request),
+        title=f'Профиль #{profile_id}',
+        profile=profile,
+    )
+    return render(request, 'admin/control/diagnostics/profile_detail.html', context)
+
+
+@never_cache
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """Метрики Prometheus: токен METRICS_TOKEN или сессия сотрудника"""
+    import hmac
+    from django.conf import settings
+    from django.http import HttpResponse
+    from .metrics import render_metrics
+
+    if not settings.METRICS_ENABLED:
+        raise Http404('Метрики выключены')
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip() or request.GET.get('token', '')
+    # Байты, а не str: compare_digest падает на не-ASCII строках (токен из заголовка или URL)
+    token_ok = bool(settings.METRICS_TOKEN) and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode())
+    if not token_ok and not (request.user.is_active and request.user.is_staff):
+        return HttpResponse('Нужен токен или вход сотрудника', status=401, content_type='text/plain; charset=utf-8')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def async_staff_member_required(view_func):
+    """
+    Аналог admin_site.admin_view для async-представлений: пускает только
+    активных сотрудников, остальных отправляет на страницу входа в админку
+    """
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not (user.is_active and user.is_staff):
+            return redirect_to_login(request.get_full_path(), reverse('admin:login'))
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+# Узлы иерархии, для которых есть список транзакций (scope -> модель)
+TRANSACTION_SCOPES = {
+    'estimate': Estimate,
+    'estimateitem': EstimateItem,
+    'stage': Stage,
+    'object': Object,
+    'project': Project,
+}
+
+
+@never_cache
+@require_http_methods(["GET"])
+@async_staff_member_required
+async def transactions_list_async_view(request, scope, pk):
+    """Страница списка транзакций узла (AJAX-пагинация) без блокировки воркера"""
+    from .utils import aget_transactions_list_context, get_per_page
+
+    model = TRANSACTION_SCOPES.get(scope)
+    if model is None:
+        raise Http404('Неизвестный узел')
+    try:
+        obj = await model._default_manager.aget(pk=pk)
+    except model.DoesNotExist:
+        raise Http404('Объект не найден')
+    # Те же права, что у страниц админки: просмотр транзакций и самого узла.
+    # Проверка прав ходит в БД - только через sync_to_async
+    user = await request.auser()
+    opts = model._meta
+    can_view = await sync_to_async(user.has_perms)([
+        'control.view_transaction', f'{opts.app_label}.{get_permission_codename("view", opts)}',
+    ])
+    if not can_view:
+        raise PermissionDenied
+
+    context = await aget_transactions_list_context(
+        scope, obj, reverse('control_transactions_list_async', args=[scope, pk]),
+        page=request.GET.get('page') or 1,
+        per_page=get_per_page(request),
+    )
+    if scope == 'estimate':
+        context['estimate'] = obj
+    return render(request, 'admin/control/estimate/transactions_list.html', context)